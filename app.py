@@ -1,10 +1,13 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 # from engine import WorkFlow, WorkFlowEngine
-import os
-import json
+from uploads import uploads, OffsetMismatch, CHUNK_SIZE
+import re
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
 
 class WizFlowBlueprint(BaseModel):
     blueprint: str
@@ -13,6 +16,12 @@ class CreateDirectory(BaseModel):
     workflowID: str
     userID: str
 
+class CreateUpload(BaseModel):
+    workflowID: str
+    userID: str
+    filename: str
+    size: int
+
 
 app = FastAPI(
     title="WizFlow API",
@@ -39,11 +48,7 @@ async def read_root():
 
 @app.post("/api/v1/directory")
 async def create_directory(directory: CreateDirectory):
-    base_dir = "uploads"
-    user_dir = os.path.join(base_dir, directory.userID)
-    workflow_dir = os.path.join(user_dir, directory.workflowID)
-    
-    os.makedirs(workflow_dir, exist_ok=True)
+    uploads.workflow_dir(directory.userID, directory.workflowID)
 
     return JSONResponse({
         "message": "Directory created successfully",
@@ -56,23 +61,88 @@ async def upload_file(
     workflowID: str = Form(...),
     userID: str = Form(...)
 ):
-    contents = await file.read()
-
-    base_dir = "uploads"
-    user_dir = os.path.join(base_dir, userID)
-    workflow_dir = os.path.join(user_dir, workflowID)
-    
-    os.makedirs(workflow_dir, exist_ok=True)
-    
-    file_path = os.path.join(workflow_dir, file.filename)
-
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    # copied and hashed in chunks on a worker thread, never held in memory
+    stored = await run_in_threadpool(uploads.put_stream, file.file, userID, workflowID, file.filename)
 
     return JSONResponse({
         "filename": file.filename,
-        "saved_path": file_path,
         "content_type": file.content_type,
+        **stored,
         "message": "File uploaded successfully",
         "status_code": 200
-    })
\ No newline at end of file
+    })
+
+@app.post("/api/v1/uploads")
+async def create_upload(upload: CreateUpload):
+    try:
+        upload_id = uploads.create(upload.userID, upload.workflowID, upload.filename, upload.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({"upload_id": upload_id, "offset": 0, "status_code": 200})
+
+def _upload_session(upload_id):
+    try:
+        return uploads.session(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown upload {upload_id}")
+
+@app.get("/api/v1/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    session = await run_in_threadpool(_upload_session, upload_id)
+    return JSONResponse(
+        {"upload_id": upload_id, "offset": session.offset, "size": session.size, "status_code": 200},
+        headers={"Upload-Offset": str(session.offset)},
+    )
+
+def _request_offset(request):
+    content_range = request.headers.get("content-range")
+    if content_range:
+        m = CONTENT_RANGE.fullmatch(content_range.strip())
+        if not m:
+            raise HTTPException(status_code=400, detail="Malformed Content-Range")
+        return int(m.group(1))
+    offset = request.headers.get("upload-offset")
+    if offset is None or not offset.isdigit():
+        raise HTTPException(status_code=400, detail="Content-Range or Upload-Offset header required")
+    return int(offset)
+
+@app.put("/api/v1/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    """
+    Append the request body at the given offset. A dropped transfer resumes
+    from the offset reported by GET; a mismatched offset gets 409 with the
+    offset the server has.
+    """
+    offset = _request_offset(request)
+    await run_in_threadpool(_upload_session, upload_id)
+    try:
+        session = uploads.begin(upload_id, offset)
+    except OffsetMismatch as e:
+        return JSONResponse({"detail": str(e), "offset": e.offset, "status_code": 409},
+                            status_code=409, headers={"Upload-Offset": str(e.offset)})
+    try:
+        buf = bytearray()
+        async for chunk in request.stream():
+            buf += chunk
+            if len(buf) >= CHUNK_SIZE:
+                await run_in_threadpool(session.write, bytes(buf))
+                buf.clear()
+        if buf:
+            await run_in_threadpool(session.write, bytes(buf))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        # whatever arrived before a disconnect is kept for the next attempt
+        stored = await run_in_threadpool(uploads.end, session)
+    if stored is None:
+        return JSONResponse({"upload_id": upload_id, "offset": session.offset, "status_code": 200},
+                            headers={"Upload-Offset": str(session.offset)})
+    return JSONResponse({**stored, "message": "File uploaded successfully", "status_code": 200})
+
+@app.delete("/api/v1/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    try:
+        await run_in_threadpool(uploads.abort, upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown upload {upload_id}")
+    return JSONResponse({"message": "Upload aborted", "status_code": 200})
\ No newline at end of file
@@ -0,0 +1,471 @@
+import os
+import time
+import queue
+import asyncio
+import sqlite3
+import fnmatch
+import threading
+import redis
+from dotenv import load_dotenv
+import logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# redis (default), memory or sqlite
+BACKEND = os.getenv("WIZFLOW_BACKEND", "redis").lower()
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+SQLITE_PATH = os.getenv("WIZFLOW_SQLITE_PATH", os.path.join("runs", "wizflow.db"))
+
+BackendError = (redis.RedisError, sqlite3.Error)
+
+# commands a pipeline can queue on the local backends
+PIPELINE_COMMANDS = {"get", "set", "mget", "delete", "hset", "hget", "hgetall", "hdel", "publish"}
+
+
+def _stored(value):
+    # string values are kept as text like Redis would return them decoded;
+    # binary values (cache records) stay bytes
+    return value if isinstance(value, bytes) else str(value)
+
+
+class Broker:
+    """
+    In-process pub/sub with Redis semantics: exact channel subscriptions and
+    glob patterns. Messages reach subscribers in this process only.
+    """
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def attach(self, sub):
+        with self.lock:
+            self.subscribers.add(sub)
+
+    def detach(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subs = list(self.subscribers)
+        return sum(sub._deliver(channel, message) for sub in subs)
+
+
+class _Subscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.patterns = set()
+
+    def _match(self, channel, message):
+        if channel in self.channels:
+            return {"type": "message", "pattern": None, "channel": channel, "data": message}
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(channel, pattern):
+                return {"type": "pmessage", "pattern": pattern, "channel": channel, "data": message}
+        return None
+
+
+class LocalPubSub(_Subscription):
+    """
+    Blocking subscriber for Broker, shaped like redis.client.PubSub.
+    """
+    def __init__(self, broker, ignore_subscribe_messages=False):
+        super().__init__(broker)
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.queue = queue.Queue()
+
+    def _deliver(self, channel, message):
+        msg = self._match(channel, message)
+        if msg is None:
+            return False
+        self.queue.put(msg)
+        return True
+
+    def _subscribed(self, kind, names):
+        self.broker.attach(self)
+        if not self.ignore_subscribe_messages:
+            for name in names:
+                self.queue.put({"type": kind, "pattern": None, "channel": name, "data": 1})
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+        self._subscribed("subscribe", channels)
+
+    def psubscribe(self, *patterns):
+        self.patterns.update(patterns)
+        self._subscribed("psubscribe", patterns)
+
+    def unsubscribe(self, *channels):
+        self.channels.difference_update(channels or set(self.channels))
+
+    def punsubscribe(self, *patterns):
+        self.patterns.difference_update(patterns or set(self.patterns))
+
+    def get_message(self, timeout=0.0):
+        try:
+            return self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def listen(self):
+        while True:
+            yield self.queue.get()
+
+    def close(self):
+        self.broker.detach(self)
+        self.channels.clear()
+        self.patterns.clear()
+
+    reset = close
+
+
+class LocalAsyncPubSub(_Subscription):
+    """
+    asyncio subscriber for Broker, shaped like redis.asyncio.client.PubSub.
+    Publishers on other threads hand messages over to the subscriber's loop.
+    """
+    def __init__(self, broker):
+        super().__init__(broker)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def _deliver(self, channel, message):
+        msg = self._match(channel, message)
+        if msg is None:
+            return False
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, msg)
+        return True
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+        self.broker.attach(self)
+
+    async def psubscribe(self, *patterns):
+        self.patterns.update(patterns)
+        self.broker.attach(self)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def reset(self):
+        self.broker.detach(self)
+        self.channels.clear()
+        self.patterns.clear()
+
+    close = reset
+
+
+class LocalAsyncClient:
+    """
+    What the WebSocket server needs from redis.asyncio.Redis (pubsub only)
+    for the in-process backends.
+    """
+    def __init__(self, broker):
+        self.broker = broker
+
+    def pubsub(self):
+        return LocalAsyncPubSub(self.broker)
+
+    async def close(self):
+        pass
+
+
+class LocalPipeline:
+    """
+    Queues commands and runs them in one batch on execute(): under one lock
+    for the memory backend, in one transaction for SQLite.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.commands = []
+
+    def __getattr__(self, name):
+        if name not in PIPELINE_COMMANDS:
+            raise AttributeError(name)
+        def queue_command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue_command
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return self.backend._execute(commands)
+
+
+class MemoryBackend:
+    """
+    State, cache and events in plain dicts for single-process runs: no
+    command ever leaves the process. Nothing survives a restart.
+    """
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.broker = Broker()
+        self.lock = threading.RLock()
+
+    def _live(self, key):
+        entry = self.strings.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.strings[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._live(key)
+
+    def mget(self, keys):
+        with self.lock:
+            return [self._live(k) for k in keys]
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.strings[key] = (_stored(value), None if ex is None else time.monotonic() + ex)
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum((self.strings.pop(k, None) is not None) + (self.hashes.pop(k, None) is not None)
+                       for k in keys)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self.lock:
+            h = self.hashes.setdefault(name, {})
+            added = sum(f not in h for f in items)
+            h.update((f, str(v)) for f, v in items.items())
+        return added
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.hashes.get(name, {}).get(key)
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            h = self.hashes.get(name, {})
+            return sum(h.pop(k, None) is not None for k in keys)
+
+    def publish(self, channel, message):
+        return self.broker.publish(channel, message)
+
+    def pipeline(self, transaction=False):
+        return LocalPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return LocalPubSub(self.broker, ignore_subscribe_messages)
+
+    def _execute(self, commands):
+        with self.lock:
+            return [getattr(self, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class SqliteBackend:
+    """
+    State and cache in a SQLite database in WAL mode, for durable
+    single-box deployments. Events go through the in-process Broker, so
+    subscribers must live in the process that runs the workflows (the
+    WebSocket server does). A pipeline is one transaction; its events are
+    published after the commit. Expired keys are hidden on read and purged
+    by writes, at most once every PURGE_INTERVAL seconds.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)",
+        "CREATE TABLE IF NOT EXISTS hashes (name TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL,"
+        " PRIMARY KEY (name, field)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires) WHERE expires IS NOT NULL",
+    )
+    MAX_VARIABLES = 500
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for stmt in self.SCHEMA:
+            self.conn.execute(stmt)
+        self.broker = Broker()
+        self.lock = threading.RLock()
+        self.deferred = None
+        self.purged = 0.0
+
+    def _purge_expired(self, now):
+        if now - self.purged < self.PURGE_INTERVAL:
+            return
+        self.purged = now
+        self.conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+
+    def _value(self, row):
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._value(self.conn.execute(
+                "SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone())
+
+    def mget(self, keys):
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), self.MAX_VARIABLES):
+                chunk = keys[i:i + self.MAX_VARIABLES]
+                rows = self.conn.execute(
+                    f"SELECT key, value, expires FROM kv WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, value, expires in rows:
+                    found[key] = self._value((value, expires))
+        return [found.get(k) for k in keys]
+
+    def set(self, key, value, ex=None):
+        now = time.time()
+        with self.lock:
+            self._purge_expired(now)
+            self.conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                              (key, _stored(value), None if ex is None else now + ex))
+        return True
+
+    def delete(self, *keys):
+        deleted = 0
+        with self.lock:
+            for key in keys:
+                deleted += self.conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+                deleted += self.conn.execute("DELETE FROM hashes WHERE name = ?", (key,)).rowcount > 0
+        return deleted
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                                  [(name, f, str(v)) for f, v in items.items()])
+        return len(items)
+
+    def hget(self, name, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM hashes WHERE name = ? AND field = ?",
+                                    (name, key)).fetchone()
+        return row[0] if row else None
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.conn.execute("SELECT field, value FROM hashes WHERE name = ?", (name,)))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            return sum(self.conn.execute("DELETE FROM hashes WHERE name = ? AND field = ?",
+                                         (name, k)).rowcount for k in keys)
+
+    def publish(self, channel, message):
+        if self.deferred is not None:
+            self.deferred.append((channel, message))
+            return 0
+        return self.broker.publish(channel, message)
+
+    def pipeline(self, transaction=False):
+        return LocalPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return LocalPubSub(self.broker, ignore_subscribe_messages)
+
+    def _execute(self, commands):
+        with self.lock:
+            self.deferred = []
+            try:
+                self.conn.execute("BEGIN")
+                try:
+                    results = [getattr(self, name)(*args, **kwargs) for name, args, kwargs in commands]
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                self.conn.execute("COMMIT")
+                events = self.deferred
+            finally:
+                self.deferred = None
+        for channel, message in events:
+            self.broker.publish(channel, message)
+        return results
+
+
+_redis_pool = None
+_redis_lock = threading.Lock()
+
+def redis_client():
+    """
+    A Redis client on the process-wide connection pool. Distributed runs
+    (dispatch.py, worker.py) always use Redis, whatever the backend.
+    """
+    global _redis_pool
+    with _redis_lock:
+        if _redis_pool is None:
+            _redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                                               decode_responses=True)
+    return redis.Redis(connection_pool=_redis_pool)
+
+class RawReader:
+    """
+    Binary reads over a decoding Redis client's own connection pool: the
+    replies skip decoding per command instead of needing a second pool.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.execute_command("GET", key, NEVER_DECODE=True)
+
+    def mget(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self.client.execute_command("MGET", *keys, NEVER_DECODE=True)
+
+def raw_client(client):
+    """
+    A reader on the same store whose replies are not decoded, for binary
+    values. The local backends already hand bytes back as they were set.
+    """
+    if getattr(client, "connection_pool", None) is None:
+        return client
+    return RawReader(client)
+
+def create_backend(kind=BACKEND):
+    if kind == "redis":
+        return redis_client()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SqliteBackend()
+    raise ValueError(f"Unknown WIZFLOW_BACKEND '{kind}' (expected redis, memory or sqlite)")
+
+def async_client():
+    """
+    Client for event subscriptions in the WebSocket server.
+    """
+    if BACKEND == "redis":
+        from redis.asyncio import Redis
+        return Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    return LocalAsyncClient(r.broker)
+
+
+r = create_backend()
+logger.debug(f"Using {BACKEND} backend")
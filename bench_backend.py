@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import redis
+from backend import MemoryBackend, SqliteBackend, redis_client
+from cache import ResultCache
+from store import StateWriter
+
+
+def simulate(b, n):
+    """
+    The backend traffic of n uncached tasks: a cache lookup, RUNNING and
+    COMPLETED status updates and the cache/manifest/duration write.
+    """
+    writer = StateWriter(b)
+    cache = ResultCache(b)
+    wf = "bench_backend"
+    start = time.perf_counter()
+    for i in range(n):
+        key = f"bench-{time.time_ns()}-{i}"
+        cache.get(key)
+        writer.set_task_status(wf, f"t{i}", "RUNNING")
+        pipe = b.pipeline(transaction=False)
+        cache.put(key, {"out": i}, pipe=pipe)
+        pipe.hset(f"{wf}:cache:manifest", f"t{i}", key)
+        pipe.hset(f"{wf}:cache:durations", f"t{i}", json.dumps([0.1]))
+        pipe.execute()
+        writer.set_task_status(wf, f"t{i}", "COMPLETED")
+    writer.flush()
+    return time.perf_counter() - start
+
+def backends():
+    yield "memory", MemoryBackend()
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    yield "sqlite", SqliteBackend(path)
+    client = redis_client()
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        print(f"redis   skipped ({e})")
+        return
+    yield "redis", client
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-task backend overhead")
+    parser.add_argument("--tasks", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, b in backends():
+        elapsed = simulate(b, args.tasks)
+        print(f"{name:<7} {elapsed / args.tasks * 1e6:8.1f} us / task")
+
+if __name__ == "__main__":
+    main()
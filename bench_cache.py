@@ -0,0 +1,100 @@
+import argparse
+import glob
+import json
+import random
+import time
+import cache
+from cache import encode_record, decode_record
+from utils import compute_hash
+
+
+def rest_document(rnd, size):
+    """
+    A REST-style JSON document of roughly `size` bytes: a page of records
+    with ids, text, numbers and nested fields.
+    """
+    items = []
+    doc = {"status": "ok", "page": 1, "items": items}
+    length = 0
+    while length < size:
+        item = {
+            "id": f"{rnd.getrandbits(64):016x}",
+            "name": f"resource-{len(items)}",
+            "score": round(rnd.random() * 100, 3),
+            "active": rnd.random() < 0.8,
+            "tags": rnd.sample(["alpha", "beta", "gamma", "delta", "prod", "dev"], 2),
+            "owner": {"id": rnd.randint(1, 500), "region": rnd.choice(["us-east", "eu-west", "ap-south"])},
+        }
+        items.append(item)
+        length += len(json.dumps(item))
+    return doc
+
+def synthetic_outputs(task, rnd, rest_bytes):
+    outputs = {}
+    for name, spec in task.get("outputs", {}).items():
+        typ = spec.get("type")
+        if typ == "json":
+            outputs[name] = rest_document(rnd, rest_bytes)
+        elif typ == "file":
+            outputs[name] = spec["path"]
+        else:
+            outputs[name] = "\n".join(f"line {i}: {rnd.getrandbits(32):08x}" for i in range(20))
+    if not outputs and task.get("type") == "RESTAPI":
+        outputs["response"] = rest_document(rnd, rest_bytes)
+    return outputs
+
+def sample_records(paths, rest_bytes):
+    rnd = random.Random(0)
+    records = []
+    for path in paths:
+        with open(path) as f:
+            workflow = json.load(f)
+        for task in workflow.get("tasks", []):
+            records.append((compute_hash(task), synthetic_outputs(task, rnd, rest_bytes)))
+    return records
+
+def legacy_encode(key, outputs):
+    data = json.dumps(outputs)
+    return data, len(data)
+
+def legacy_decode(key, data):
+    return json.loads(data)
+
+def measure(records, encode, decode, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        stored = [encode(key, outputs)[0] for key, outputs in records]
+    encode_time = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for (key, _), data in zip(records, stored):
+            decode(key, data)
+    decode_time = (time.perf_counter() - start) / repeat
+    return sum(len(d) for d in stored), encode_time, decode_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache record size and encode/decode time on the sample workflows")
+    parser.add_argument("--rest-kb", type=int, default=64, help="size of synthetic REST JSON outputs")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("workflows", nargs="*")
+    args = parser.parse_args()
+
+    paths = args.workflows or sorted(glob.glob("*.json"))
+    records = sample_records(paths, args.rest_kb * 1024)
+    codec = "msgpack" if cache.msgpack is not None else "json"
+    print(f"{len(records)} task results from {', '.join(paths)}; payload codec: {codec}")
+    formats = {
+        "legacy json": (legacy_encode, legacy_decode),
+        "record/none": (lambda k, o: encode_record(k, o, "none"), decode_record),
+        "record/zlib": (lambda k, o: encode_record(k, o, "zlib"), decode_record),
+        "record/lzma": (lambda k, o: encode_record(k, o, "lzma"), decode_record),
+    }
+    base = None
+    for name, (encode, decode) in formats.items():
+        size, enc, dec = measure(records, encode, decode, args.repeat)
+        base = base or size
+        print(f"{name:<12} {size:>10} bytes ({size / base:6.1%})  "
+              f"encode {enc / len(records) * 1e6:8.1f} us  decode {dec / len(records) * 1e6:8.1f} us  per record")
+
+if __name__ == "__main__":
+    main()
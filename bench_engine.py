@@ -0,0 +1,46 @@
+import argparse
+import asyncio
+import time
+from engine import WorkflowEngine
+
+def make_workflow(name, width, depth, sleep):
+    tasks = [{"id": "root", "type": "SHELL", "command": "true", "depends_on": []}]
+    for d in range(depth):
+        for w in range(width):
+            parents = ["root"] if d == 0 else [f"t{d - 1}_{w}"]
+            tasks.append({
+                "id": f"t{d}_{w}",
+                "type": "SHELL",
+                "command": f"sleep {sleep}",
+                "depends_on": parents,
+            })
+    # unique version so neither mode is served from the other's cache
+    return {"workflow_name": name, "version": str(time.time_ns()), "tasks": tasks}
+
+def bench_threads(width, depth, sleep, max_workers):
+    engine = WorkflowEngine(make_workflow("bench_threads", width, depth, sleep))
+    start = time.perf_counter()
+    engine.run_parallel(max_workers=max_workers or engine.estimate_max_workers())
+    return time.perf_counter() - start
+
+def bench_async(width, depth, sleep, max_workers):
+    engine = WorkflowEngine(make_workflow("bench_async", width, depth, sleep))
+    start = time.perf_counter()
+    asyncio.run(engine.run_async(max_concurrency=max_workers))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare run_parallel and run_async")
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--sleep", type=float, default=0.2)
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    n = args.width * args.depth + 1
+    for label, fn in (("run_parallel", bench_threads), ("run_async", bench_async)):
+        elapsed = fn(args.width, args.depth, args.sleep, args.max_workers)
+        print(f"{label:<13} {n} tasks in {elapsed:.2f}s ({n / elapsed:.1f} tasks/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+from utils import build_dag, topological_sort, compute_max_threads
+
+
+def synthetic_tasks(n, max_parents=3, window=1000, seed=0):
+    rnd = random.Random(seed)
+    tasks = []
+    for i in range(n):
+        k = min(i, rnd.randint(0, max_parents))
+        parents = rnd.sample(range(max(0, i - window), i), k) if k else []
+        tasks.append({
+            "id": f"task_{i}",
+            "type": "SHELL",
+            "command": f"echo {i}",
+            "depends_on": [f"task_{p}" for p in parents],
+        })
+    return tasks
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def legacy_build_dag(tasks):
+    dag = {t["id"]: [] for t in tasks}
+    indegree = {}
+    nodes = {}
+    for t in tasks:
+        nodes[t["id"]] = t
+        indegree.setdefault(t["id"], 0)
+    for t in tasks:
+        for parent in t.get("depends_on", []):
+            dag[parent].append(t["id"])
+            indegree[t["id"]] = indegree.get(t["id"], 0) + 1
+    return dag, indegree, nodes
+
+def legacy_topological_sort(dag, indegree):
+    q = deque([n for n, deg in indegree.items() if deg == 0])
+    order = []
+    while q:
+        node = q.popleft()
+        order.append(node)
+        for child in dag.get(node, []):
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                q.append(child)
+    return order
+
+def legacy_max_threads(dag, indegree):
+    frontier = deque([n for n, d in indegree.items() if d == 0])
+    width = len(frontier)
+    while frontier:
+        nxt = []
+        while frontier:
+            for child in dag.get(frontier.popleft(), []):
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    nxt.append(child)
+        frontier = deque(nxt)
+        width = max(width, len(frontier))
+    return width
+
+def legacy_descendants(dag, task_id):
+    seen = set()
+    stack = [task_id]
+    while stack:
+        for child in dag.get(stack.pop(), []):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return seen
+
+def load(kind, tasks):
+    """
+    What WorkflowEngine does with the graph at startup, plus one failure.
+    """
+    if kind == "legacy":
+        dag, indegree, nodes = legacy_build_dag(tasks)
+        order = legacy_topological_sort(dag, indegree.copy())
+        width = legacy_max_threads(dag, indegree.copy())
+        blocked = legacy_descendants(dag, order[0])
+        return (dag, indegree, nodes, order), width, len(blocked)
+    dag, nodes = build_dag(tasks)
+    order = topological_sort(dag)
+    width = compute_max_threads(dag)
+    blocked = dag.descendants(order[0])
+    return (dag, nodes, order), width, len(blocked)
+
+def child(kind, n):
+    tasks = synthetic_tasks(n)
+    gc.collect()
+    before = rss_bytes()
+    start = time.perf_counter()
+    graph, width, blocked = load(kind, tasks)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print(json.dumps({"seconds": elapsed, "rss": rss_bytes() - before,
+                      "width": width, "blocked": blocked}))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load time and memory of the task graph")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--child", nargs=2, metavar=("KIND", "N"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], int(args.child[1]))
+        return
+
+    for n in (int(s) for s in args.sizes.split(",")):
+        for kind in ("legacy", "csr"):
+            # a fresh interpreter per run so RSS is not shared between them
+            out = subprocess.run([sys.executable, __file__, "--child", kind, str(n)],
+                                 check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            print(f"{n:>7} tasks  {kind:<6} load {r['seconds'] * 1000:8.1f} ms  "
+                  f"rss +{r['rss'] / 2**20:7.1f} MiB  width {r['width']}  "
+                  f"descendants {r['blocked']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from tasks import execute_rest
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive JSON endpoint. A `fail_rate` share of requests answers 503
+    so retries can be exercised.
+    """
+    protocol_version = "HTTP/1.1"
+    fail_rate = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StandInHandler.lock:
+            StandInHandler.connections += 1
+
+    def do_GET(self):
+        if random.random() < self.fail_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "items": list(range(50))}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_rest(task, cwd=None):
+    resp = requests.request(task["method"], task["url"], headers=task.get("headers", {}),
+                            json=task.get("body"))
+    resp.raise_for_status()
+    return resp.json()
+
+def run_batch(fn, tasks, run_dir, threads):
+    StandInHandler.connections = 0
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for fut in [pool.submit(fn, task, run_dir) for task in tasks]:
+            try:
+                fut.result()
+            except Exception:
+                failed += 1
+    return time.perf_counter() - start, StandInHandler.connections, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="REST tasks against a local stand-in server")
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    StandInHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    tasks = [{
+        "id": f"t{i}",
+        "type": "RESTAPI",
+        "method": "GET",
+        "url": f"{url}/item/{i}",
+        "retries": args.retries,
+        "retry_backoff": 0.01,
+    } for i in range(args.tasks)]
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        for label, fn in (("per-request", legacy_rest), ("pooled", execute_rest)):
+            elapsed, conns, failed = run_batch(fn, tasks, run_dir, args.threads)
+            print(f"{label:<12} {args.tasks} tasks in {elapsed:.2f}s "
+                  f"({args.tasks / elapsed:.0f} tasks/s), {conns} connections, {failed} failed")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import prefork
+from tasks import execute_task
+
+
+def run(tasks, threads, cwd):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        for _ in pool.map(lambda t: execute_task(t, cwd=cwd), tasks):
+            pass
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Short SHELL tasks: fresh /bin/sh per task vs pre-forked workers")
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=prefork.PREFORK_WORKERS)
+    parser.add_argument("--command", default="echo hello")
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp()
+    modes = {
+        "spawn": [{"id": f"t{i}", "type": "SHELL", "command": args.command, "executor": "spawn"}
+                  for i in range(args.tasks)],
+        "prefork": [{"id": f"t{i}", "type": "SHELL", "command": args.command, "executor": "prefork"}
+                    for i in range(args.tasks)],
+        "python": [{"id": f"t{i}", "type": "PYTHON", "callable": "os.path:join", "args": ["a", str(i)]}
+                   for i in range(args.tasks)],
+    }
+    # start the pools outside the timed runs, as a long-lived server would
+    prefork.shell_pool()
+    prefork.python_pool()
+    for name, tasks in modes.items():
+        elapsed = run(tasks, args.threads, cwd)
+        print(f"{name:<8} {args.tasks / elapsed:8.0f} tasks/s  {elapsed / args.tasks * 1e3:6.3f} ms / task")
+
+if __name__ == "__main__":
+    main()
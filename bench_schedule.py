@@ -0,0 +1,21 @@
+import sys
+from main import load_workflow_from_file
+from engine import WorkflowEngine
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} <workflow.json>")
+        sys.exit(1)
+
+    engine = WorkflowEngine(load_workflow_from_file(sys.argv[1]))
+    history = sum(1 for samples in engine.durations.values() if samples)
+    print(f"{engine.wf_key}: {len(engine.nodes)} tasks, {history} with recorded durations")
+    print(f"{'workers':>7} {'fifo':>10} {'critical':>10}")
+    width = engine.estimate_max_workers()
+    for workers in sorted({1, 2, 4, 8, 16, width}):
+        fifo = engine.simulate(workers, policy="fifo")
+        critical = engine.simulate(workers)
+        print(f"{workers:>7} {fifo:>10.2f} {critical:>10.2f}")
+
+if __name__ == "__main__":
+    main()
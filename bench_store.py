@@ -0,0 +1,63 @@
+import argparse
+import json
+import time
+import redis
+import store
+
+round_trips = 0
+_send = redis.connection.Connection.send_packed_command
+
+def counting_send(self, command, check_health=True):
+    global round_trips
+    round_trips += 1
+    return _send(self, command, check_health)
+
+redis.connection.Connection.send_packed_command = counting_send
+
+def legacy_init_workflow(wf_id, task_ids):
+    r = store.r
+    r.hset(f"wf:{wf_id}:tasks", mapping={tid: "PENDING" for tid in task_ids})
+    r.set(f"wf:{wf_id}:status", "PENDING")
+    r.publish(f"wf:{wf_id}:events", json.dumps({"type": "workflow_update", "status": "PENDING"}))
+    for tid in task_ids:
+        r.publish(f"wf:{wf_id}:events", json.dumps({"type": "NODE_UPDATE", "nodeId": tid, "status": "PENDING"}))
+
+def legacy_set_task_status(wf_id, task_id, status):
+    r = store.r
+    r.hset(f"wf:{wf_id}:tasks", task_id, status)
+    r.publish(f"wf:{wf_id}:events", json.dumps({"type": "NODE_UPDATE", "nodeId": task_id, "status": status}))
+
+def legacy_set_workflow_status(wf_id, status):
+    store.r.set(f"wf:{wf_id}:status", status)
+    store.r.publish(f"wf:{wf_id}:events", json.dumps({"type": "workflow_update", "status": status}))
+
+def simulate(wf_id, n, init_workflow, set_task_status, set_workflow_status):
+    global round_trips
+    task_ids = [f"t{i}" for i in range(n)]
+    round_trips = 0
+    start = time.perf_counter()
+    init_workflow(wf_id, task_ids)
+    set_workflow_status(wf_id, "RUNNING")
+    for tid in task_ids:
+        set_task_status(wf_id, tid, "RUNNING")
+        set_task_status(wf_id, tid, "COMPLETED")
+    set_workflow_status(wf_id, "COMPLETED")
+    return round_trips, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Round trips and wall time of state writes")
+    parser.add_argument("--tasks", type=int, default=1000)
+    args = parser.parse_args()
+
+    runs = (
+        ("per-call", legacy_init_workflow, legacy_set_task_status, legacy_set_workflow_status),
+        ("batched", store.init_workflow, store.set_task_status, store.set_workflow_status),
+    )
+    for label, *fns in runs:
+        trips, elapsed = simulate(f"bench_store:{label}", args.tasks, *fns)
+        per_1k = 1000 / args.tasks
+        print(f"{label:<9} {trips * per_1k:8.0f} round trips / 1k tasks  "
+              f"{elapsed * per_1k * 1000:8.1f} ms / 1k tasks")
+
+if __name__ == "__main__":
+    main()
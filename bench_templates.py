@@ -0,0 +1,55 @@
+import argparse
+import time
+from utils import resolve_input_mappings
+from templates import CompiledTask
+
+def make_fan_in(parents, outputs_per_parent, body_fields):
+    results = {
+        f"p{i}": {f"out_{i}_{j}": f"value-{i}-{j}" for j in range(outputs_per_parent)}
+        for i in range(parents)
+    }
+    names = [name for outs in results.values() for name in outs]
+    used = names[::max(1, len(names) // 20)]
+    task = {
+        "id": "fan_in",
+        "type": "RESTAPI",
+        "method": "POST",
+        "url": "https://api.example.com/items/{{" + used[0] + "}}",
+        "command": " ".join("{{" + n + "}}" for n in used),
+        "headers": {f"X-Header-{i}": "{{" + n + "}}" for i, n in enumerate(used[:10])},
+        "body": {
+            "items": [
+                {"id": i, "label": "{{" + used[i % len(used)] + "}}" if i % 10 == 0 else f"static-{i}"}
+                for i in range(body_fields)
+            ],
+        },
+        "depends_on": list(results),
+    }
+    return task, results
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled templates vs resolve_input_mappings")
+    parser.add_argument("--parents", type=int, default=200)
+    parser.add_argument("--outputs", type=int, default=5)
+    parser.add_argument("--body-fields", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    task, results = make_fan_in(args.parents, args.outputs, args.body_fields)
+    compiled = CompiledTask(task)
+    assert compiled.render(results) == resolve_input_mappings(task, results)
+
+    legacy = timeit(lambda: resolve_input_mappings(task, results), args.repeat)
+    fast = timeit(lambda: compiled.render(results), args.repeat)
+    print(f"fan-in of {args.parents} parents x {args.outputs} outputs, {args.body_fields} body items")
+    print(f"resolve_input_mappings {legacy * 1000:9.2f} ms/render")
+    print(f"CompiledTask.render    {fast * 1000:9.2f} ms/render  ({legacy / fast:.0f}x)")
+
+if __name__ == "__main__":
+    main()
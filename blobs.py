@@ -0,0 +1,129 @@
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import logging
+logger = logging.getLogger(__name__)
+
+BLOB_THRESHOLD = 64 * 1024
+BLOB_DIR = os.path.join("runs", ".blobs")
+HASH_CHUNK = 1024 * 1024
+
+
+def is_blob_ref(value):
+    return isinstance(value, dict) and "$blob" in value
+
+
+class BlobStore:
+    """
+    Content-addressed files for task outputs too large to keep inline.
+    Results and the cache hold a small reference instead:
+    {"$blob": <sha256>, "size": <bytes>, "kind": "text" | "json" | "body"}.
+    "body" marks a raw response body that is JSON if it parses and text
+    otherwise.
+    """
+    def __init__(self, root=BLOB_DIR, threshold=BLOB_THRESHOLD):
+        self.root = os.path.abspath(root)
+        self.threshold = threshold
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _commit(self, digest, write):
+        path = self.path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+
+    def put(self, value):
+        """
+        Store a str (kind "text") or any other JSON value (kind "json").
+        """
+        if isinstance(value, str):
+            data, kind = value.encode("utf-8"), "text"
+        else:
+            data, kind = json.dumps(value).encode("utf-8"), "json"
+        digest = hashlib.sha256(data).hexdigest()
+        self._commit(digest, lambda f: f.write(data))
+        return {"$blob": digest, "size": len(data), "kind": kind}
+
+    def put_file(self, src, kind="body"):
+        """
+        Store a file by streaming it through the hash and copying it once.
+        """
+        h = hashlib.sha256()
+        size = 0
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+
+        def copy(dst):
+            with open(src, "rb") as f:
+                shutil.copyfileobj(f, dst, HASH_CHUNK)
+        self._commit(digest, copy)
+        return {"$blob": digest, "size": size, "kind": kind}
+
+    def exists(self, ref):
+        return os.path.exists(self.path(ref["$blob"]))
+
+    @contextlib.contextmanager
+    def view(self, ref):
+        """
+        Read-only memory map of a blob (an empty bytes object for size 0).
+        """
+        if ref["size"] == 0:
+            yield b""
+            return
+        with open(self.path(ref["$blob"]), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    def load(self, ref):
+        with self.view(ref) as mm:
+            data = mm[:]
+        if ref["kind"] == "json":
+            return json.loads(data)
+        if ref["kind"] == "body":
+            try:
+                return json.loads(data)
+            except ValueError:
+                pass
+        return data.decode("utf-8", errors="replace")
+
+    def offload(self, outputs):
+        """
+        Replace output values whose JSON form exceeds the threshold with
+        blob references.
+        """
+        offloaded = {}
+        for name, value in outputs.items():
+            if isinstance(value, (str, list, dict)) and not is_blob_ref(value):
+                size = len(value) if isinstance(value, str) else len(json.dumps(value))
+                if size > self.threshold:
+                    value = self.put(value)
+                    logger.debug(f"Output {name} moved to blob {value['$blob'][:12]} ({size} bytes)")
+            offloaded[name] = value
+        return offloaded
+
+    def available(self, outputs):
+        return all(self.exists(v) for v in outputs.values() if is_blob_ref(v))
+
+    def materialize(self, value):
+        return self.load(value) if is_blob_ref(value) else value
+
+
+blobs = BlobStore()
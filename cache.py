@@ -1,17 +1,254 @@
-import redis
+import os
 import json
+import zlib
+import lzma
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from backend import r, raw_client
+import logging
+logger = logging.getLogger(__name__)
 
-r = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-def load_task_cache(wf_key: str, task_id: str):
-    key = f"{wf_key}:cache:{task_id}"
-    data = r.get(key)
-    if not data:
+CACHE_TTL = 7 * 24 * 3600
+DURATION_SAMPLES = 20
+L1_MAX_ENTRIES = 10_000
+L1_MAX_BYTES = 64 * 1024 * 1024
+
+# record: magic, version, flags (compression << 4 | codec), sha256 of the
+# cache key, then the payload
+RECORD_MAGIC = b"WZ"
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct(">2sBB32s")
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+COMPRESSION = {"none": 0, "zlib": 1, "lzma": 2}
+COMPRESS_THRESHOLD = 1024
+CACHE_COMPRESSION = os.getenv("WIZFLOW_CACHE_COMPRESSION", "zlib")
+
+def result_key(cache_key: str):
+    return f"cache:result:{cache_key}"
+
+def manifest_key(wf_key: str):
+    return f"{wf_key}:cache:manifest"
+
+def durations_key(wf_key: str):
+    return f"{wf_key}:cache:durations"
+
+def _key_digest(key):
+    if len(key) == 64:
+        try:
+            return bytes.fromhex(key)
+        except ValueError:
+            pass
+    return hashlib.sha256(key.encode()).digest()
+
+def _compress(method, payload):
+    if method == COMPRESSION["zlib"]:
+        return zlib.compress(payload, 6)
+    return lzma.compress(payload, preset=1)
+
+def _decompress(method, payload):
+    if method == COMPRESSION["zlib"]:
+        return zlib.decompress(payload)
+    return lzma.decompress(payload)
+
+def encode_record(key, outputs, compression=CACHE_COMPRESSION):
+    """
+    Binary cache record for `outputs`. Returns the record and the size of
+    the uncompressed payload. The payload is msgpack when it is installed,
+    compact JSON otherwise, and is compressed past COMPRESS_THRESHOLD when
+    that makes it smaller.
+    """
+    if msgpack is not None:
+        codec, payload = CODEC_MSGPACK, msgpack.packb(outputs, use_bin_type=True)
+    else:
+        codec = CODEC_JSON
+        payload = json.dumps(outputs, separators=(",", ":"), ensure_ascii=False).encode()
+    size = len(payload)
+    method = 0
+    if size > COMPRESS_THRESHOLD and compression != "none":
+        packed = _compress(COMPRESSION[compression], payload)
+        if len(packed) < size:
+            method, payload = COMPRESSION[compression], packed
+    return RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, method << 4 | codec, _key_digest(key)) + payload, size
+
+def record_matches(key, data):
+    """
+    Whether `data` is a current-format record for `key`, from the header
+    alone.
+    """
+    if data[:2] != RECORD_MAGIC or len(data) < RECORD_HEADER.size:
+        return False
+    _, version, flags, digest = RECORD_HEADER.unpack_from(data)
+    return version == RECORD_VERSION and digest == _key_digest(key)
+
+def decode_record(key, data):
+    """
+    (outputs, size, legacy) for a stored value, or None when it is not a
+    readable record for `key`. Values written before the binary format
+    are plain JSON and come back with legacy=True.
+    """
+    if data[:2] != RECORD_MAGIC:
+        try:
+            return json.loads(data), len(data), True
+        except ValueError:
+            return None
+    if not record_matches(key, data):
+        return None
+    flags = data[3]
+    codec, method = flags & 0x0f, flags >> 4
+    if codec == CODEC_MSGPACK and msgpack is None:
+        return None
+    payload = memoryview(data)[RECORD_HEADER.size:]
+    try:
+        if method:
+            payload = _decompress(method, payload)
+        if codec == CODEC_MSGPACK:
+            return msgpack.unpackb(payload, raw=False), len(payload), False
+        return json.loads(bytes(payload)), len(payload), False
+    except (zlib.error, lzma.LZMAError, ValueError):
         return None
-    obj = json.loads(data)
-    return obj["outputs"], obj["config_hash"]
 
-def save_task_cache(wf_key: str, task_id: str, outputs: dict, config_hash: str):
-    key = f"{wf_key}:cache:{task_id}"
-    payload = json.dumps({"outputs": outputs, "config_hash": config_hash})
-    r.set(key, payload)
+
+class ResultCache:
+    """
+    Task outputs keyed by the hash of the resolved task config, so identical
+    tasks share results across workflows and versions. A bounded in-process
+    LRU sits in front of the state backend (see backend.py), where entries
+    expire after `ttl` seconds. Entries are stored as binary records (see
+    encode_record); old JSON entries are rewritten when they are read.
+    """
+    def __init__(self, client, ttl=CACHE_TTL, max_entries=L1_MAX_ENTRIES, max_bytes=L1_MAX_BYTES):
+        self.client = client
+        self.reader = raw_client(client)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.l1 = OrderedDict()
+        self.l1_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "evictions": 0, "migrated": 0}
+
+    def _remember(self, key, outputs, size):
+        with self.lock:
+            if key in self.l1:
+                self.l1_bytes -= self.l1.pop(key)[1]
+            self.l1[key] = (outputs, size)
+            self.l1_bytes += size
+            while self.l1 and (len(self.l1) > self.max_entries or self.l1_bytes > self.max_bytes):
+                _, (_, old_size) = self.l1.popitem(last=False)
+                self.l1_bytes -= old_size
+                self.counters["evictions"] += 1
+
+    def _lookup_l1(self, key):
+        with self.lock:
+            entry = self.l1.get(key)
+            if entry is None:
+                return None
+            self.l1.move_to_end(key)
+            self.counters["l1_hits"] += 1
+            return entry[0]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Look up many keys with a single MGET for whatever is not in L1.
+        Returns {key: outputs} for hits only.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            outputs = self._lookup_l1(key)
+            if outputs is None:
+                missing.append(key)
+            else:
+                found[key] = outputs
+        if not missing:
+            return found
+        values = self.reader.mget([result_key(k) for k in missing])
+        legacy = []
+        for key, data in zip(missing, values):
+            record = None if data is None else decode_record(key, data)
+            with self.lock:
+                self.counters["misses" if record is None else "l2_hits"] += 1
+            if record is None:
+                if data is not None:
+                    logger.warning(f"Ignoring unreadable cache record for {key}")
+                continue
+            outputs, size, is_legacy = record
+            self._remember(key, outputs, size)
+            found[key] = outputs
+            if is_legacy:
+                legacy.append(key)
+        if legacy:
+            self._migrate(legacy, found)
+        return found
+
+    def _migrate(self, keys, found):
+        # entries from before the binary format are rewritten on first read
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            self.put(key, found[key], pipe=pipe)
+        pipe.execute()
+        with self.lock:
+            self.counters["migrated"] += len(keys)
+
+    def put(self, key, outputs, pipe=None):
+        data, size = encode_record(key, outputs)
+        target = pipe if pipe is not None else self.client
+        target.set(result_key(key), data, ex=self.ttl)
+        self._remember(key, outputs, size)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, l1_entries=len(self.l1), l1_bytes=self.l1_bytes)
+
+
+results = ResultCache(r)
+
+def load_manifest(wf_key: str):
+    """
+    Merkle digest of every task as of its last successful run.
+    """
+    return r.hgetall(manifest_key(wf_key))
+
+def save_manifest_entry(wf_key: str, task_id: str, digest: str):
+    r.hset(manifest_key(wf_key), task_id, digest)
+
+def prefetch_task_cache(cache_keys):
+    return results.get_many(cache_keys)
+
+def load_task_cache(cache_key: str):
+    return results.get(cache_key)
+
+def load_durations(wf_key: str):
+    """
+    Recent execution times (seconds) of every task, oldest first.
+    """
+    return {tid: json.loads(v) for tid, v in r.hgetall(durations_key(wf_key)).items()}
+
+def save_task_cache(wf_key: str, task_id: str, cache_key: str, outputs: dict, digest: str, durations=None):
+    pipe = r.pipeline(transaction=False)
+    results.put(cache_key, outputs, pipe=pipe)
+    pipe.hset(manifest_key(wf_key), task_id, digest)
+    if durations is not None:
+        pipe.hset(durations_key(wf_key), task_id, json.dumps(durations[-DURATION_SAMPLES:]))
+    pipe.execute()
+
+def save_item_cache(cache_key: str, outputs: dict):
+    """
+    Outputs of one MAP item; items are cached by content only, with no
+    manifest entry of their own.
+    """
+    results.put(cache_key, outputs)
+
+def cache_stats():
+    return results.stats()
@@ -0,0 +1,72 @@
+import json
+import time
+from backend import r
+
+
+def checkpoint_key(wf_key, part):
+    return f"wf:{wf_key}:checkpoint:{part}"
+
+
+class CheckpointState:
+    def __init__(self, workflow, done, inflight, failed):
+        self.workflow = workflow
+        self.done = done
+        self.inflight = inflight
+        self.failed = failed
+
+
+class Checkpoint:
+    """
+    Durable frontier of a workflow's current run in the state backend: the
+    workflow definition, the outputs of completed tasks and the ids of
+    in-flight and failed tasks. Indegree counters are not stored; they
+    follow from the completed set and the DAG when the run is resumed.
+    """
+    def __init__(self, wf_key):
+        self.wf_key = wf_key
+        self.keys = {part: checkpoint_key(wf_key, part)
+                     for part in ("workflow", "done", "inflight", "failed")}
+
+    def start(self, workflow):
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(self.keys["done"], self.keys["inflight"], self.keys["failed"])
+        pipe.set(self.keys["workflow"], json.dumps(workflow))
+        pipe.execute()
+
+    def started(self, task_id):
+        r.hset(self.keys["inflight"], task_id, time.time())
+
+    def completed(self, task_id, outputs):
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(self.keys["done"], task_id, json.dumps(outputs))
+        pipe.hdel(self.keys["inflight"], task_id)
+        pipe.execute()
+
+    def failed(self, task_id):
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(self.keys["failed"], task_id, time.time())
+        pipe.hdel(self.keys["inflight"], task_id)
+        pipe.execute()
+
+    def load(self):
+        """
+        Everything needed to resume, in one round trip. None if the workflow
+        has no checkpoint.
+        """
+        pipe = r.pipeline(transaction=False)
+        pipe.get(self.keys["workflow"])
+        pipe.hgetall(self.keys["done"])
+        pipe.hgetall(self.keys["inflight"])
+        pipe.hgetall(self.keys["failed"])
+        workflow, done, inflight, failed = pipe.execute()
+        if workflow is None:
+            return None
+        return CheckpointState(
+            json.loads(workflow),
+            {tid: json.loads(outputs) for tid, outputs in done.items()},
+            set(inflight),
+            set(failed),
+        )
+
+    def clear(self):
+        r.delete(*self.keys.values())
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+import weakref
+from store import r, get_workflow_status
+import logging
+logger = logging.getLogger(__name__)
+
+CONTROL_PATTERN = "wf:*:control"
+# published on the control channel too, but they report how a run went and
+# must not reopen a paused or draining workflow
+RUN_OUTCOMES = ("FAILED", "COMPLETED")
+
+
+class PauseGate:
+    """
+    In-memory view of a workflow's run state. Tasks wait on `run_open`
+    (closed while PAUSED) and schedulers wait on `submit_open` (closed while
+    PAUSED or DRAINING). Both are plain Events, so the hot path never
+    touches Redis; the ControlListener keeps gates in every process in sync.
+    """
+    def __init__(self, wf_id, status=None):
+        self.wf_id = wf_id
+        self.state = None
+        self.run_open = threading.Event()
+        self.submit_open = threading.Event()
+        self.lock = threading.Lock()
+        self.async_waiters = []
+        self.apply(status if status is not None else get_workflow_status(wf_id))
+        listener.register(self)
+
+    def apply(self, status):
+        with self.lock:
+            if status in RUN_OUTCOMES and self.state is not None:
+                return
+            self.state = status
+            if status == "PAUSED":
+                self.run_open.clear()
+                self.submit_open.clear()
+            elif status == "DRAINING":
+                self.run_open.set()
+                self.submit_open.clear()
+            else:
+                self.run_open.set()
+                self.submit_open.set()
+            waiters = [w for w in self.async_waiters if w[0].is_set()]
+            self.async_waiters = [w for w in self.async_waiters if not w[0].is_set()]
+        for _, loop, fut in waiters:
+            loop.call_soon_threadsafe(_resolve, fut)
+
+    def wait(self):
+        self.run_open.wait()
+
+    def wait_submit(self):
+        self.submit_open.wait()
+
+    def can_submit(self):
+        return self.submit_open.is_set()
+
+    async def _wait_async(self, event):
+        if event.is_set():
+            return
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self.lock:
+            if event.is_set():
+                return
+            self.async_waiters.append((event, loop, fut))
+        await fut
+
+    async def wait_async(self):
+        await self._wait_async(self.run_open)
+
+    async def wait_submit_async(self):
+        await self._wait_async(self.submit_open)
+
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class ControlListener:
+    """
+    One background pub/sub subscription per process that forwards workflow
+    status changes published by store.set_workflow_status to local gates.
+    """
+    def __init__(self):
+        self.gates = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, gate):
+        with self.lock:
+            self.gates.setdefault(gate.wf_id, weakref.WeakSet()).add(gate)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="control-listener", daemon=True)
+                self.thread.start()
+
+    def _dispatch(self, wf_id, status):
+        with self.lock:
+            gates = list(self.gates.get(wf_id, ()))
+        for gate in gates:
+            gate.apply(status)
+
+    def _resync(self):
+        with self.lock:
+            wf_ids = [wf_id for wf_id, gates in self.gates.items() if gates]
+        for wf_id in wf_ids:
+            self._dispatch(wf_id, get_workflow_status(wf_id))
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = r.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(CONTROL_PATTERN)
+                # statuses may have changed while we were not subscribed
+                self._resync()
+                for msg in pubsub.listen():
+                    if msg.get("type") != "pmessage":
+                        continue
+                    wf_id = msg["channel"][len("wf:"):-len(":control")]
+                    self._dispatch(wf_id, msg["data"])
+            except Exception as e:
+                logger.warning(f"Control channel lost, reconnecting: {e}")
+                time.sleep(1)
+
+
+listener = ControlListener()
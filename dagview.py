@@ -0,0 +1,105 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import compute_hash, dag_to_dot
+import logging
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = 2
+
+
+def structure_hash(dag):
+    """
+    Hash of the graph shape only (task ids and edges), so edits to commands
+    or other task fields do not force a re-render.
+    """
+    return compute_hash({tid: sorted(children) for tid, children in dag.items()})
+
+def dag_levels(dag, order):
+    """
+    Layout level of every task: the length of the longest path from a root.
+    """
+    level = {tid: 0 for tid in order}
+    for tid in order:
+        for child in dag.get(tid, []):
+            level[child] = max(level[child], level[tid] + 1)
+    return level
+
+def graph_json(dag, nodes, order):
+    """
+    Nodes, edges and layout levels for drawing the DAG client-side.
+    """
+    level = dag_levels(dag, order)
+    levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for tid in order:
+        levels[level[tid]].append(tid)
+    return {
+        "hash": structure_hash(dag),
+        "nodes": [
+            {
+                "id": tid,
+                "name": nodes[tid].get("name", tid),
+                "type": nodes[tid].get("type"),
+                "level": level[tid],
+            }
+            for tid in order
+        ],
+        "edges": [[parent, child] for parent in order for child in dag.get(parent, [])],
+        "levels": levels,
+    }
+
+
+class DagRenderer:
+    """
+    Renders DAG images with Graphviz on a small background executor. Images
+    are keyed by structure_hash: a graph already rendered into the target
+    directory is reused as is, one rendered elsewhere in this process is
+    copied, and concurrent requests for the same image share one render.
+    """
+    def __init__(self, max_workers=RENDER_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dag-render")
+        self.rendered = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, dag, nodes, out_dir, name=None):
+        """
+        Schedule a render into `out_dir`; returns a Future for the png path.
+        """
+        digest = structure_hash(dag)
+        base = os.path.join(out_dir, f"dag_{digest[:16]}")
+        with self.lock:
+            fut = self.pending.get(base)
+            if fut is not None:
+                return fut
+            fut = self.executor.submit(self._render, dag, list(nodes), base, digest, name)
+            self.pending[base] = fut
+        # outside the lock: a future that is already done runs the callback
+        # right here, and _forget takes the lock
+        fut.add_done_callback(lambda f: self._forget(base, f))
+        return fut
+
+    def _forget(self, base, fut):
+        with self.lock:
+            if self.pending.get(base) is fut:
+                del self.pending[base]
+
+    def _render(self, dag, nodes, base, digest, name):
+        png_path = base + ".png"
+        if os.path.exists(png_path):
+            return png_path
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        with self.lock:
+            previous = self.rendered.get(digest)
+        if previous and os.path.exists(previous):
+            shutil.copyfile(previous, png_path)
+            return png_path
+        png_path = dag_to_dot(dag, all_nodes=nodes, filename=base, engine_name=name)
+        with self.lock:
+            self.rendered[digest] = png_path
+        logger.info(f"Rendered DAG {digest[:16]} to {png_path}")
+        return png_path
+
+
+renderer = DagRenderer()
@@ -0,0 +1,128 @@
+import json
+import time
+import uuid
+from backend import redis_client
+import logging
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY      = "wizflow:queue"
+PROCESSING_KEY = "wizflow:processing"
+LEASE_TTL      = 15
+HEARTBEAT_INTERVAL = 5
+
+r = redis_client()
+
+def job_key(job_id):
+    return f"wizflow:job:{job_id}"
+
+def lease_key(job_id):
+    return f"wizflow:lease:{job_id}"
+
+def results_key(wf_key):
+    return f"wizflow:results:{wf_key}"
+
+def enqueue_task(wf_key, task_id, task, cwd):
+    """
+    Push an already-resolved task onto the shared work queue.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "wf_key": wf_key,
+        "task_id": task_id,
+        "task": task,
+        "cwd": cwd,
+    }
+    pipe = r.pipeline()
+    pipe.set(job_key(job_id), json.dumps(job))
+    pipe.lpush(QUEUE_KEY, job_id)
+    pipe.execute()
+    return job_id
+
+def claim_job(worker_id, timeout=1):
+    """
+    Block until a job is available, move it to the processing list and take
+    a lease on it. Returns the job dict or None on timeout.
+    """
+    job_id = r.brpoplpush(QUEUE_KEY, PROCESSING_KEY, timeout=timeout)
+    if not job_id:
+        return None
+    r.set(lease_key(job_id), worker_id, ex=LEASE_TTL)
+    data = r.get(job_key(job_id))
+    if not data:
+        # result was already reported by a worker we presumed dead
+        r.lrem(PROCESSING_KEY, 0, job_id)
+        r.delete(lease_key(job_id))
+        return None
+    return json.loads(data)
+
+def renew_leases(worker_id, job_ids):
+    pipe = r.pipeline()
+    for job_id in job_ids:
+        pipe.set(lease_key(job_id), worker_id, ex=LEASE_TTL)
+    pipe.execute()
+
+def report_result(job, ok, outputs=None, error=None, worker_id=None, duration=None):
+    job_id = job["job_id"]
+    result = {
+        "job_id": job_id,
+        "task_id": job["task_id"],
+        "ok": ok,
+        "outputs": outputs,
+        "error": error,
+        "worker": worker_id,
+        "duration": duration,
+    }
+    pipe = r.pipeline()
+    pipe.lpush(results_key(job["wf_key"]), json.dumps(result))
+    pipe.lrem(PROCESSING_KEY, 0, job_id)
+    pipe.delete(lease_key(job_id), job_key(job_id))
+    pipe.execute()
+
+def wait_for_result(wf_key, timeout=1):
+    item = r.brpop(results_key(wf_key), timeout=timeout)
+    if not item:
+        return None
+    return json.loads(item[1])
+
+def clear_results(wf_key):
+    r.delete(results_key(wf_key))
+
+class LeaseReaper:
+    """
+    Requeues jobs sitting in the processing list without a live lease.
+    A job must be seen unleased for a full LEASE_TTL before it is requeued,
+    which covers the short gap between a worker claiming it and taking the
+    lease.
+    """
+    def __init__(self, lease_ttl=LEASE_TTL):
+        self.lease_ttl = lease_ttl
+        self.orphans = {}
+
+    def reap(self):
+        now = time.monotonic()
+        job_ids = r.lrange(PROCESSING_KEY, 0, -1)
+        if not job_ids:
+            self.orphans.clear()
+            return []
+        pipe = r.pipeline()
+        for job_id in job_ids:
+            pipe.exists(lease_key(job_id))
+        leased = pipe.execute()
+
+        requeued = []
+        unleased = set()
+        for job_id, alive in zip(job_ids, leased):
+            if alive:
+                continue
+            unleased.add(job_id)
+            first_seen = self.orphans.setdefault(job_id, now)
+            if now - first_seen < self.lease_ttl:
+                continue
+            if r.lrem(PROCESSING_KEY, 1, job_id):
+                r.rpush(QUEUE_KEY, job_id)
+                requeued.append(job_id)
+                logger.warning(f"Lease expired for job {job_id}, requeued")
+            unleased.discard(job_id)
+        self.orphans = {j: t for j, t in self.orphans.items() if j in unleased}
+        return requeued
@@ -1,18 +1,41 @@
-import time
 import os
-from collections import deque
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+import asyncio
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from utils import (
     compute_hash,
     build_dag,
     topological_sort,
-    resolve_input_mappings,
     extract_outputs,
+    compile_outputs,
     compute_max_threads,
     dag_to_dot,
+    fingerprint_file,
+)
+from templates import compile_tasks
+from tasks import execute_task, execute_task_async, PROCESS_TYPES
+from http_client import session_scope
+from cache import (
+    load_durations,
+    load_manifest,
+    load_task_cache,
+    prefetch_task_cache,
+    save_task_cache,
+    save_manifest_entry,
+    save_item_cache,
 )
-from tasks import execute_task
-from cache import load_task_cache, save_task_cache
+from control import PauseGate
+from lanes import Lanes
+from blobs import blobs
+from backend import BACKEND
+from checkpoint import Checkpoint
+from mapreduce import MapExpansion, MapState, map_items, reduce_outputs
+from dagview import renderer, graph_json
+from scheduling import ReadyQueue, task_weights, critical_path_priorities, simulate_schedule
+from logstream import TaskLogStream
+from dispatch import enqueue_task, wait_for_result, clear_results, LeaseReaper
 from store import (
     init_workflow,
     set_task_status,
@@ -22,181 +45,811 @@ from store import (
 import logging
 logger = logging.getLogger(__name__)
 
+SPECULATION_MIN_SAMPLES = 5
+SPECULATION_FACTOR = 1.5
+
+
+def workflow_key(workflow_json):
+    """
+    The key a workflow's state lives under, known before an engine (which
+    resets that state) is built.
+    """
+    return f"{workflow_json.get('workflow_name', 'workflow')}:{workflow_json.get('version', 'v1')}"
+
+def check_run_mode(workflow_json, mode):
+    """
+    Raises ValueError if the workflow cannot run in `mode`: workers only
+    execute plain tasks, so MAP/REDUCE need an in-process mode.
+    """
+    if mode != "distributed":
+        return
+    fan = [t["id"] for t in workflow_json["tasks"] if t.get("type") in ("MAP", "REDUCE")]
+    if fan:
+        raise ValueError(f"MAP/REDUCE tasks ({', '.join(fan)}) cannot run in distributed mode; "
+                         f"use the default, parallel or async mode")
+
 
 class WorkflowEngine:
     def __init__(self, workflow_json):
         self.name    = workflow_json.get("workflow_name", "workflow")
         self.version = workflow_json.get("version", "v1")
         self.tasks   = workflow_json["tasks"]
+        self.workflow_json = workflow_json
         self.base_dir = os.path.abspath(os.path.join("runs", self.name + "_" + self.version))
         os.makedirs(self.base_dir, exist_ok=True)
 
-        self.dag, self.indegree, self.nodes = build_dag(self.tasks)
-        self.order = topological_sort(self.dag, self.indegree.copy())
+        self.dag, self.nodes = build_dag(self.tasks)
+        self.templates = compile_tasks(self.nodes)
+        self.output_plans = {tid: compile_outputs(t) for tid, t in self.nodes.items()}
+        self.order = topological_sort(self.dag)
         self.results = {}
-        self.wf_key = f"{self.name}:{self.version}"
+        self.wf_key = workflow_key(workflow_json)
         init_workflow(self.wf_key, list(self.nodes.keys()))
+        self.gate = PauseGate(self.wf_key, status="PENDING")
         self._tasks_to_rexecute()
+        self.durations = load_durations(self.wf_key)
+        self._update_priorities()
+        self.lanes = Lanes()
+        self.maps = {}
+        self.chunks = {}
+        self.checkpoint = Checkpoint(self.wf_key)
+        self.resume_state = None
+        self.resumed_failed = set()
+
+    @classmethod
+    def from_checkpoint(cls, wf_key):
+        """
+        Engine for the workflow checkpointed under `wf_key`; its next run
+        continues from the checkpointed frontier.
+        """
+        state = Checkpoint(wf_key).load()
+        if state is None:
+            raise ValueError(f"No checkpoint for workflow {wf_key}")
+        engine = cls(state.workflow)
+        engine.resume_state = state
+        return engine
+
+    @classmethod
+    def resume_from_checkpoint(cls, wf_key, max_workers=4, policy="critical_path"):
+        """
+        Continue an interrupted run with run_parallel: completed tasks keep
+        their checkpointed outputs and only unfinished tasks run.
+        """
+        engine = cls.from_checkpoint(wf_key)
+        engine.run_parallel(max_workers, policy)
+        return engine
 
     def get_workflow_id(self):
         return self.wf_key
 
+    def _cache_key(self, task_id, task):
+        key = {
+            "task": task,
+            "inputs": [self.output_digests.get(p) for p in self.nodes[task_id].get("depends_on", [])],
+        }
+        # shell and python side effects live in the run directory, so their
+        # results are only shared between runs of the same workflow version
+        if task.get("type") in PROCESS_TYPES:
+            key["cwd"] = self.base_dir
+        return compute_hash(key)
+
+    def _file_fingerprints(self, task_id):
+        prints = {}
+        for name, spec in self.nodes[task_id].get("outputs", {}).items():
+            if spec.get("type") == "file":
+                path = os.path.join(self.base_dir, spec["path"])
+                prints[name] = fingerprint_file(path, spec.get("fingerprint", "stat"))
+        return prints
+
+    def _merkle_digest(self, task_id):
+        return compute_hash({
+            "config": self.config_hashes[task_id],
+            "parents": [self.merkle[p] for p in self.nodes[task_id].get("depends_on", [])],
+            "files": self._file_fingerprints(task_id),
+        })
+
+    def _prepare_task(self, task_id):
+        task = self.templates[task_id].render(self.results)
+        cache_key = self._cache_key(task_id, task)
+        if task_id in self.reexec:
+            return task, cache_key, None
+        cached = load_task_cache(cache_key)
+        if cached is not None and not blobs.available(cached):
+            logger.info(f"Cached result for task {task_id} refers to missing blobs, re-running")
+            cached = None
+        return task, cache_key, cached
+
+    def _complete_task(self, task_id, task, cache_key, raw_output, elapsed=None):
+        outputs = extract_outputs(task, raw_output, self.output_plans[task_id], blobs)
+        return self._record_outputs(task_id, cache_key, outputs, elapsed)
+
+    def _record_outputs(self, task_id, cache_key, outputs, elapsed=None):
+        outputs = blobs.offload(outputs)
+        self.output_digests[task_id] = compute_hash(outputs)
+        self.merkle[task_id] = self._merkle_digest(task_id)
+        samples = None
+        if elapsed is not None:
+            samples = self.durations.get(task_id, []) + [elapsed]
+            self.durations[task_id] = samples
+        save_task_cache(self.wf_key, task_id, cache_key, outputs, self.merkle[task_id], samples)
+        self.checkpoint.completed(task_id, outputs)
+        self.manifest[task_id] = self.merkle[task_id]
+        set_task_status(self.wf_key, task_id, "COMPLETED")
+        return outputs
+
+    def _adopt_outputs(self, task_id, outputs):
+        self.output_digests[task_id] = compute_hash(outputs)
+        self.merkle[task_id] = self._merkle_digest(task_id)
+        if self.manifest.get(task_id) != self.merkle[task_id]:
+            save_manifest_entry(self.wf_key, task_id, self.merkle[task_id])
+            self.manifest[task_id] = self.merkle[task_id]
+        set_task_status(self.wf_key, task_id, "COMPLETED")
+        return outputs
+
+    def _use_cached(self, task_id, outputs):
+        self._adopt_outputs(task_id, outputs)
+        self.checkpoint.completed(task_id, outputs)
+        logger.debug(f"Using cached result for task {task_id}")
+        return outputs
+
+    def _expand_map(self, task_id, task, cache_key):
+        context = self.templates[task_id].context(self.results)
+        return MapExpansion(map_items(task, context), cache_key, context)
+
+    def _open_log(self, task_id, task):
+        if task.get("type") not in PROCESS_TYPES:
+            return None
+        return TaskLogStream(self.wf_key, task_id, os.path.join(self.base_dir, ".logs"))
+
+    def _speculation_delay(self, task_id, task):
+        """
+        Seconds after which a SHELL task marked `"speculative": true` gets a
+        duplicate: `speculate_after` if set, otherwise SPECULATION_FACTOR
+        times the p95 of its recorded durations. None when the task is not
+        speculative or has too little history.
+        """
+        if not task.get("speculative") or task.get("type") != "SHELL":
+            return None
+        if task.get("speculate_after") is not None:
+            return float(task["speculate_after"])
+        samples = self.durations.get(task_id, [])
+        if len(samples) < SPECULATION_MIN_SAMPLES:
+            return None
+        return statistics.quantiles(samples, n=20)[-1] * SPECULATION_FACTOR
+
+    def _speculate(self, task_id, task, log, delay):
+        """
+        Run the task and, if it is still running after `delay` seconds, an
+        identical copy next to it. The first attempt to succeed wins and the
+        other one's process group is killed.
+        """
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"speculate-{task_id}")
+        attempts = [pool.submit(execute_task, task, self.base_dir, log, cancel)]
+        try:
+            done, _ = wait(attempts, timeout=delay)
+            if not done:
+                logger.info(f"Task {task_id} still running after {delay:.2f}s, starting a speculative copy")
+                attempts.append(pool.submit(execute_task, task, self.base_dir,
+                                            TaskLogStream(None, task_id), cancel))
+            error = None
+            for fut in as_completed(attempts):
+                try:
+                    return fut.result()
+                except Exception as e:
+                    error = error or e
+            raise error
+        finally:
+            cancel.set()
+            pool.shutdown(wait=False)
+
+    async def _speculate_async(self, task_id, task, log, delay):
+        attempts = [asyncio.ensure_future(execute_task_async(task, cwd=self.base_dir, log=log))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                logger.info(f"Task {task_id} still running after {delay:.2f}s, starting a speculative copy")
+                attempts.append(asyncio.ensure_future(execute_task_async(
+                    task, cwd=self.base_dir, log=TaskLogStream(None, task_id))))
+            error = None
+            for fut in asyncio.as_completed(attempts):
+                try:
+                    return await fut
+                except Exception as e:
+                    error = error or e
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    def _fail_task(self, task_id, error):
+        self.checkpoint.failed(task_id)
+        set_task_status(self.wf_key, task_id, "FAILED")
+        set_workflow_status(self.wf_key, "FAILED")
+        return RuntimeError(f"Task {task_id} failed: {error}")
+
     def _run_single_task(self, task_id):
+        if task_id in self.chunks:
+            return self._run_chunk(task_id)
         self._check_paused()
         set_task_status(self.wf_key, task_id, "RUNNING")
-        raw = self.nodes[task_id]
-        task = resolve_input_mappings(raw, self.results)
-        cfg_hash = compute_hash(task)
-        cached = load_task_cache(self.wf_key, task_id)
-        if task_id not in self.reexec and cached and cached[1] == cfg_hash:
-            set_task_status(self.wf_key, task_id, "COMPLETED")
-            logger.debug(f"Using cached result for task {task_id}")
-            return cached[0]
+        task, cache_key, cached = self._prepare_task(task_id)
+        if cached is not None:
+            return self._use_cached(task_id, cached)
+        self.checkpoint.started(task_id)
+        log = self._open_log(task_id, task)
+        start = time.monotonic()
         try:
-            raw_output = execute_task(task, cwd=self.base_dir)
-            outputs = extract_outputs(task, raw_output)
-            save_task_cache(self.wf_key, task_id, outputs, cfg_hash)
-            set_task_status(self.wf_key, task_id, "COMPLETED")
-            return outputs
+            if task["type"] == "MAP":
+                return self._expand_map(task_id, task, cache_key)
+            if task["type"] == "REDUCE":
+                return self._record_outputs(task_id, cache_key, self._reduce(task_id, task))
+            delay = self._speculation_delay(task_id, task)
+            if delay is None:
+                raw_output = execute_task(task, cwd=self.base_dir, log=log)
+            else:
+                raw_output = self._speculate(task_id, task, log, delay)
+            return self._complete_task(task_id, task, cache_key, raw_output, time.monotonic() - start)
         except Exception as e:
-            set_task_status(self.wf_key, task_id, "FAILED")
-            set_workflow_status(self.wf_key, "FAILED")
-            raise RuntimeError(f"Task {task_id} failed: {e}")
+            raise self._fail_task(task_id, e)
+        finally:
+            if log is not None:
+                log.close()
+
+    async def _run_single_task_async(self, task_id):
+        # cache, checkpoint and status writes block on the backend and log,
+        # REDUCE and output files on the disk, so they run in threads rather
+        # than on the event loop
+        if task_id in self.chunks:
+            return await self._run_chunk_async(task_id)
+        await self._check_paused_async()
+        set_task_status(self.wf_key, task_id, "RUNNING")
+        task, cache_key, cached = await asyncio.to_thread(self._prepare_task, task_id)
+        if cached is not None:
+            return await asyncio.to_thread(self._use_cached, task_id, cached)
+        await asyncio.to_thread(self.checkpoint.started, task_id)
+        log = await asyncio.to_thread(self._open_log, task_id, task)
+        start = time.monotonic()
+        try:
+            if task["type"] == "MAP":
+                return await asyncio.to_thread(self._expand_map, task_id, task, cache_key)
+            if task["type"] == "REDUCE":
+                outputs = await asyncio.to_thread(self._reduce, task_id, task)
+                return await asyncio.to_thread(self._record_outputs, task_id, cache_key, outputs)
+            delay = self._speculation_delay(task_id, task)
+            if delay is None:
+                raw_output = await execute_task_async(task, cwd=self.base_dir, log=log)
+            else:
+                raw_output = await self._speculate_async(task_id, task, log, delay)
+            return await asyncio.to_thread(self._complete_task, task_id, task, cache_key,
+                                           raw_output, time.monotonic() - start)
+        except Exception as e:
+            raise await asyncio.to_thread(self._fail_task, task_id, e)
+        finally:
+            if log is not None:
+                log.close()
 
     def run(self):
         """
         Run the workflow without multi threading.
         """
-        set_workflow_status(self.wf_key, "RUNNING")
-        blocked = set()
-        any_failed = False
+        _, blocked, any_failed = self._begin_run()
 
         for task_id in self.order:
+            if task_id in self.results or task_id in self.resumed_failed:
+                continue
             if task_id in blocked:
                 set_task_status(self.wf_key, task_id, "PENDING")
                 logger.info(f"Task {task_id} blocked (ancestor failed)")
                 continue
-            self._check_paused()
+            self._hold_submissions()
             try:
                 outputs = self._run_single_task(task_id)
+                if isinstance(outputs, MapExpansion):
+                    outputs = self._run_map_serial(task_id, outputs)
                 self.results[task_id] = outputs
             except Exception:
                 any_failed = True
                 blocked |= self._get_descendants(task_id)
-        final_status = "FAILED" if any_failed else "COMPLETED"
-        set_workflow_status(self.wf_key, final_status)
+        self._end_run(any_failed)
         return self.results
-    
-    def run_parallel(self, max_workers=4):
+
+    def _update_priorities(self):
+        weights = task_weights(self.nodes, self.durations)
+        self.priorities = critical_path_priorities(self.dag, self.order, weights)
+
+    def _ready_queue(self, indegree, policy):
+        priorities = self.priorities if policy == "critical_path" else None
+        return ReadyQueue(priorities, [tid for tid, deg in indegree.items() if deg == 0])
+
+    def simulate(self, max_workers, policy="critical_path"):
         """
-        Run the workflow with multi threading.
+        Predict the end-to-end time of a run with `max_workers` slots by
+        replaying the schedule with recorded task durations (unit weights
+        for workflows that have never run).
         """
-        set_workflow_status(self.wf_key, "RUNNING")
-        indegree = {tid: 0 for tid in self.nodes}
-        for parent, children in self.dag.items():
-            for child in children:
-                indegree[child] += 1
+        weights = task_weights(self.nodes, self.durations)
+        priorities = self.priorities if policy == "critical_path" else None
+        makespan, _ = simulate_schedule(self.dag, self.dag.indegree_map(), weights, max_workers, priorities)
+        return makespan
 
-        blocked = set()
-        any_failed = False
-        ready = deque([tid for tid, deg in indegree.items() if deg == 0])
+    def _admit_ready(self, ready, blocked, limit=None):
+        """
+        Pop every ready task (at most `limit`) whose execution lanes have
+        room; tasks that do not fit go back on the queue. Returns
+        [(task_id, lane lease)].
+        """
+        admitted = []
+        deferred = []
+        while ready and self.gate.can_submit() and (limit is None or len(admitted) < limit):
+            tid = ready.pop()
+            state = self.maps.get(self.chunks.get(tid))
+            if tid in blocked:
+                if state is None:
+                    set_task_status(self.wf_key, tid, "PENDING")
+                    logger.info(f"Task {tid} blocked (ancestor failed)")
+                continue
+            if state is not None and not state.can_start():
+                deferred.append(tid)
+                continue
+            ticket = self.lanes.try_acquire(self._task_node(tid))
+            if ticket is None:
+                deferred.append(tid)
+                continue
+            if state is not None:
+                state.running += 1
+            samples = self.durations.get(tid)
+            expected = statistics.median(samples) if samples else None
+            admitted.append((tid, (ticket, time.monotonic(), expected)))
+        for tid in deferred:
+            ready.push(tid)
+        return admitted
+
+    def _task_node(self, tid):
+        if tid in self.chunks:
+            return self.nodes[self.chunks[tid]]["task"]
+        return self.nodes[tid]
+
+    def _release_children(self, tid, indegree, ready):
+        for child in self.dag.get(tid, []):
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.push(child)
+
+    def _settle_task(self, tid, outputs, error, indegree, ready, blocked):
+        """
+        Record a finished task, MAP expansion or MAP chunk (error is None on
+        success) and release whatever became ready. Returns False if the
+        task, or the MAP the chunk belongs to, failed.
+        """
+        if tid in self.chunks:
+            return self._settle_chunk(tid, outputs, error, indegree, ready, blocked)
+        if error is not None:
+            blocked |= self._get_descendants(tid)
+            self._release_children(tid, indegree, ready)
+            return False
+        if isinstance(outputs, MapExpansion):
+            state = self._register_map(tid, outputs)
+            for chunk_id in state.chunks:
+                ready.push(chunk_id)
+            if not state.chunks:
+                self._finish_map(state, indegree, ready)
+            return True
+        self.results[tid] = outputs
+        self._release_children(tid, indegree, ready)
+        return True
+
+    def _settle_chunk(self, chunk_id, outputs, error, indegree, ready, blocked):
+        state = self.maps[self.chunks[chunk_id]]
+        state.running -= 1
+        if state.failed:
+            return False
+        if error is not None:
+            state.failed = True
+            logger.info(self._fail_task(state.map_id, error))
+            blocked |= self._get_descendants(state.map_id) | set(state.chunks)
+            self._release_children(state.map_id, indegree, ready)
+            return False
+        state.store(chunk_id, outputs)
+        if state.pending == 0:
+            self._finish_map(state, indegree, ready)
+        return True
+
+    def _register_map(self, map_id, expansion):
+        state = MapState(map_id, self.nodes[map_id], expansion)
+        self.maps[map_id] = state
+        for chunk_id in state.chunks:
+            self.chunks[chunk_id] = map_id
+            self.priorities[chunk_id] = self.priorities.get(map_id, 0)
+        logger.info(f"MAP {map_id} expanded into {len(state.items)} items, {len(state.chunks)} chunks")
+        return state
+
+    def _finish_map(self, state, indegree=None, ready=None):
+        outputs = self._record_outputs(state.map_id, state.cache_key, state.result(),
+                                       time.monotonic() - state.started)
+        self.results[state.map_id] = outputs
+        if ready is not None:
+            self._release_children(state.map_id, indegree, ready)
+        return outputs
+
+    def _run_map_serial(self, map_id, expansion):
+        state = self._register_map(map_id, expansion)
+        for chunk_id in state.chunks:
+            try:
+                state.store(chunk_id, self._run_chunk(chunk_id))
+            except Exception as e:
+                raise self._fail_task(map_id, e)
+        return self._finish_map(state)
+
+    def _item_cache_key(self, task):
+        key = {"item_task": task}
+        if task.get("type") in PROCESS_TYPES:
+            key["cwd"] = self.base_dir
+        return compute_hash(key)
+
+    def _chunk_plan(self, chunk_id):
+        """
+        Rendered item tasks of a chunk with their cache keys, and the cached
+        outputs found for them in one bulk read.
+        """
+        state = self.maps[self.chunks[chunk_id]]
+        start, stop = state.chunks[chunk_id]
+        items = []
+        for index in range(start, stop):
+            task = state.item_task(index)
+            items.append((task, self._item_cache_key(task)))
+        cached = {}
+        if state.map_id not in self.reexec:
+            cached = prefetch_task_cache([key for _, key in items])
+            cached = {key: outputs for key, outputs in cached.items() if blobs.available(outputs)}
+        return state, items, cached
+
+    def _run_chunk(self, chunk_id):
+        state, items, cached = self._chunk_plan(chunk_id)
+        outputs = []
+        for task, key in items:
+            if key not in cached:
+                self._check_paused()
+                raw_output = execute_task(task, cwd=self.base_dir)
+                cached[key] = self._save_item(state, task, key, raw_output)
+            outputs.append(cached[key])
+        return outputs
+
+    async def _run_chunk_async(self, chunk_id):
+        state, items, cached = await asyncio.to_thread(self._chunk_plan, chunk_id)
+        outputs = []
+        for task, key in items:
+            if key not in cached:
+                await self._check_paused_async()
+                raw_output = await execute_task_async(task, cwd=self.base_dir)
+                cached[key] = await asyncio.to_thread(self._save_item, state, task, key, raw_output)
+            outputs.append(cached[key])
+        return outputs
+
+    def _save_item(self, state, task, key, raw_output):
+        outputs = blobs.offload(extract_outputs(task, raw_output, state.plan, blobs))
+        save_item_cache(key, outputs)
+        return outputs
+
+    def _reduce(self, task_id, task):
+        parents = self.nodes[task_id].get("depends_on", [])
+        map_id = task.get("map") or next(
+            (p for p in parents if self.nodes[p].get("type") == "MAP"), None)
+        if map_id not in self.results:
+            raise ValueError(f"REDUCE task {task_id} has no completed MAP input")
+        return reduce_outputs(task, self.results[map_id])
+
+    def _release_lanes(self, lease, ok):
+        ticket, started, expected = lease
+        self.lanes.release(ticket, time.monotonic() - started, expected, ok)
+
+    def _initial_indegree(self):
+        # MAP expansions belong to a single run
+        self.maps = {}
+        self.chunks = {}
+        return self.dag.indegree_map()
+
+    def _begin_run(self):
+        """
+        Mark the workflow RUNNING and return (indegree, blocked, any_failed)
+        for a new run. An engine loaded with from_checkpoint() starts from
+        the checkpointed frontier instead: completed tasks get their outputs
+        back and failed ones block their descendants again, so only tasks
+        that never finished (including those that were in flight) run.
+        The failed ones are kept in `self.resumed_failed` for run(), which
+        walks the order rather than the indegrees.
+        """
+        set_workflow_status(self.wf_key, "RUNNING")
+        indegree = self._initial_indegree()
         self.results = {}
+        self.resumed_failed = set()
+        blocked = set()
+        state, self.resume_state = self.resume_state, None
+        if state is None:
+            self.checkpoint.start(self.workflow_json)
+            return indegree, blocked, False
 
+        def retire(tid):
+            del indegree[tid]
+            for child in self.dag.get(tid, []):
+                indegree[child] -= 1
+
+        # topological order, so parents' output digests exist before their
+        # children's are computed
+        for tid in self.order:
+            if tid in state.done:
+                self.results[tid] = self._adopt_outputs(tid, state.done[tid])
+                retire(tid)
+            elif tid in state.failed:
+                self.resumed_failed.add(tid)
+                set_task_status(self.wf_key, tid, "FAILED")
+                blocked |= self._get_descendants(tid)
+                retire(tid)
+        logger.info(f"Resuming {self.wf_key}: {len(state.done)} tasks done, "
+                    f"{len(state.inflight)} were in flight")
+        return indegree, blocked, bool(state.failed)
+
+    def _end_run(self, any_failed):
+        """
+        Record how the run went. A successful run leaves nothing to resume,
+        so its checkpoint goes; a failed one keeps it for RECOVER.
+        """
+        if not any_failed:
+            self.checkpoint.clear()
+        set_workflow_status(self.wf_key, "FAILED" if any_failed else "COMPLETED")
+
+    def run_parallel(self, max_workers=4, policy="critical_path"):
+        """
+        Run the workflow with multi threading. With the default
+        "critical_path" policy, ready tasks on the longest remaining path
+        (by recorded durations) are submitted first; "fifo" submits them in
+        the order they became ready.
+        """
+        indegree, blocked, any_failed = self._begin_run()
+        ready = self._ready_queue(indegree, policy)
+
+        self.lanes.bound(max_workers)
         with ThreadPoolExecutor(max_workers=max_workers) as pool:
             future_to_tid = {}
 
-            def submit(tid):
+            def submit_ready():
+                for tid, lease in self._admit_ready(ready, blocked):
+                    fut = pool.submit(self._run_single_task, tid)
+                    future_to_tid[fut] = (tid, lease)
+
+            submit_ready()
+            while future_to_tid or ready:
+                if not future_to_tid:
+                    self._hold_submissions()
+                    submit_ready()
+                    continue
+                # while submissions are held, wake up regularly to notice a resume
+                timeout = 0.05 if ready and not self.gate.can_submit() else None
+                done, _ = wait(future_to_tid, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    tid, lease = future_to_tid.pop(fut)
+                    error = fut.exception()
+                    self._release_lanes(lease, ok=error is None)
+                    outputs = fut.result() if error is None else None
+                    if not self._settle_task(tid, outputs, error, indegree, ready, blocked):
+                        any_failed = True
+                submit_ready()
+        self._end_run(any_failed)
+        return self.results
+
+    async def run_async(self, max_concurrency=None, policy="critical_path"):
+        """
+        Run the workflow on the current event loop. SHELL and RESTAPI tasks
+        are awaited directly, so in-flight tasks do not hold OS threads.
+        """
+        async with session_scope():
+            return await self._run_async(max_concurrency, policy)
+
+    async def _run_async(self, max_concurrency, policy):
+        indegree, blocked, any_failed = await asyncio.to_thread(self._begin_run)
+        ready = self._ready_queue(indegree, policy)
+        self.lanes.bound(max_concurrency or self.dag.max_width())
+        limit = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        task_to_tid = {}
+
+        async def run_limited(tid):
+            async with limit:
+                return await self._run_single_task_async(tid)
+
+        def submit_ready():
+            for tid, lease in self._admit_ready(ready, blocked):
+                coro = run_limited(tid) if limit else self._run_single_task_async(tid)
+                task_to_tid[asyncio.create_task(coro)] = (tid, lease)
+
+        submit_ready()
+        while task_to_tid or ready:
+            if not task_to_tid:
+                await asyncio.to_thread(self._settle_drain)
+                await self.gate.wait_submit_async()
+                submit_ready()
+                continue
+            waiting = set(task_to_tid)
+            gate_open = None
+            if ready and not self.gate.can_submit():
+                gate_open = asyncio.ensure_future(self.gate.wait_submit_async())
+                waiting.add(gate_open)
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if gate_open is not None:
+                gate_open.cancel()
+                done.discard(gate_open)
+            for fut in done:
+                tid, lease = task_to_tid.pop(fut)
+                error = fut.exception()
+                self._release_lanes(lease, ok=error is None)
+                outputs = fut.result() if error is None else None
+                # a finished MAP or failed chunk writes to the cache and checkpoint
+                settled = await asyncio.to_thread(
+                    self._settle_task, tid, outputs, error, indegree, ready, blocked)
+                if not settled:
+                    any_failed = True
+            submit_ready()
+        await asyncio.to_thread(self._end_run, any_failed)
+        return self.results
+
+    def run_distributed(self, max_inflight=None, poll_interval=1, policy="critical_path"):
+        """
+        Run the workflow on external worker processes (see worker.py).
+        Ready tasks are resolved here and pushed onto the Redis work queue;
+        this process only tracks indegrees and records the reported outputs.
+        """
+        check_run_mode(self.workflow_json, "distributed")
+        if BACKEND != "redis":
+            raise RuntimeError(f"Distributed runs share state through Redis, not the {BACKEND} backend")
+        indegree, blocked, any_failed = self._begin_run()
+        clear_results(self.wf_key)
+        reaper = LeaseReaper()
+
+        ready = self._ready_queue(indegree, policy)
+        inflight = {}
+
+        def release_children(tid):
+            for child in self.dag.get(tid, []):
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.push(child)
+
+        while ready or inflight:
+            if not inflight:
+                self._hold_submissions()
+            while ready and self.gate.can_submit() and (not max_inflight or len(inflight) < max_inflight):
+                tid = ready.pop()
                 if tid in blocked:
                     set_task_status(self.wf_key, tid, "PENDING")
                     logger.info(f"Task {tid} blocked (ancestor failed)")
-                else:
-                    fut = pool.submit(self._run_single_task, tid)
-                    future_to_tid[fut] = tid
+                    continue
+                task, cache_key, cached = self._prepare_task(tid)
+                if cached is not None:
+                    self.results[tid] = self._use_cached(tid, cached)
+                    release_children(tid)
+                    continue
+                job_id = enqueue_task(self.wf_key, tid, task, self.base_dir)
+                self.checkpoint.started(tid)
+                inflight[job_id] = (tid, cache_key)
 
-            for tid in ready:
-                submit(tid)
-            ready.clear()
+            if not inflight:
+                continue
+            result = wait_for_result(self.wf_key, timeout=poll_interval)
+            if result is None:
+                reaper.reap()
+                continue
+            entry = inflight.pop(result["job_id"], None)
+            if entry is None:
+                # late duplicate from a job that was requeued
+                continue
+            tid, cache_key = entry
+            if result["ok"]:
+                self.results[tid] = self._record_outputs(
+                    tid, cache_key, result["outputs"], result.get("duration"))
+            else:
+                logger.info(self._fail_task(tid, result["error"]))
+                any_failed = True
+                blocked |= self._get_descendants(tid)
+            release_children(tid)
 
-            while future_to_tid:
-                done, _ = wait(future_to_tid, return_when=FIRST_COMPLETED)
-                for fut in done:
-                    tid = future_to_tid.pop(fut)
-                    try:
-                        outputs = fut.result()
-                        self.results[tid] = outputs
-                    except Exception as e:
-                        any_failed = True
-                        blocked |= self._get_descendants(tid)
-
-                    for child in self.dag.get(tid, []):
-                        indegree[child] -= 1
-                        if indegree[child] == 0:
-                            submit(child)
-        final_status = "FAILED" if any_failed else "COMPLETED"
-        set_workflow_status(self.wf_key, final_status)
+        self._end_run(any_failed)
         return self.results
-    
+
     def _tasks_to_rexecute(self):
+        """
+        Plan incremental execution in one topological pass. Each task's
+        Merkle digest covers its own config, its parents' digests and the
+        fingerprints of its declared file outputs, so a changed config or a
+        deleted/modified artifact invalidates the task and everything
+        downstream of it without a separate descendant walk.
+        """
+        self.manifest = load_manifest(self.wf_key)
+        self.config_hashes = {}
+        self.merkle = {}
+        self.output_digests = {}
         reexec = set()
-        for tid, raw in self.nodes.items():
-            new_hash = compute_hash(raw)
-            cached = load_task_cache(self.wf_key, tid)
-            old_hash = cached[1] if cached else None
-            if new_hash != old_hash:
+        for tid in self.order:
+            self.config_hashes[tid] = compute_hash(self.nodes[tid])
+            self.merkle[tid] = self._merkle_digest(tid)
+            # tasks never run under this workflow key are not forced; they can
+            # still be served from results other workflows left in the cache
+            if tid in self.manifest and self.manifest[tid] != self.merkle[tid]:
                 reexec.add(tid)
+        self.reexec = reexec
 
-        all_reexec = set(reexec)        
-        for tid in list(reexec):
-            all_reexec |= self._get_descendants(tid)
-
-        self.reexec = all_reexec
+        # root tasks resolve to their raw config, so their cache keys are
+        # known now and can be warmed with a single bulk read
+        root_keys = [
+            self._cache_key(tid, self.templates[tid].render({}))
+            for tid in self.dag.roots()
+            if tid not in self.reexec
+        ]
+        if root_keys:
+            prefetch_task_cache(root_keys)
 
     def _get_descendants(self, task_id):
-        seen = set()
-        stack = [task_id]
-        while stack:
-            node = stack.pop()
-            for child in self.dag.get(node, []):
-                if child not in seen:
-                    seen.add(child)
-                    stack.append(child)
-        return seen
+        return self.dag.descendants(task_id)
     
     def _check_paused(self):
-        if get_workflow_status(self.wf_key) == "PAUSED":
-            # busy‑wait until resumed
-            while get_workflow_status(self.wf_key) == "PAUSED":
-                time.sleep(0.5)
+        self.gate.wait()
+
+    async def _check_paused_async(self):
+        await self.gate.wait_async()
+
+    def _settle_drain(self):
+        # a drain turns into a regular pause once nothing is in flight
+        if self.gate.state == "DRAINING":
+            logger.info(f"Workflow {self.wf_key} drained, pausing")
+            self.pause()
+
+    def _hold_submissions(self):
+        if not self.gate.can_submit():
+            self._settle_drain()
+            self.gate.wait_submit()
 
     def pause(self):
+        self.gate.apply("PAUSED")
         set_workflow_status(self.wf_key, "PAUSED")
 
+    def drain(self):
+        """
+        Let in-flight tasks finish but submit no new ones. The workflow
+        becomes PAUSED once it is idle and continues on resume().
+        """
+        self.gate.apply("DRAINING")
+        set_workflow_status(self.wf_key, "DRAINING")
+
     def resume(self):
-        if get_workflow_status(self.wf_key) == "PAUSED":
+        # a task failing while paused overwrites the stored status, not the gate
+        if self.gate.state in ("PAUSED", "DRAINING") or get_workflow_status(self.wf_key) in ("PAUSED", "DRAINING"):
+            self.gate.apply("RUNNING")
             set_workflow_status(self.wf_key, "RUNNING")
 
     def restart(self, from_task=None):
+        self.resume_state = None
         if from_task is None:
             init_workflow(self.wf_key, list(self.nodes.keys()))
         else:
-            queue = [from_task]
-            seen = set()
-            while queue:
-                tid = queue.pop(0)
-                if tid in seen: continue
-                seen.add(tid)
+            if from_task not in self.dag:
+                raise ValueError(f"Unknown task '{from_task}'")
+            for tid in [from_task, *self.dag.descendants(from_task)]:
                 set_task_status(self.wf_key, tid, "PENDING")
-                for child in self.dag.get(tid, []):
-                    queue.append(child)
 
         set_workflow_status(self.wf_key, "PENDING")
 
     def estimate_max_workers(self):
-        width = compute_max_threads(self.dag, self.indegree.copy())
+        width = compute_max_threads(self.dag)
         cpu = os.cpu_count() or 1
         return min(width, cpu * 5)
     
-    def export_dag(self, output_path="workflow"):
+    def export_dag(self, output_path=None):
+        """
+        Render the DAG to png and return its path. Without `output_path` the
+        image goes to <run dir>/.dag/ and is reused while the graph shape
+        stays the same.
+        """
+        if output_path is None:
+            return self.export_dag_async().result()
         png_path = dag_to_dot(
             self.dag,
             all_nodes=self.nodes.keys(),
@@ -204,3 +857,13 @@ class WorkflowEngine:
             engine_name=self.name
         )
         return png_path
+
+    def export_dag_async(self):
+        """
+        Render into <run dir>/.dag/ on the background renderer; returns a
+        Future for the png path.
+        """
+        return renderer.submit(self.dag, self.nodes.keys(), os.path.join(self.base_dir, ".dag"), self.name)
+
+    def graph(self):
+        return graph_json(self.dag, self.nodes, self.order)
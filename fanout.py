@@ -0,0 +1,165 @@
+import json
+import time
+import asyncio
+from collections import deque
+from redis.exceptions import RedisError
+import logging
+logger = logging.getLogger(__name__)
+
+CLIENT_QUEUE_SIZE = 1000
+COALESCE_INTERVAL = 0.1
+RESUBSCRIBE_DELAY = 1.0
+
+
+class ClientFeed:
+    """
+    Bounded outbox for one socket. Events are queued as (payload, data)
+    pairs so batched clients get the original JSON text unchanged.
+
+    In coalescing mode status events are folded into the latest status per
+    node and for the workflow, and flushed once per COALESCE_INTERVAL. A
+    client whose queue fills up is switched to coalescing instead of
+    stalling the feed; other events beyond the bound are counted and
+    reported as EVENTS_DROPPED.
+    """
+    def __init__(self, batched=False, coalesce=False, maxsize=CLIENT_QUEUE_SIZE):
+        self.batched = batched
+        self.coalesce = coalesce
+        self.maxsize = maxsize
+        self.queue = deque()
+        self.nodes = {}
+        self.status = None
+        self.since = None
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+    def put(self, payload, data):
+        if self.coalesce:
+            self._fold(payload, data)
+        elif len(self.queue) < self.maxsize:
+            self.queue.append((payload, data))
+        else:
+            logger.info("Slow websocket client switched to coalesced updates")
+            self.coalesce = True
+            pending = list(self.queue)
+            self.queue.clear()
+            for item in pending:
+                self._fold(*item)
+            self._fold(payload, data)
+        self.wakeup.set()
+
+    def _fold(self, payload, data):
+        typ = data.get("type")
+        if typ in ("NODE_UPDATE_BATCH", "NODE_UPDATE", "WORKFLOW_SNAPSHOT", "workflow_update"):
+            # coalesced events carry the timestamp of the oldest update they hold
+            self.since = self.since or data.get("ts")
+        if typ == "NODE_UPDATE_BATCH":
+            for update in data["updates"]:
+                self.nodes[update["nodeId"]] = update["status"]
+        elif typ == "NODE_UPDATE":
+            self.nodes[data["nodeId"]] = data["status"]
+        elif typ == "WORKFLOW_SNAPSHOT":
+            self.nodes.update(data["nodes"])
+            self.status = data["status"]
+        elif typ == "workflow_update":
+            self.status = data["status"]
+        elif len(self.queue) < self.maxsize:
+            self.queue.append((payload, data))
+        else:
+            self.dropped += 1
+
+    async def next_events(self):
+        """
+        Wait for events and return everything queued as a list of
+        (payload, data); payload is None for events built here.
+        """
+        await self.wakeup.wait()
+        if self.coalesce:
+            await asyncio.sleep(COALESCE_INTERVAL)
+        self.wakeup.clear()
+        events = list(self.queue)
+        self.queue.clear()
+        if not self.coalesce:
+            return events
+        now = time.time()
+        since = self.since or now
+        self.since = None
+        if self.nodes:
+            updates = [{"nodeId": tid, "status": status} for tid, status in self.nodes.items()]
+            events.insert(0, (None, {"type": "NODE_UPDATE_BATCH", "updates": updates, "ts": since}))
+            self.nodes = {}
+        if self.dropped:
+            events.append((None, {"type": "EVENTS_DROPPED", "count": self.dropped, "ts": now}))
+            self.dropped = 0
+        if self.status is not None:
+            events.append((None, {"type": "workflow_update", "status": self.status, "ts": since}))
+            self.status = None
+        return events
+
+
+class WorkflowFeed:
+    """
+    The single Redis subscription for one workflow's events. Each message
+    is decoded once and handed to every attached ClientFeed.
+    """
+    def __init__(self, redis_client, wf_id):
+        self.redis = redis_client
+        self.channel = f"wf:{wf_id}:events"
+        self.clients = set()
+        self.subscribed = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.subscribed.set()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = message["data"]
+                    try:
+                        data = json.loads(payload)
+                    except json.JSONDecodeError:
+                        continue
+                    for client in self.clients:
+                        client.put(payload, data)
+            except RedisError as e:
+                logger.warning(f"Subscription to {self.channel} lost: {e}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                try:
+                    await pubsub.reset()
+                except RedisError:
+                    pass
+
+    def close(self):
+        self.task.cancel()
+
+
+class EventHub:
+    """
+    WorkflowFeeds by workflow ID, created for the first watching socket
+    and closed when the last one leaves.
+    """
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.feeds = {}
+
+    async def attach(self, wf_id, client):
+        feed = self.feeds.get(wf_id)
+        if feed is None:
+            feed = self.feeds[wf_id] = WorkflowFeed(self.redis, wf_id)
+        feed.clients.add(client)
+        # events published before the subscription is live would be lost
+        await feed.subscribed.wait()
+
+    def detach(self, wf_id, client):
+        feed = self.feeds.get(wf_id)
+        if feed is None:
+            return
+        feed.clients.discard(client)
+        if not feed.clients:
+            feed.close()
+            del self.feeds[wf_id]
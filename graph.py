@@ -0,0 +1,149 @@
+from array import array
+from collections import Counter
+from itertools import accumulate, chain, compress, repeat
+from collections.abc import Mapping
+
+DESCENDANT_CACHE_SIZE = 256
+_BITS = bytes.maketrans(b"\x00\x01", b"01")
+_FLAGS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+class TaskGraph(Mapping):
+    """
+    Task DAG with ids interned to ints and edges in CSR arrays: the children
+    of task i are targets[offsets[i]:offsets[i + 1]]. It reads like the
+    {parent: [children]} dict it replaces (graph[tid], graph.get(tid, []),
+    items()), building child lists only on access. Topological order and
+    depths are computed once; descendant sets are computed on first use
+    and the last DESCENDANT_CACHE_SIZE of them kept as bitsets.
+    """
+    def __init__(self, ids, index, offsets, targets, indegree):
+        self.ids = ids
+        self.index = index
+        self.offsets = offsets
+        self.targets = targets
+        self.indegree = indegree
+        self.order = None
+        self.depth = None
+        self._descendants = {}
+
+    @classmethod
+    def from_tasks(cls, tasks):
+        ids = [t["id"] for t in tasks]
+        index = {tid: i for i, tid in enumerate(ids)}
+        if len(index) != len(ids):
+            dup = next(tid for tid, n in Counter(ids).items() if n > 1)
+            raise ValueError(f"Duplicate task id '{dup}'")
+        n = len(ids)
+        # resolve every parent id in one map() rather than per task
+        deps = [t.get("depends_on", ()) for t in tasks]
+        indegree = list(map(len, deps))
+        try:
+            parents = list(map(index.__getitem__, chain.from_iterable(deps)))
+        except KeyError as e:
+            tid = next(t["id"] for t in tasks if e.args[0] in t.get("depends_on", ()))
+            raise ValueError(f"Task '{tid}' depends on unknown '{e.args[0]}'") from None
+        outdeg = array("i", [0]) * n
+        for j in parents:
+            outdeg[j] += 1
+        offsets = array("i", accumulate(outdeg, initial=0))
+        cursor = offsets[:-1]
+        targets = array("i", [0]) * len(parents)
+        for j, i in zip(parents, chain.from_iterable(map(repeat, range(n), indegree))):
+            targets[cursor[j]] = i
+            cursor[j] += 1
+        return cls(ids, index, offsets, targets, array("i", indegree))
+
+    def __getitem__(self, tid):
+        i = self.index[tid]
+        ids = self.ids
+        return [ids[j] for j in self.targets[self.offsets[i]:self.offsets[i + 1]]]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, tid):
+        return tid in self.index
+
+    def edge_count(self):
+        return len(self.targets)
+
+    def indegree_map(self):
+        """
+        A fresh {tid: indegree} dict for one run to count down.
+        """
+        return dict(zip(self.ids, self.indegree))
+
+    def roots(self):
+        return [tid for tid, deg in zip(self.ids, self.indegree) if deg == 0]
+
+    def leaves(self):
+        offsets = self.offsets
+        return [tid for i, tid in enumerate(self.ids) if offsets[i] == offsets[i + 1]]
+
+    def topological_order(self):
+        """
+        Kahn's algorithm over the int arrays. Also records each task's depth
+        (longest path from a root).
+        """
+        if self.order is None:
+            n = len(self.ids)
+            indeg = array("i", self.indegree)
+            depth = array("i", [0]) * n
+            offsets, targets = self.offsets, memoryview(self.targets)
+            order = array("i", (i for i in range(n) if indeg[i] == 0))
+            for i in order:
+                d = depth[i] + 1
+                for j in targets[offsets[i]:offsets[i + 1]]:
+                    if depth[j] < d:
+                        depth[j] = d
+                    indeg[j] -= 1
+                    if indeg[j] == 0:
+                        order.append(j)
+            if len(order) != n:
+                raise RuntimeError("Cycle detected in workflow graph")
+            self.order = order
+            self.depth = depth
+        ids = self.ids
+        return [ids[i] for i in self.order]
+
+    def max_width(self):
+        """
+        Largest number of tasks on one depth level, the most that can ever
+        be ready at once.
+        """
+        if self.depth is None:
+            self.topological_order()
+        return max(Counter(self.depth).values(), default=0)
+
+    def descendant_bits(self, i):
+        """
+        Descendants of task index i as an int bitset (bit j set for task j).
+        """
+        bits = self._descendants.get(i)
+        if bits is None:
+            seen = bytearray(len(self.ids))
+            offsets, targets = self.offsets, memoryview(self.targets)
+            stack = [i]
+            while stack:
+                node = stack.pop()
+                for j in targets[offsets[node]:offsets[node + 1]]:
+                    if not seen[j]:
+                        seen[j] = 1
+                        stack.append(j)
+            bits = int(seen.translate(_BITS)[::-1] or b"0", 2)
+            if len(self._descendants) >= DESCENDANT_CACHE_SIZE:
+                self._descendants.pop(next(iter(self._descendants)))
+            self._descendants[i] = bits
+        return bits
+
+    def descendants(self, tid):
+        bits = self.descendant_bits(self.index[tid])
+        flags = format(bits, f"0{len(self.ids)}b")[::-1].encode().translate(_FLAGS)
+        return set(compress(self.ids, flags))
+
+    def is_descendant(self, tid, ancestor):
+        return bool(self.descendant_bits(self.index[ancestor]) >> self.index[tid] & 1)
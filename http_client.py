@@ -0,0 +1,336 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+import requests
+import aiohttp
+from requests.adapters import HTTPAdapter
+from utils import SpooledBody
+import logging
+logger = logging.getLogger(__name__)
+
+SPOOL_THRESHOLD = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+POOL_CONNECTIONS = 32       # hosts with a cached connection pool
+POOL_MAXSIZE = 32           # keep-alive connections per host
+KEEPALIVE_TIMEOUT = 30
+DEFAULT_TIMEOUT = 60
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30
+DEFAULT_HEDGE_DELAY = 0.5
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class _BodySpool:
+    """
+    Collects a response body in memory and moves it to `path` once it grows
+    past `threshold` (0 streams straight to disk). Spilled data goes to a
+    .part file that only replaces `path` once the body is complete.
+    """
+    def __init__(self, path, threshold=SPOOL_THRESHOLD, tag=""):
+        self.path = path
+        self.part = f"{path}{tag}.part"
+        self.threshold = threshold
+        self.buffer = bytearray()
+        self.file = None
+
+    def _spill(self):
+        os.makedirs(os.path.dirname(self.part) or ".", exist_ok=True)
+        self.file = open(self.part, "wb")
+        self.file.write(self.buffer)
+        self.buffer = None
+
+    def buffers(self, chunk):
+        """
+        True when writing `chunk` only appends to the in-memory buffer.
+        """
+        return self.file is None and len(self.buffer) + len(chunk) <= self.threshold
+
+    def write(self, chunk):
+        if self.file is not None:
+            self.file.write(chunk)
+            return
+        self.buffer += chunk
+        if len(self.buffer) > self.threshold:
+            self._spill()
+
+    def finish(self):
+        if self.file is None:
+            if self.threshold > 0:
+                return bytes(self.buffer)
+            self._spill()
+        self.file.close()
+        os.replace(self.part, self.path)
+        return SpooledBody(self.path)
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            with contextlib.suppress(OSError):
+                os.remove(self.part)
+        self.file = None
+        self.buffer = bytearray()
+
+
+def backoff_delay(base, attempt):
+    """
+    Exponential backoff with jitter: `base` doubled per attempt, capped at
+    MAX_BACKOFF, scaled by a random factor in [0.5, 1).
+    """
+    return min(MAX_BACKOFF, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class RequestPolicy:
+    """
+    Per-task request settings: `timeout` (seconds per connect/read),
+    `retries` and `retry_backoff` (base delay, doubled per attempt, with
+    jitter) and `hedge` (true or a delay in seconds) for idempotent methods.
+    """
+    def __init__(self, task):
+        self.method = task["method"].upper()
+        self.timeout = float(task.get("timeout", DEFAULT_TIMEOUT))
+        self.retries = int(task.get("retries", 0))
+        self.backoff = float(task.get("retry_backoff", DEFAULT_BACKOFF))
+        hedge = task.get("hedge")
+        if hedge is True:
+            hedge = DEFAULT_HEDGE_DELAY
+        if hedge and self.method not in IDEMPOTENT_METHODS:
+            logger.warning(f"Task {task.get('id')}: hedging ignored for {self.method} requests")
+            hedge = None
+        self.hedge = float(hedge) if hedge else None
+
+    def delay(self, attempt):
+        return backoff_delay(self.backoff, attempt)
+
+
+class _Race:
+    """
+    Lets exactly one of several concurrent attempts publish its body.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.won = False
+
+    def claim(self):
+        with self.lock:
+            if self.won:
+                return False
+            self.won = True
+            return True
+
+
+def _retryable(exc):
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUSES
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status in RETRY_STATUSES
+    return isinstance(exc, (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    ))
+
+
+class HttpClient:
+    """
+    RESTAPI transport shared by every task in the process: one
+    requests.Session whose adapter keeps up to `pool_maxsize` keep-alive
+    connections per host, so repeated calls skip the TCP and TLS handshake.
+    """
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.hedge_pool = None
+        self.lock = threading.Lock()
+
+    def _hedge_executor(self):
+        with self.lock:
+            if self.hedge_pool is None:
+                self.hedge_pool = ThreadPoolExecutor(max_workers=self.pool_maxsize * 2,
+                                                     thread_name_prefix="http-hedge")
+            return self.hedge_pool
+
+    def fetch(self, task, path, threshold=SPOOL_THRESHOLD):
+        """
+        Perform the task's request, retrying transient failures. Returns
+        (body, encoding) where body is bytes or a SpooledBody at `path`.
+        """
+        policy = RequestPolicy(task)
+        attempt = 0
+        while True:
+            try:
+                if policy.hedge is not None:
+                    return self._hedged(task, policy, path, threshold)
+                return self._attempt(task, policy, _BodySpool(path, threshold))
+            except Exception as e:
+                if attempt >= policy.retries or not _retryable(e):
+                    raise
+                delay = policy.delay(attempt)
+                attempt += 1
+                logger.info(f"Task {task.get('id')}: retry {attempt}/{policy.retries} in {delay:.2f}s after {e}")
+                time.sleep(delay)
+
+    def _attempt(self, task, policy, spool, race=None):
+        try:
+            with self.session.request(policy.method, task["url"], headers=task.get("headers", {}),
+                                      json=task.get("body"), timeout=policy.timeout,
+                                      stream=True) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    if race is not None and race.won:
+                        spool.discard()
+                        return None
+                    spool.write(chunk)
+                encoding = resp.encoding
+        except BaseException:
+            spool.discard()
+            raise
+        if race is not None and not race.claim():
+            spool.discard()
+            return None
+        return spool.finish(), encoding
+
+    def _hedged(self, task, policy, path, threshold):
+        """
+        Start a second identical request if the first has not completed
+        after `policy.hedge` seconds and keep whichever body finishes first.
+        """
+        pool = self._hedge_executor()
+        race = _Race()
+        futures = [pool.submit(self._attempt, task, policy, _BodySpool(path, threshold, ".0"), race)]
+        done, _ = wait(futures, timeout=policy.hedge)
+        if not done:
+            logger.debug(f"Task {task.get('id')}: hedging after {policy.hedge}s")
+            futures.append(pool.submit(self._attempt, task, policy, _BodySpool(path, threshold, ".1"), race))
+        error = None
+        for fut in as_completed(futures):
+            try:
+                result = fut.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if result is not None:
+                return result
+        raise error
+
+
+# one aiohttp session per event loop, shared by every workflow on that loop
+_aio_sessions = weakref.WeakKeyDictionary()
+_aio_users = weakref.WeakKeyDictionary()
+
+def _aio_session():
+    loop = asyncio.get_running_loop()
+    session = _aio_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_CONNECTIONS * POOL_MAXSIZE,
+                                         limit_per_host=POOL_MAXSIZE,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector)
+        _aio_sessions[loop] = session
+    return session
+
+@contextlib.asynccontextmanager
+async def session_scope():
+    """
+    Keeps the loop's session open while at least one run is inside the
+    scope and closes it when the last one leaves.
+    """
+    loop = asyncio.get_running_loop()
+    _aio_users[loop] = _aio_users.get(loop, 0) + 1
+    try:
+        yield
+    finally:
+        _aio_users[loop] -= 1
+        session = _aio_sessions.get(loop)
+        if _aio_users[loop] == 0 and session is not None:
+            del _aio_sessions[loop]
+            await session.close()
+
+async def _spool_write(spool, chunk):
+    # a cancelled attempt discards its spool, so let a write already running
+    # in its thread finish first
+    future = asyncio.ensure_future(asyncio.to_thread(spool.write, chunk))
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        with contextlib.suppress(BaseException):
+            await future
+        raise
+
+async def _attempt_async(task, policy, spool, race=None):
+    timeout = aiohttp.ClientTimeout(sock_connect=policy.timeout, sock_read=policy.timeout)
+    try:
+        async with _aio_session().request(policy.method, task["url"], headers=task.get("headers", {}),
+                                          json=task.get("body"), timeout=timeout) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                if spool.buffers(chunk):
+                    spool.write(chunk)
+                else:
+                    await _spool_write(spool, chunk)
+            encoding = resp.charset
+    except BaseException:
+        spool.discard()
+        raise
+    if race is not None and not race.claim():
+        await asyncio.to_thread(spool.discard)
+        return None
+    return await asyncio.to_thread(spool.finish), encoding
+
+async def _hedged_async(task, policy, path, threshold):
+    race = _Race()
+    attempts = [asyncio.ensure_future(
+        _attempt_async(task, policy, _BodySpool(path, threshold, ".0"), race))]
+    done, _ = await asyncio.wait(attempts, timeout=policy.hedge)
+    if not done:
+        logger.debug(f"Task {task.get('id')}: hedging after {policy.hedge}s")
+        attempts.append(asyncio.ensure_future(
+            _attempt_async(task, policy, _BodySpool(path, threshold, ".1"), race)))
+    error = None
+    try:
+        for fut in asyncio.as_completed(attempts):
+            try:
+                result = await fut
+            except Exception as e:
+                error = error or e
+                continue
+            if result is not None:
+                return result
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+async def fetch_async(task, path, threshold=SPOOL_THRESHOLD):
+    """
+    Async counterpart of HttpClient.fetch on the loop's shared session.
+    """
+    policy = RequestPolicy(task)
+    attempt = 0
+    while True:
+        try:
+            if policy.hedge is not None:
+                return await _hedged_async(task, policy, path, threshold)
+            return await _attempt_async(task, policy, _BodySpool(path, threshold))
+        except Exception as e:
+            if attempt >= policy.retries or not _retryable(e):
+                raise
+            delay = policy.delay(attempt)
+            attempt += 1
+            logger.info(f"Task {task.get('id')}: retry {attempt}/{policy.retries} in {delay:.2f}s after {e}")
+            await asyncio.sleep(delay)
+
+
+client = HttpClient()
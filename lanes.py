@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+CPU_TYPES = ("SHELL", "PYTHON")
+LATENCY_FACTOR = 2.0
+DECREASE_COOLDOWN = 1.0
+SATURATION = 0.9
+CPU_SAMPLE_INTERVAL = 0.5
+
+
+class CpuMonitor:
+    """
+    System-wide CPU busy fraction from /proc/stat, sampled at most every
+    CPU_SAMPLE_INTERVAL seconds. Where /proc is not available the 1-minute
+    load average per core stands in for it.
+    """
+    def __init__(self):
+        self.last = self._read()
+        self.checked = time.monotonic()
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open("/proc/stat") as f:
+                values = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle + iowait
+        return sum(values), values[3] + (values[4] if len(values) > 4 else 0)
+
+    def busy_fraction(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked >= CPU_SAMPLE_INTERVAL:
+                sample = self._read()
+                if sample is None or self.last is None:
+                    self.busy = os.getloadavg()[0] / (os.cpu_count() or 1)
+                elif sample[0] > self.last[0]:
+                    self.busy = 1 - (sample[1] - self.last[1]) / (sample[0] - self.last[0])
+                self.last = sample
+                self.checked = now
+            return self.busy
+
+    def saturated(self):
+        return self.busy_fraction() >= SATURATION
+
+
+cpu_monitor = CpuMonitor()
+
+
+class Lane:
+    """
+    Concurrency limit for one class of tasks, adapted AIMD-style: every
+    healthy completion adds 1/limit (about +1 per full window), while a
+    failure or a task taking more than LATENCY_FACTOR times its usual
+    duration halves the limit, at most once per DECREASE_COOLDOWN seconds.
+    A lane given a `saturated` check also halves on healthy completions
+    while it reports true, but not below `floor`.
+    """
+    def __init__(self, name, limit, min_limit=1, max_limit=None, saturated=None, floor=None):
+        self.name = name
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit
+        self.saturated = saturated
+        self.floor = floor or min_limit
+        self.in_use = 0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def can_admit(self, weight):
+        # a task heavier than the whole lane may still run on its own
+        return self.in_use == 0 or self.in_use + weight <= int(self.limit)
+
+    def acquire(self, weight):
+        with self.lock:
+            self.in_use += weight
+
+    def release(self, weight, latency=None, expected=None, ok=True):
+        with self.lock:
+            self.in_use -= weight
+            slow = expected and latency is not None and latency > expected * LATENCY_FACTOR
+            if ok and not slow:
+                if self.saturated is not None and self.saturated():
+                    self._decrease(self.floor)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                return
+            self._decrease(self.min_limit)
+
+    def _decrease(self, floor):
+        now = time.monotonic()
+        if now - self.last_decrease >= DECREASE_COOLDOWN and self.limit > floor:
+            self.limit = max(floor, self.limit / 2)
+            self.last_decrease = now
+
+    def bound(self, max_limit):
+        """
+        New upper bound; the limit starts again from it.
+        """
+        with self.lock:
+            self.max_limit = max_limit
+            self.limit = float(max_limit)
+
+    def snapshot(self):
+        return {"limit": round(self.limit, 2), "in_use": self.in_use}
+
+
+class Lanes:
+    """
+    Execution lanes per task type: a SHELL lane shared with PYTHON tasks,
+    I/O lanes for RESTAPI (with an extra lane per host) and EMAIL. SHELL
+    and PYTHON tasks can claim several slots with `"resources": {"cpus": N}`.
+    The SHELL lane is bounded by the caller's worker limit (`max_workers`
+    or bound()) rather than the core count: it starts there and is halved,
+    down to one slot per core, while the CPU is saturated.
+    """
+    def __init__(self, cpus=None, rest_limit=32, per_host_limit=8, email_limit=4, max_workers=None):
+        cpus = cpus or os.cpu_count() or 1
+        self.per_host_limit = per_host_limit
+        shell_limit = max(max_workers or cpus, 1)
+        self.lanes = {
+            "SHELL": Lane("SHELL", shell_limit, max_limit=shell_limit,
+                          saturated=cpu_monitor.saturated, floor=cpus),
+            "RESTAPI": Lane("RESTAPI", rest_limit, max_limit=rest_limit * 8),
+            "EMAIL": Lane("EMAIL", email_limit, max_limit=email_limit * 4),
+            "OTHER": Lane("OTHER", cpus, max_limit=cpus * 4),
+        }
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _host_lane(self, task):
+        url = task.get("url")
+        if not isinstance(url, str) or "{{" in url:
+            return None
+        host = urlsplit(url).netloc
+        if not host:
+            return None
+        with self.lock:
+            if host not in self.hosts:
+                limit = self.per_host_limit
+                self.hosts[host] = Lane(host, limit, max_limit=limit * 8)
+            return self.hosts[host]
+
+    def ticket(self, task):
+        """
+        The lanes a task occupies and its weight in them.
+        """
+        typ = task.get("type")
+        if typ in CPU_TYPES:
+            typ = "SHELL"
+        lane = self.lanes.get(typ, self.lanes["OTHER"])
+        weight = 1
+        if typ == "SHELL":
+            weight = max(1, int(task.get("resources", {}).get("cpus", 1)))
+        lanes = [lane]
+        if typ == "RESTAPI":
+            host_lane = self._host_lane(task)
+            if host_lane is not None:
+                lanes.append(host_lane)
+        return lanes, weight
+
+    def bound(self, max_workers):
+        self.lanes["SHELL"].bound(max(max_workers, 1))
+
+    def try_acquire(self, task):
+        lanes, weight = self.ticket(task)
+        if not all(lane.can_admit(weight) for lane in lanes):
+            return None
+        for lane in lanes:
+            lane.acquire(weight)
+        return lanes, weight
+
+    def release(self, ticket, latency=None, expected=None, ok=True):
+        lanes, weight = ticket
+        for lane in lanes:
+            lane.release(weight, latency, expected, ok)
+
+    def snapshot(self):
+        state = {name: lane.snapshot() for name, lane in self.lanes.items()}
+        with self.lock:
+            state["hosts"] = {host: lane.snapshot() for host, lane in self.hosts.items()}
+        return state
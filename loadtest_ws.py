@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import websockets
+
+def make_workflow(width, sleep):
+    tasks = [{"id": "root", "type": "SHELL", "command": "true", "depends_on": []}]
+    tasks += [{
+        "id": f"t{i}",
+        "type": "SHELL",
+        "command": f"sleep {sleep}",
+        "depends_on": ["root"],
+    } for i in range(width)]
+    return {"workflow_name": "loadtest", "version": str(time.time_ns()), "tasks": tasks}
+
+def cpu_seconds(pid):
+    """
+    utime + stime of a process from /proc (Linux only).
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+async def watcher(url, wf_id, latencies, options, done, ready):
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "WATCH", "workflow_id": wf_id, "batched": True, **options}))
+        await ws.recv()
+        ready.release()
+        async for text in ws:
+            data = json.loads(text)
+            if "ts" in data:
+                latencies.append(time.time() - data["ts"])
+            if data.get("type") == "workflow_update" and data.get("status") in ("COMPLETED", "FAILED"):
+                done.release()
+                return
+
+async def main():
+    parser = argparse.ArgumentParser(description="Open N websocket clients on one workflow")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.05)
+    parser.add_argument("--coalesce", action="store_true")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="pid of the uvicorn process to report CPU time for")
+    args = parser.parse_args()
+
+    options = {"coalesce": True} if args.coalesce else {}
+    async with websockets.connect(args.url, max_size=None) as starter:
+        # a slow root task gives the watchers time to attach before the
+        # fan-out of status events starts
+        workflow = make_workflow(args.width, args.sleep)
+        workflow["tasks"][0]["command"] = "sleep 1"
+        await starter.send(json.dumps({"type": "START", "workflow": workflow, "batched": True}))
+        while True:
+            data = json.loads(await starter.recv())
+            if data.get("type") == "workflow_started":
+                wf_id = data["workflow_id"]
+                break
+
+        latencies = []
+        ready = asyncio.Semaphore(0)
+        done = asyncio.Semaphore(0)
+        cpu_start = cpu_seconds(args.server_pid) if args.server_pid else None
+        start = time.perf_counter()
+        clients = [
+            asyncio.create_task(watcher(args.url, wf_id, latencies, options, done, ready))
+            for _ in range(args.clients)
+        ]
+        for _ in clients:
+            await ready.acquire()
+        attached = time.perf_counter() - start
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{args.clients} clients attached in {attached:.2f}s, run observed in {elapsed:.2f}s")
+    if latencies:
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+        print(f"{len(latencies)} events, latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+              f"p95 {p95 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    if cpu_start is not None:
+        cpu = cpu_seconds(args.server_pid) - cpu_start
+        print(f"server CPU {cpu:.2f}s ({cpu / elapsed * 100:.0f}% of one core)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
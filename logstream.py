@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import queue
+import threading
+from store import r
+import logging
+logger = logging.getLogger(__name__)
+
+TAIL_BYTES = 1024 * 1024
+LOG_INTERVAL = 0.2
+LOG_CHUNK_BYTES = 16 * 1024
+MAX_PENDING_BYTES = 64 * 1024
+PUBLISH_QUEUE_SIZE = 1000
+
+
+class TaskLogStream:
+    """
+    Sink for the output of one running task. Every chunk goes to a spool
+    file (when a directory is given) and into a bounded in-memory tail;
+    recent output is also queued for TASK_LOG events. Writers never block
+    on Redis: output beyond MAX_PENDING_BYTES that has not been published
+    yet is dropped from the live feed (it is still in the spool file) and
+    reported as `dropped` on the next event.
+    """
+    def __init__(self, wf_id, task_id, spool_dir=None, tail_bytes=TAIL_BYTES):
+        self.wf_id = wf_id
+        self.task_id = task_id
+        self.tail_bytes = tail_bytes
+        self.tails = {"stdout": bytearray(), "stderr": bytearray()}
+        self.pending = {"stdout": bytearray(), "stderr": bytearray()}
+        self.dropped = {"stdout": 0, "stderr": 0}
+        self.lock = threading.Lock()
+        self.files = {}
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            name = re.sub(r"[^\w.-]", "_", str(task_id))
+            for stream in self.tails:
+                path = os.path.join(spool_dir, f"{name}.{stream}.log")
+                self.files[stream] = open(path, "wb")
+        if wf_id is not None:
+            publisher.register(self)
+
+    def write(self, stream, chunk):
+        f = self.files.get(stream)
+        if f is not None:
+            f.write(chunk)
+        with self.lock:
+            tail = self.tails[stream]
+            tail += chunk
+            if len(tail) > self.tail_bytes:
+                del tail[:len(tail) - self.tail_bytes]
+            if self.wf_id is None:
+                return
+            pending = self.pending[stream]
+            room = MAX_PENDING_BYTES - len(pending)
+            if room < len(chunk):
+                self.dropped[stream] += len(chunk) - max(room, 0)
+                chunk = chunk[:max(room, 0)]
+            pending += chunk
+
+    def new_attempt(self, attempt):
+        """
+        Start over for a retry: the tails (and so the task's output) only
+        hold this attempt, while the spool files and the live feed keep the
+        earlier ones behind a delimiter line.
+        """
+        marker = f"\n----- attempt {attempt} -----\n".encode()
+        with self.lock:
+            for stream, tail in self.tails.items():
+                tail.clear()
+                f = self.files.get(stream)
+                if f is not None:
+                    f.write(marker)
+                if self.wf_id is not None:
+                    self.pending[stream] += marker
+
+    def take_events(self):
+        events = []
+        with self.lock:
+            for stream, pending in self.pending.items():
+                if not pending and not self.dropped[stream]:
+                    continue
+                data = bytes(pending[:LOG_CHUNK_BYTES])
+                del pending[:LOG_CHUNK_BYTES]
+                events.append({
+                    "type": "TASK_LOG",
+                    "nodeId": self.task_id,
+                    "stream": stream,
+                    "data": data.decode("utf-8", errors="replace"),
+                    "dropped": self.dropped[stream],
+                    "ts": time.time(),
+                })
+                self.dropped[stream] = 0
+        return events
+
+    def tail(self, stream="stdout"):
+        with self.lock:
+            return bytes(self.tails[stream]).decode("utf-8", errors="replace")
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        if self.wf_id is not None:
+            publisher.unregister(self)
+
+
+class LogPublisher:
+    """
+    Background thread that turns pending task output into TASK_LOG events,
+    at most one per stream and task every LOG_INTERVAL seconds.
+    """
+    def __init__(self):
+        self.streams = set()
+        self.lock = threading.Lock()
+        self.outbox = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self.thread = None
+
+    def register(self, stream):
+        with self.lock:
+            self.streams.add(stream)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-publisher", daemon=True)
+                self.thread.start()
+
+    def unregister(self, stream):
+        # publish whatever the task wrote since the last tick
+        while self._collect(stream):
+            pass
+        with self.lock:
+            self.streams.discard(stream)
+
+    def _collect(self, stream):
+        events = stream.take_events()
+        for event in events:
+            try:
+                self.outbox.put_nowait((stream.wf_id, event))
+            except queue.Full:
+                logger.debug(f"Log event for task {stream.task_id} dropped")
+        return len(events)
+
+    def _publish_pending(self):
+        pipe = None
+        while True:
+            try:
+                wf_id, event = self.outbox.get_nowait()
+            except queue.Empty:
+                break
+            if pipe is None:
+                pipe = r.pipeline(transaction=False)
+            pipe.publish(f"wf:{wf_id}:events", json.dumps(event))
+        if pipe is not None:
+            pipe.execute()
+
+    def _run(self):
+        while True:
+            time.sleep(LOG_INTERVAL)
+            with self.lock:
+                streams = list(self.streams)
+            for stream in streams:
+                self._collect(stream)
+            try:
+                self._publish_pending()
+            except Exception as e:
+                logger.warning(f"Publishing task logs failed: {e}")
+
+
+publisher = LogPublisher()
@@ -0,0 +1,205 @@
+import os
+import time
+import queue
+import smtplib
+import threading
+from concurrent.futures import Future
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+import logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")    # ssl | starttls | none
+SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+APP_PASSWORD = os.getenv("APP_PASSWORD")
+
+BATCH_WINDOW = 0.05
+MAX_BATCH = 100
+IDLE_TIMEOUT = 60
+NOOP_AFTER = 10
+SMTP_TIMEOUT = 30
+
+
+def server_key(task):
+    """
+    The SMTP session a task is sent through. Tasks may override the server
+    with `"smtp": {"host", "port", "security"}`; credentials always come
+    from the environment.
+    """
+    smtp = task.get("smtp", {})
+    return (
+        smtp.get("host", SMTP_HOST),
+        int(smtp.get("port", SMTP_PORT)),
+        smtp.get("security", SMTP_SECURITY),
+        SENDER_EMAIL,
+    )
+
+def build_message(task, sender):
+    msg = MIMEMultipart()
+    msg["From"] = sender or ""
+    msg["To"] = ""
+    msg["Subject"] = task["subject"]
+    msg.attach(MIMEText(task["emailBody"], "plain"))
+    return msg
+
+def _describe(exc, recipient):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and recipient in exc.recipients:
+        code, reply = exc.recipients[recipient]
+        return f"{code} {reply.decode(errors='replace')}"
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return f"{exc.smtp_code} {exc.smtp_error.decode(errors='replace')}"
+    return str(exc)
+
+
+class SmtpSession:
+    """
+    One logged-in SMTP connection, reopened on demand and checked with
+    NOOP after it has been idle for NOOP_AFTER seconds.
+    """
+    def __init__(self, key):
+        self.host, self.port, self.security, self.user = key
+        self.smtp = None
+        self.last_used = 0.0
+
+    def _open(self):
+        if self.security == "ssl":
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            if self.security == "starttls":
+                smtp.starttls()
+        if self.user and APP_PASSWORD:
+            smtp.login(self.user, APP_PASSWORD)
+        logger.debug(f"SMTP session opened to {self.host}:{self.port}")
+        return smtp
+
+    def ensure(self):
+        if self.smtp is not None and time.monotonic() - self.last_used > NOOP_AFTER:
+            try:
+                if self.smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self.smtp is None:
+            self.smtp = self._open()
+
+    def send(self, sender, recipient, data):
+        for attempt in (0, 1):
+            self.ensure()
+            try:
+                self.smtp.sendmail(sender, [recipient], data)
+                self.last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+        self.smtp = None
+
+
+class Mailer:
+    """
+    Sends EMAIL tasks through one pooled session per server and credential
+    set. Each server has a sender thread that collects the tasks submitted
+    within BATCH_WINDOW into a batch and sends every recipient of the batch
+    over the same connection; the thread and its session go away after
+    IDLE_TIMEOUT seconds without mail.
+    """
+    def __init__(self, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, idle_timeout=IDLE_TIMEOUT):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def submit(self, task):
+        """
+        Queue a task for delivery. The returned future resolves to
+        {"sent": [...], "failed": {recipient: error}}.
+        """
+        future = Future()
+        key = server_key(task)
+        with self.lock:
+            q = self.queues.get(key)
+            if q is None:
+                q = self.queues[key] = queue.Queue()
+                threading.Thread(target=self._serve, args=(key, q),
+                                 name=f"smtp-{key[0]}", daemon=True).start()
+            q.put((task, future))
+        return future
+
+    def send(self, task):
+        return self.submit(task).result()
+
+    def _next_batch(self, key, q):
+        try:
+            batch = [q.get(timeout=self.idle_timeout)]
+        except queue.Empty:
+            with self.lock:
+                if q.empty():
+                    del self.queues[key]
+                    return None
+            return []
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self, key, q):
+        session = SmtpSession(key)
+        try:
+            while True:
+                batch = self._next_batch(key, q)
+                if batch is None:
+                    return
+                if batch:
+                    self._send_batch(session, batch)
+        finally:
+            session.close()
+
+    def _send_batch(self, session, batch):
+        sender = session.user
+        try:
+            session.ensure()
+        except Exception as e:
+            logger.warning(f"SMTP connection to {session.host}:{session.port} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        logger.debug(f"Sending {len(batch)} email task(s) via {session.host}")
+        for task, future in batch:
+            try:
+                msg = build_message(task, sender)
+                sent, failed = [], {}
+                for recipient in task["recipients"]:
+                    msg.replace_header("To", recipient)
+                    try:
+                        session.send(sender, recipient, msg.as_string())
+                        sent.append(recipient)
+                    except (smtplib.SMTPException, OSError) as e:
+                        failed[recipient] = _describe(e, recipient)
+                        logger.debug(f"Email to {recipient} failed: {e}")
+                future.set_result({"sent": sent, "failed": failed})
+            except Exception as e:
+                future.set_exception(e)
+
+
+mailer = Mailer()
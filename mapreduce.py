@@ -0,0 +1,130 @@
+import json
+import time
+from blobs import blobs
+from templates import CompiledTask
+from utils import compile_outputs
+
+DEFAULT_CHUNK_SIZE = 1
+
+
+class MapExpansion:
+    """
+    What running a MAP node yields: the items it fans out over. The engine
+    turns it into chunk executions on its ready queue.
+    """
+    def __init__(self, items, cache_key, context):
+        self.items = items
+        self.cache_key = cache_key
+        self.context = context
+
+
+def map_items(task, context):
+    name = task["over"]
+    items = blobs.materialize(context.get(name))
+    if not isinstance(items, list):
+        raise ValueError(f"MAP task {task.get('id')}: input '{name}' is not a list")
+    return items
+
+def item_context(context, item, index):
+    """
+    Parent outputs plus {{item}}, {{index}} and, for object items,
+    {{item.<key>}} for each key.
+    """
+    ctx = dict(context)
+    ctx["item"] = json.dumps(item) if isinstance(item, (dict, list)) else item
+    ctx["index"] = index
+    if isinstance(item, dict):
+        for key, value in item.items():
+            ctx[f"item.{key}"] = value
+    return ctx
+
+
+class MapState:
+    """
+    Progress of one expanded MAP task: item i belongs to chunk
+    "<map id>[i // chunk_size]", and at most `max_parallel` chunks of the
+    map run at once (no limit when unset).
+    """
+    def __init__(self, map_id, task, expansion):
+        self.map_id = map_id
+        self.items = expansion.items
+        self.cache_key = expansion.cache_key
+        self.context = expansion.context
+        self.template = CompiledTask(task["task"])
+        self.plan = compile_outputs(task["task"])
+        size = max(1, int(task.get("chunk_size", DEFAULT_CHUNK_SIZE)))
+        n = len(self.items)
+        self.chunks = {
+            f"{map_id}[{start // size}]": (start, min(start + size, n))
+            for start in range(0, n, size)
+        }
+        self.max_parallel = task.get("max_parallel")
+        self.outputs = [None] * n
+        self.pending = len(self.chunks)
+        self.running = 0
+        self.failed = False
+        self.started = time.monotonic()
+
+    def can_start(self):
+        return not self.max_parallel or self.running < self.max_parallel
+
+    def item_task(self, index):
+        return self.template.render_context(item_context(self.context, self.items[index], index))
+
+    def store(self, chunk_id, outputs):
+        start, stop = self.chunks[chunk_id]
+        self.outputs[start:stop] = outputs
+        self.pending -= 1
+
+    def result(self):
+        return {"results": self.outputs, "count": len(self.outputs)}
+
+
+REDUCE_OPS = {
+    "collect": lambda values: values,
+    "concat": lambda values: [v for value in values for v in value],
+    "sum": sum,
+    "count": len,
+    "min": min,
+    "max": max,
+}
+NUMERIC_OPS = {"sum", "min", "max"}
+
+def _number(task, op, value):
+    # SHELL outputs are text, so "42\n" counts as 42
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        for parse in (int, float):
+            try:
+                return parse(text)
+            except ValueError:
+                pass
+    raise ValueError(f"REDUCE task {task.get('id')}: op '{op}' needs numbers, got {value!r}")
+
+def reduce_outputs(task, map_outputs):
+    """
+    Outputs of a REDUCE task from the per-item outputs of its MAP.
+    `"reduce": {"<name>": {"field": "<item output>", "op": "sum"}}` picks
+    the field of every item and combines the values; without a spec each
+    item output is collected into a list of the same name.
+    """
+    items = blobs.materialize(map_outputs["results"])
+    spec = task.get("reduce")
+    if spec is None:
+        fields = list(dict.fromkeys(name for outputs in items for name in outputs))
+        return {name: [blobs.materialize(outputs.get(name)) for outputs in items] for name in fields}
+    reduced = {}
+    for name, rule in spec.items():
+        op = rule.get("op", "collect")
+        if op not in REDUCE_OPS:
+            raise ValueError(f"REDUCE task {task.get('id')}: unknown op '{op}'")
+        if "field" in rule:
+            values = [blobs.materialize(outputs.get(rule["field"])) for outputs in items]
+        else:
+            values = items
+        if op in NUMERIC_OPS:
+            values = [_number(task, op, value) for value in values]
+        reduced[name] = REDUCE_OPS[op](values)
+    return reduced
@@ -0,0 +1,328 @@
+import io
+import os
+import sys
+import json
+import uuid
+import shlex
+import time
+import signal
+import struct
+import select
+import shutil
+import tempfile
+import importlib
+import threading
+import contextlib
+import subprocess
+import logging
+logger = logging.getLogger(__name__)
+
+PREFORK_WORKERS = int(os.getenv("WIZFLOW_PREFORK_WORKERS", str(max(2, os.cpu_count() or 1))))
+PREFORK_MAX_TASKS = int(os.getenv("WIZFLOW_PREFORK_MAX_TASKS", "1000"))
+CHUNK_SIZE = 64 * 1024
+STDERR_TAIL = 1024 * 1024
+POLL_INTERVAL = 0.1
+FRAME_HEADER = struct.Struct(">I")
+
+
+class WorkerTimeout(Exception):
+    pass
+
+
+class WorkerCancelled(Exception):
+    pass
+
+
+class WorkerDied(Exception):
+    pass
+
+
+class _Worker:
+    """
+    A long-lived child process in its own session, so killing it also kills
+    whatever the current task started.
+    """
+    def __init__(self, proc):
+        self.proc = proc
+        self.tasks = 0
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        self.proc.wait()
+
+    def _wait_readable(self, fd, deadline, cancel):
+        """
+        Block until `fd` has data, raising WorkerTimeout past `deadline`
+        (time.monotonic) and WorkerCancelled once `cancel` is set.
+        """
+        while True:
+            step = POLL_INTERVAL if cancel is not None else None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                step = remaining if step is None else min(step, remaining)
+            readable, _, _ = select.select([fd], [], [], step)
+            if readable:
+                return
+            if cancel is not None and cancel.is_set():
+                raise WorkerCancelled()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise WorkerTimeout()
+
+
+class ShellWorker(_Worker):
+    """
+    A persistent /bin/sh session. Each command runs in a subshell that cd's
+    to the task's directory, so cwd, variables and `exit` stay contained;
+    stdin is /dev/null and stderr goes to a private file. Completion is
+    framed on stdout by a marker line with the exit code.
+    """
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="wizflow-sh-")
+        self.errfile = os.path.join(self.dir, "stderr")
+        self.token = f"__wizflow_{uuid.uuid4().hex}__"
+        super().__init__(subprocess.Popen(
+            ["/bin/sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, start_new_session=True, bufsize=0))
+
+    def kill(self):
+        super().kill()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def run(self, command, cwd, log, deadline=None, cancel=None):
+        """
+        Run one command, streaming stdout into `log`. Returns the exit code.
+        """
+        marker = f"{self.token}{self.tasks}"
+        script = (f"( cd -- {shlex.quote(cwd)} && eval {shlex.quote(command)} ) "
+                  f"</dev/null 2>{shlex.quote(self.errfile)}; "
+                  f"printf '\\n%s %d\\n' {marker} \"$?\"\n")
+        try:
+            self.proc.stdin.write(script.encode())
+        except BrokenPipeError:
+            raise WorkerDied("shell worker exited")
+        fd = self.proc.stdout.fileno()
+        end = f"\n{marker} ".encode()
+        buf = bytearray()
+        while True:
+            self._wait_readable(fd, deadline, cancel)
+            chunk = os.read(fd, CHUNK_SIZE)
+            if not chunk:
+                raise WorkerDied("shell worker exited")
+            buf += chunk
+            idx = buf.find(end)
+            if idx != -1:
+                nl = buf.find(b"\n", idx + len(end))
+                if nl == -1:
+                    continue
+                log.write("stdout", bytes(buf[:idx]))
+                returncode = int(buf[idx + len(end):nl])
+                break
+            # hold back what could be the start of the marker
+            keep = len(end) - 1
+            if len(buf) > keep:
+                log.write("stdout", bytes(buf[:-keep]))
+                del buf[:-keep]
+        with open(self.errfile, "rb") as f:
+            f.seek(max(os.fstat(f.fileno()).st_size - STDERR_TAIL, 0))
+            err = f.read()
+        if err:
+            log.write("stderr", err)
+        return returncode
+
+
+class PythonWorker(_Worker):
+    """
+    A Python interpreter that imports and calls `module:function` targets.
+    Requests and replies are length-prefixed JSON frames on stdin/stdout.
+    """
+    def __init__(self):
+        env = dict(os.environ)
+        paths = [os.path.dirname(os.path.abspath(__file__)), os.getcwd(), env.get("PYTHONPATH", "")]
+        env["PYTHONPATH"] = os.pathsep.join(p for p in paths if p)
+        super().__init__(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, start_new_session=True, env=env, bufsize=0))
+
+    def call(self, request, deadline=None, cancel=None):
+        try:
+            _write_frame(self.proc.stdin, request)
+        except BrokenPipeError:
+            raise WorkerDied("python worker exited")
+        self._wait_readable(self.proc.stdout.fileno(), deadline, cancel)
+        reply = _read_frame(self.proc.stdout)
+        if reply is None:
+            raise WorkerDied("python worker exited")
+        return reply
+
+
+def _write_frame(f, obj):
+    data = json.dumps(obj).encode()
+    f.write(FRAME_HEADER.pack(len(data)) + data)
+    f.flush()
+
+def _read_exact(f, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = f.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+def _read_frame(f):
+    header = _read_exact(f, FRAME_HEADER.size)
+    if header is None:
+        return None
+    data = _read_exact(f, FRAME_HEADER.unpack(header)[0])
+    return None if data is None else json.loads(data)
+
+
+class WorkerPool:
+    """
+    Up to `size` warm workers, all started up front. A worker goes back to
+    the pool after a successful task; after `max_tasks` tasks or any
+    failure it is killed and a fresh one takes its place.
+    """
+    def __init__(self, factory, size=PREFORK_WORKERS, max_tasks=PREFORK_MAX_TASKS):
+        self.factory = factory
+        self.size = size
+        self.max_tasks = max_tasks
+        self.idle = [factory() for _ in range(size)]
+        self.count = size
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.count >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            return self.factory()
+        except BaseException:
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, worker, healthy):
+        worker.tasks += 1
+        if healthy and worker.tasks < self.max_tasks and worker.alive():
+            with self.cond:
+                self.idle.append(worker)
+                self.cond.notify()
+            return
+        worker.kill()
+        try:
+            fresh = self.factory()
+        except Exception as e:
+            logger.warning(f"Could not replace recycled worker: {e}")
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            return
+        with self.cond:
+            self.idle.append(fresh)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+        for worker in idle:
+            worker.kill()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(kind, factory):
+    with _pools_lock:
+        if kind not in _pools:
+            _pools[kind] = WorkerPool(factory)
+            logger.info(f"Started {PREFORK_WORKERS} pre-forked {kind} workers")
+        return _pools[kind]
+
+def shell_pool():
+    return _pool("shell", ShellWorker)
+
+def python_pool():
+    return _pool("python", PythonWorker)
+
+
+def run_shell(command, cwd, log, deadline=None, cancel=None):
+    """
+    Run a command in a warm shell session and return its exit code. The
+    session is recycled after a non-zero exit, a timeout or a cancel.
+    """
+    pool = shell_pool()
+    worker = pool.acquire()
+    returncode = None
+    try:
+        returncode = worker.run(command, cwd, log, deadline, cancel)
+    finally:
+        pool.release(worker, returncode == 0)
+    return returncode
+
+def call_python(target, args, kwargs, cwd, deadline=None, cancel=None):
+    """
+    Call `target` ("module:function") in a warm interpreter. Returns the
+    worker's reply: {"ok", "result" or "error", "stdout", "stderr"}.
+    """
+    request = {"target": target, "args": args, "kwargs": kwargs, "cwd": cwd}
+    pool = python_pool()
+    worker = pool.acquire()
+    reply = None
+    try:
+        reply = worker.call(request, deadline, cancel)
+    finally:
+        pool.release(worker, reply is not None and reply["ok"])
+    return reply
+
+
+def _resolve(target, cache={}):
+    if target not in cache:
+        module, _, name = target.partition(":")
+        obj = importlib.import_module(module)
+        for part in name.split("."):
+            obj = getattr(obj, part)
+        cache[target] = obj
+    return cache[target]
+
+def _serve_call(request):
+    out, err = io.StringIO(), io.StringIO()
+    reply = {"ok": True}
+    home = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            os.chdir(request["cwd"])
+            try:
+                reply["result"] = _resolve(request["target"])(*request["args"], **request["kwargs"])
+            finally:
+                os.chdir(home)
+        json.dumps(reply["result"])
+    except Exception as e:
+        reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    reply["stdout"] = out.getvalue()
+    reply["stderr"] = err.getvalue()
+    return reply
+
+def python_worker_main():
+    requests_in = sys.stdin.buffer
+    replies = os.fdopen(os.dup(1), "wb")
+    # stray writes to fd 1 must not corrupt the reply frames
+    os.dup2(2, 1)
+    while True:
+        request = _read_frame(requests_in)
+        if request is None:
+            return
+        _write_frame(replies, _serve_call(request))
+
+
+if __name__ == "__main__":
+    python_worker_main()
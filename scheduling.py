@@ -0,0 +1,74 @@
+import heapq
+import itertools
+import statistics
+
+
+class ReadyQueue:
+    """
+    Ready tasks ordered by priority (highest first), FIFO among equals.
+    Without priorities it behaves like the plain deque it replaces.
+    """
+    def __init__(self, priorities=None, items=()):
+        self.priorities = priorities
+        self.heap = []
+        self.seq = itertools.count()
+        for tid in items:
+            self.push(tid)
+
+    def push(self, tid):
+        prio = self.priorities.get(tid, 0) if self.priorities else 0
+        heapq.heappush(self.heap, (-prio, next(self.seq), tid))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+
+def task_weights(task_ids, durations):
+    """
+    Expected runtime per task from recorded duration samples. With no
+    history at all every task weighs 1; tasks without history of their own
+    get the median of the known ones.
+    """
+    known = {tid: statistics.fmean(samples) for tid, samples in durations.items() if samples}
+    if not known:
+        return {tid: 1.0 for tid in task_ids}
+    default = statistics.median(known.values())
+    return {tid: known.get(tid, default) for tid in task_ids}
+
+def critical_path_priorities(dag, order, weights):
+    """
+    Longest weighted path from each task to a sink, computed in one pass
+    over the reversed topological order.
+    """
+    prio = {}
+    for tid in reversed(order):
+        prio[tid] = weights[tid] + max((prio[c] for c in dag.get(tid, [])), default=0)
+    return prio
+
+def simulate_schedule(dag, indegree, weights, max_workers, priorities=None):
+    """
+    Replay a list schedule with `max_workers` slots and the given task
+    weights as runtimes. Returns (makespan, {task_id: start_time}).
+    """
+    indeg = dict(indegree)
+    ready = ReadyQueue(priorities, [t for t, d in indeg.items() if d == 0])
+    running = []
+    starts = {}
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < max_workers:
+            tid = ready.pop()
+            starts[tid] = now
+            heapq.heappush(running, (now + weights[tid], tid))
+        now, tid = heapq.heappop(running)
+        for child in dag.get(tid, []):
+            indeg[child] -= 1
+            if indeg[child] == 0:
+                ready.push(child)
+    return now, starts
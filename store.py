@@ -1,38 +1,153 @@
-import redis
 import json
+import time
+import atexit
+import threading
+from backend import r, BackendError
+import logging
+logger = logging.getLogger(__name__)
 
-r = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+FLUSH_INTERVAL = 0.05
+MAX_BATCH = 500
 
 def publish_event(wf_id, payload):
     channel = f"wf:{wf_id}:events"
     r.publish(channel, json.dumps(payload))
 
+
+class StateWriter:
+    """
+    Buffers task status changes and writes them in one pipeline per flush.
+    Repeated updates of the same task inside a flush window are coalesced,
+    and each workflow gets a single NODE_UPDATE_BATCH event per flush.
+    A flush happens every `flush_interval` seconds or once `max_batch`
+    distinct tasks are pending, whichever comes first. Both happen on the
+    writer thread, so setting a status never waits on the backend; only
+    an explicit flush() does.
+    """
+    def __init__(self, client, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pending = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.full = threading.Event()
+        self.thread = None
+
+    def set_task_status(self, wf_id, task_id, status):
+        with self.lock:
+            statuses = self.pending.setdefault(wf_id, {})
+            if task_id not in statuses:
+                self.count += 1
+            statuses[task_id] = status
+            if self.count >= self.max_batch:
+                self.full.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+                self.thread.start()
+
+    def _take(self, wf_id=None):
+        with self.lock:
+            if wf_id is None:
+                batch, self.pending = self.pending, {}
+                self.count = 0
+            elif wf_id in self.pending:
+                batch = {wf_id: self.pending.pop(wf_id)}
+                self.count -= len(batch[wf_id])
+            else:
+                batch = {}
+        return batch
+
+    def _requeue(self, batch):
+        # updates made while the batch was in flight are newer and win
+        with self.lock:
+            for wf, statuses in batch.items():
+                current = self.pending.setdefault(wf, {})
+                for tid, status in statuses.items():
+                    if tid not in current:
+                        current[tid] = status
+                        self.count += 1
+
+    def flush(self, wf_id=None):
+        # flush_lock keeps batches from overtaking each other on the wire
+        with self.flush_lock:
+            batch = self._take(wf_id)
+            if not batch:
+                return
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for wf, statuses in batch.items():
+                    pipe.hset(f"wf:{wf}:tasks", mapping=statuses)
+                    pipe.publish(f"wf:{wf}:events", json.dumps({
+                        "type": "NODE_UPDATE_BATCH",
+                        "updates": [
+                            {"nodeId": tid, "status": status}
+                            for tid, status in statuses.items()
+                        ],
+                        "ts": time.time(),
+                    }))
+                pipe.execute()
+            except BaseException:
+                self._requeue(batch)
+                raise
+
+    def _run(self):
+        while True:
+            try:
+                self.full.wait(self.flush_interval)
+                self.full.clear()
+                if self.pending:
+                    self.flush()
+            except BackendError as e:
+                logger.warning(f"Task status flush failed, retrying: {e}")
+                time.sleep(self.flush_interval)
+            except Exception:
+                logger.exception("Task status flush failed, retrying")
+                time.sleep(self.flush_interval)
+
+
+writer = StateWriter(r)
+atexit.register(writer.flush)
+
 def init_workflow(wf_id, task_ids):
-    key_tasks = f"wf:{wf_id}:tasks"
+    writer.flush(wf_id)
     mapping = {tid: "PENDING" for tid in task_ids}
-    r.hset(key_tasks, mapping=mapping)
-    r.set(f"wf:{wf_id}:status", "PENDING")
-    publish_event(wf_id, {"type": "workflow_update", "status": "PENDING"})
-    for tid in task_ids:
-        publish_event(wf_id, {"type": "NODE_UPDATE", "nodeId": tid, "status": "PENDING"})
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(f"wf:{wf_id}:tasks", mapping=mapping)
+    pipe.set(f"wf:{wf_id}:status", "PENDING")
+    pipe.publish(f"wf:{wf_id}:events", json.dumps({
+        "type": "WORKFLOW_SNAPSHOT",
+        "status": "PENDING",
+        "nodes": mapping,
+        "ts": time.time(),
+    }))
+    pipe.publish(f"wf:{wf_id}:control", "PENDING")
+    pipe.execute()
 
 def set_task_status(wf_id, task_id, status):
-    r.hset(f"wf:{wf_id}:tasks", task_id, status)
-    publish_event(wf_id, {
-        "type": "NODE_UPDATE",
-        "nodeId": task_id,
-        "status": status
-    })
+    writer.set_task_status(wf_id, task_id, status)
+
+def flush_task_statuses(wf_id=None):
+    writer.flush(wf_id)
 
 def get_task_status(wf_id):
+    writer.flush(wf_id)
     return r.hgetall(f"wf:{wf_id}:tasks")
 
 def set_workflow_status(wf_id, status):
-    r.set(f"wf:{wf_id}:status", status)
-    publish_event(wf_id, {
+    # node updates must reach subscribers before the workflow-level event
+    writer.flush(wf_id)
+    pipe = r.pipeline(transaction=False)
+    pipe.set(f"wf:{wf_id}:status", status)
+    pipe.publish(f"wf:{wf_id}:events", json.dumps({
         "type": "workflow_update",
-        "status": status
-    })
+        "status": status,
+        "ts": time.time(),
+    }))
+    # pause gates in every process follow this channel (see control.py)
+    pipe.publish(f"wf:{wf_id}:control", status)
+    pipe.execute()
 
 def get_workflow_status(wf_id):
     return r.get(f"wf:{wf_id}:status")
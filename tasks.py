@@ -1,9 +1,18 @@
 import subprocess
-import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from dotenv import load_dotenv
+import asyncio
+import json
+import re
+import time
+import signal
+import shutil
+import threading
+import contextlib
+import http_client
+import prefork
+from http_client import SPOOL_THRESHOLD, DEFAULT_BACKOFF, backoff_delay
+from mailer import mailer
+from utils import SpooledBody
+from logstream import TaskLogStream
 import os
 import logging
 logger = logging.getLogger(__name__)
@@ -15,71 +24,341 @@ EXECUTION_FLAGS = {
 results = {}
 error_info = None
 
-def execute_shell(task, cwd = None):
+CHUNK_SIZE = 64 * 1024
+# task types that run in the run directory and write a task log
+PROCESS_TYPES = ("SHELL", "PYTHON")
+SHELL_EXECUTOR = os.getenv("WIZFLOW_SHELL_EXECUTOR", "spawn")
+CANCEL_POLL = 0.1
+READER_GRACE = 2.0
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def _pump(pipe, stream, log):
+    for chunk in iter(lambda: pipe.read1(CHUNK_SIZE), b""):
+        log.write(stream, chunk)
+    pipe.close()
+
+def _task_timeout(task):
+    timeout = task.get("timeout")
+    return float(timeout) if timeout else None
+
+def _kill_group(pid):
+    # commands run in their own session, so this also reaches the children
+    # the shell started
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def _wait_shell(proc, task, timeout, cancel):
+    """
+    Wait for the command, killing its process group once `timeout` seconds
+    have passed or `cancel` (a threading.Event) is set.
+    """
+    if timeout is None and cancel is None:
+        return proc.wait()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        step = CANCEL_POLL if cancel is not None else None
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0)
+            step = remaining if step is None else min(step, remaining)
+        try:
+            return proc.wait(step)
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel is not None and cancel.is_set():
+            _kill_group(proc.pid)
+            proc.wait()
+            raise TaskCancelled(f"Task {task.get('id')} cancelled")
+        if deadline is not None and time.monotonic() >= deadline:
+            _kill_group(proc.pid)
+            proc.wait()
+            raise TaskTimeout(f"Shell task timed out after {timeout:g}s")
+
+def _uses_prefork(task):
+    return task.get("executor", SHELL_EXECUTOR) == "prefork"
+
+def _deadline(task):
+    timeout = _task_timeout(task)
+    return None if timeout is None else time.monotonic() + timeout
+
+def _run_prefork(task, call):
+    """
+    Run `call(deadline)` against a pre-forked worker, translating the pool's
+    timeout and cancel errors into the task-level ones.
+    """
+    try:
+        return call(_deadline(task))
+    except prefork.WorkerTimeout:
+        raise TaskTimeout(f"{task['type'].capitalize()} task timed out after {_task_timeout(task):g}s")
+    except prefork.WorkerCancelled:
+        raise TaskCancelled(f"Task {task.get('id')} cancelled")
+
+def execute_shell_prefork(task, cwd=None, log=None, cancel=None):
+    """
+    execute_shell on a warm shell session from the prefork pool instead of a
+    freshly spawned /bin/sh.
+    """
+    log = log or TaskLogStream(None, task.get("id"))
+    returncode = _run_prefork(task, lambda deadline: prefork.run_shell(
+        task['command'], os.path.abspath(cwd or os.getcwd()), log, deadline, cancel))
+    if returncode != 0:
+        raise Exception(f"Shell task failed: {log.tail('stderr').strip()}")
+    return log.tail("stdout").strip()
+
+def execute_python(task, cwd=None, log=None, cancel=None):
+    """
+    Call the task's `callable` ("module:function") with its `args` and
+    `kwargs` in a pre-forked interpreter. The return value must be JSON
+    serialisable; printed output goes to the task log.
+    """
+    log = log or TaskLogStream(None, task.get("id"))
+    reply = _run_prefork(task, lambda deadline: prefork.call_python(
+        task['callable'], task.get("args", []), task.get("kwargs", {}),
+        os.path.abspath(cwd or os.getcwd()), deadline, cancel))
+    for stream in ("stdout", "stderr"):
+        if reply[stream]:
+            log.write(stream, reply[stream].encode())
+    if not reply["ok"]:
+        raise Exception(f"Python task failed: {reply['error']}")
+    return reply["result"]
+
+def execute_shell(task, cwd = None, log=None, cancel=None):
+    """
+    Run a shell command, reading stdout/stderr incrementally into `log`
+    (a logstream.TaskLogStream). Only a bounded tail of the output is kept
+    in memory; that tail is what the task returns. The command's process
+    group is killed after the task's `timeout` or when `cancel` is set.
+    """
+    if _uses_prefork(task):
+        return execute_shell_prefork(task, cwd, log, cancel)
     command = task['command']
     run_dir = cwd or None
+    log = log or TaskLogStream(None, task.get("id"))
+    proc = subprocess.Popen(command, shell=True, cwd=run_dir, start_new_session=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, "stdout", log), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, "stderr", log), daemon=True),
+    ]
+    for t in readers:
+        t.start()
     try:
-        result = subprocess.run(command, shell=True, check=True,
-                                capture_output=True, text=True, cwd=run_dir)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Shell task failed: {e.stderr.strip()}")
+        returncode = _wait_shell(proc, task, _task_timeout(task), cancel)
+    finally:
+        for t in readers:
+            # a process that left the group may still hold the pipes open
+            t.join(READER_GRACE if proc.returncode is None or proc.returncode < 0 else None)
+    if returncode != 0:
+        raise Exception(f"Shell task failed: {log.tail('stderr').strip()}")
+    return log.tail("stdout").strip()
 
-def execute_rest(task, cwd=None):
-    method  = task["method"].upper()
-    url     = task["url"]
-    headers = task.get("headers", {})
-    body    = task.get("body", None)
+def _spool_path(task, run_dir):
+    name = re.sub(r"[^\w.-]", "_", str(task.get("id", "response")))
+    return os.path.join(run_dir, ".responses", f"{name}.body")
 
-    resp = requests.request(method, url, headers=headers, json=body)
-    resp.raise_for_status()
+def _json_output_paths(task, run_dir):
+    return [
+        os.path.join(run_dir, spec["json_path"])
+        for spec in task.get("outputs", {}).values()
+        if spec.get("type") == "json"
+    ]
 
-    run_dir = cwd or os.getcwd()
-    for name, spec in task.get("outputs", {}).items():
-        if spec.get("type") == "json":
-            path = os.path.join(run_dir, spec["json_path"])
+def _response_target(task, run_dir):
+    """
+    Where the body goes: straight to the first JSON output file when the
+    task has one, otherwise memory with a spill file past SPOOL_THRESHOLD.
+    """
+    paths = _json_output_paths(task, run_dir)
+    if paths:
+        return paths[0], 0
+    return _spool_path(task, run_dir), SPOOL_THRESHOLD
+
+def _write_json_outputs(task, run_dir, body):
+    for path in _json_output_paths(task, run_dir):
+        if isinstance(body, SpooledBody):
+            if os.path.abspath(path) != os.path.abspath(body.path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.copyfile(body.path, path)
+        else:
             os.makedirs(os.path.dirname(path), exist_ok=True)
             with open(path, "w", encoding="utf-8") as f:
-                f.write(resp.text)
+                f.write(body)
+
+def _finish_body(task, run_dir, body, encoding):
+    if not isinstance(body, SpooledBody):
+        body = body.decode(encoding or "utf-8", errors="replace")
+    _write_json_outputs(task, run_dir, body)
+    if isinstance(body, SpooledBody):
+        # extract_outputs streams JSON outputs straight from the file
+        return body
     try:
-        return resp.json()
+        return json.loads(body)
     except ValueError:
-        return resp.text
+        return body
 
-def execute_email(task):
-    load_dotenv()
-    sender_email = os.getenv("SENDER_EMAIL")
-    password = os.getenv("APP_PASSWORD") 
+def execute_rest(task, cwd=None):
+    run_dir = cwd or os.getcwd()
+    path, threshold = _response_target(task, run_dir)
+    body, encoding = http_client.client.fetch(task, path, threshold)
+    return _finish_body(task, run_dir, body, encoding)
 
-    subject = task['subject']
-    body = task['emailBody']
+async def _pump_async(reader, stream, log):
+    while True:
+        chunk = await reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        log.write(stream, chunk)
 
-    for recipient in task['recipients']:
-        receiver_email = recipient
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = receiver_email
-        msg['Subject'] = subject
+async def _in_worker_thread(func, task, cwd, log):
+    # pre-forked workers are driven from a thread; cancelling the coroutine
+    # sets the event so the worker is killed and recycled
+    cancel = threading.Event()
+    future = asyncio.ensure_future(asyncio.to_thread(func, task, cwd, log, cancel))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        with contextlib.suppress(BaseException):
+            await future
+        raise
 
-        msg.attach(MIMEText(body, 'plain'))
+async def execute_shell_async(task, cwd=None, log=None):
+    """
+    Async execute_shell: the process group is killed after the task's
+    `timeout` or when the calling coroutine is cancelled.
+    """
+    if _uses_prefork(task):
+        return await _in_worker_thread(execute_shell_prefork, task, cwd, log)
+    command = task['command']
+    run_dir = cwd or None
+    log = log or TaskLogStream(None, task.get("id"))
+    timeout = _task_timeout(task)
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=run_dir,
+        start_new_session=True,
+    )
+    try:
+        await asyncio.wait_for(asyncio.gather(
+            _pump_async(proc.stdout, "stdout", log),
+            _pump_async(proc.stderr, "stderr", log),
+            proc.wait(),
+        ), timeout)
+    except asyncio.TimeoutError:
+        _kill_group(proc.pid)
+        await proc.wait()
+        raise TaskTimeout(f"Shell task timed out after {timeout:g}s")
+    except asyncio.CancelledError:
+        _kill_group(proc.pid)
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise Exception(f"Shell task failed: {log.tail('stderr').strip()}")
+    return log.tail("stdout").strip()
 
-        try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                server.login(sender_email, password)
-                server.sendmail(sender_email, receiver_email, msg.as_string())
-            return "Email sent successfully!"
-        except Exception as e:
-            logger.debug(f"Error sending email: {e}")
+async def execute_rest_async(task, cwd=None):
+    run_dir = cwd or os.getcwd()
+    path, threshold = _response_target(task, run_dir)
+    body, encoding = await http_client.fetch_async(task, path, threshold)
+    return await asyncio.to_thread(_finish_body, task, run_dir, body, encoding)
 
-    raise NotImplementedError("Email task execution is not implemented yet.")
+def _email_result(result):
+    if result["failed"] and not result["sent"]:
+        raise Exception(f"Email task failed for every recipient: {result['failed']}")
+    return result
 
-def execute_task(task, cwd=None):
+def execute_email(task):
+    """
+    Deliver through the shared mailer; outputs report per-recipient results.
+    """
+    return _email_result(mailer.send(task))
+
+async def execute_email_async(task):
+    return _email_result(await asyncio.wrap_future(mailer.submit(task)))
+
+def _retry_policy(task):
+    # RESTAPI requests are retried per request by http_client, which knows
+    # which failures are transient
+    if task.get("type") == "RESTAPI":
+        return 0, DEFAULT_BACKOFF
+    return int(task.get("retries", 0)), float(task.get("retry_backoff", DEFAULT_BACKOFF))
+
+def _execute_once(task, cwd, log, cancel):
     task_type = task['type']
     if task_type == "SHELL":
-        return execute_shell(task, cwd)
+        return execute_shell(task, cwd, log, cancel)
     elif task_type == "RESTAPI":
         return execute_rest(task, cwd)
     elif task_type == "EMAIL":
         return execute_email(task)
+    elif task_type == "PYTHON":
+        return execute_python(task, cwd, log, cancel)
     else:
         raise ValueError(f"Unsupported task type: {task_type}")
+
+
+def execute_task(task, cwd=None, log=None, cancel=None):
+    """
+    Run a task, retrying failures up to its `retries` times with
+    exponential backoff from `retry_backoff` seconds.
+    """
+    retries, backoff = _retry_policy(task)
+    attempt = 0
+    while True:
+        if attempt and log is not None:
+            log.new_attempt(attempt + 1)
+        try:
+            return _execute_once(task, cwd, log, cancel)
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(backoff, attempt)
+            attempt += 1
+            logger.info(f"Task {task.get('id')}: retry {attempt}/{retries} in {delay:.2f}s after {e}")
+            if cancel is not None:
+                if cancel.wait(delay):
+                    raise TaskCancelled(f"Task {task.get('id')} cancelled")
+            else:
+                time.sleep(delay)
+
+async def _execute_once_async(task, cwd, log):
+    task_type = task['type']
+    if task_type == "SHELL":
+        return await execute_shell_async(task, cwd, log)
+    elif task_type == "RESTAPI":
+        return await execute_rest_async(task, cwd)
+    elif task_type == "EMAIL":
+        return await execute_email_async(task)
+    elif task_type == "PYTHON":
+        return await _in_worker_thread(execute_python, task, cwd, log)
+    else:
+        raise ValueError(f"Unsupported task type: {task_type}")
+
+async def execute_task_async(task, cwd=None, log=None):
+    retries, backoff = _retry_policy(task)
+    attempt = 0
+    while True:
+        if attempt and log is not None:
+            log.new_attempt(attempt + 1)
+        try:
+            return await _execute_once_async(task, cwd, log)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(backoff, attempt)
+            attempt += 1
+            logger.info(f"Task {task.get('id')}: retry {attempt}/{retries} in {delay:.2f}s after {e}")
+            await asyncio.sleep(delay)
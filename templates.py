@@ -0,0 +1,148 @@
+import re
+from blobs import blobs, is_blob_ref
+from uploads import resolve_placeholder
+
+PLACEHOLDER = re.compile(r"\{\{(.+?)\}\}")
+TEMPLATED_FIELDS = ("command", "url")
+JSON_FIELDS = ("body", "args", "kwargs")
+
+
+class Template:
+    """
+    A string split once into literal segments and placeholder slots.
+    Rendering is a single pass over the parts; placeholders whose variable
+    is not in the context are left as written, like the str.replace based
+    resolver did. Blob references are read back only here, so an output
+    that lives in the blob store is loaded only if a template uses it.
+    `{{upload:<sha256>}}` renders as the path of that uploaded file.
+    """
+    __slots__ = ("parts",)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    @classmethod
+    def compile(cls, text):
+        parts = []
+        pos = 0
+        for m in PLACEHOLDER.finditer(text):
+            if m.start() > pos:
+                parts.append(text[pos:m.start()])
+            parts.append((m.group(1), m.group(0)))
+            pos = m.end()
+        if not parts:
+            return None
+        if pos < len(text):
+            parts.append(text[pos:])
+        return cls(parts)
+
+    def render(self, context):
+        out = []
+        for part in self.parts:
+            if type(part) is str:
+                out.append(part)
+            else:
+                name, literal = part
+                if name not in context:
+                    out.append(resolve_placeholder(name) or literal)
+                    continue
+                value = context[name]
+                out.append(str(blobs.load(value) if is_blob_ref(value) else value))
+        return "".join(out)
+
+
+def _compile_value(value):
+    """
+    Returns a render function for a JSON value that contains placeholders,
+    or None when the value is static and can be shared as is.
+    """
+    if isinstance(value, str):
+        tpl = Template.compile(value)
+        return tpl.render if tpl else None
+    if isinstance(value, dict):
+        items = []
+        dynamic = False
+        for k, v in value.items():
+            key_tpl = Template.compile(k) if isinstance(k, str) else None
+            plan = _compile_value(v)
+            dynamic = dynamic or key_tpl is not None or plan is not None
+            items.append((k, key_tpl, v, plan))
+        if not dynamic:
+            return None
+        def render_dict(context):
+            return {
+                (key_tpl.render(context) if key_tpl else k): (plan(context) if plan else v)
+                for k, key_tpl, v, plan in items
+            }
+        return render_dict
+    if isinstance(value, list):
+        plans = [(v, _compile_value(v)) for v in value]
+        if all(plan is None for _, plan in plans):
+            return None
+        def render_list(context):
+            return [plan(context) if plan else v for v, plan in plans]
+        return render_list
+    return None
+
+
+class CompiledTask:
+    """
+    Input-mapping plan for one task, built once when the workflow is loaded.
+    render() produces the same task dict as utils.resolve_input_mappings
+    without deep-copying the task or round-tripping the body through JSON;
+    static parts of the task are shared with the raw definition.
+    """
+    def __init__(self, task):
+        self.raw = task
+        self.parents = list(task.get("depends_on", []))
+        self.fields = {}
+        for field in TEMPLATED_FIELDS:
+            if isinstance(task.get(field), str):
+                tpl = Template.compile(task[field])
+                if tpl:
+                    self.fields[field] = tpl
+        self.headers = None
+        headers = task.get("headers")
+        if isinstance(headers, dict):
+            compiled = {
+                k: Template.compile(v) if isinstance(v, str) else None
+                for k, v in headers.items()
+            }
+            if any(compiled.values()):
+                self.headers = compiled
+        self.values = {}
+        for field in JSON_FIELDS:
+            plan = _compile_value(task[field]) if field in task else None
+            if plan:
+                self.values[field] = plan
+        self.static = not (self.fields or self.headers or self.values)
+
+    def context(self, results):
+        context = {}
+        for parent in self.parents:
+            context.update(results.get(parent, {}))
+        return context
+
+    def render(self, results):
+        if self.static:
+            return dict(self.raw)
+        return self.render_context(self.context(results))
+
+    def render_context(self, context):
+        t = dict(self.raw)
+        if self.static:
+            return t
+        for field, tpl in self.fields.items():
+            t[field] = tpl.render(context)
+        if self.headers:
+            t["headers"] = {
+                k: tpl.render(context) if tpl else v
+                for (k, tpl), v in zip(self.headers.items(), self.raw["headers"].values())
+            }
+        for field, plan in self.values.items():
+            t[field] = plan(context)
+        return t
+
+
+def compile_tasks(nodes):
+    return {tid: CompiledTask(task) for tid, task in nodes.items()}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# tests run against the in-process backend unless told otherwise
+os.environ.setdefault("WIZFLOW_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
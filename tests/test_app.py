@@ -0,0 +1,13 @@
+from fastapi.testclient import TestClient
+import app
+from uploads import uploads
+
+
+def test_create_directory_stays_inside_the_upload_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(uploads, "root", str(tmp_path / "uploads"))
+    client = TestClient(app.app)
+    resp = client.post("/api/v1/directory", json={"userID": "../../evil", "workflowID": "../wf"})
+    assert resp.status_code == 200
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["uploads"]
+    assert (tmp_path / "uploads" / "evil" / "wf").is_dir()
@@ -0,0 +1,108 @@
+import time
+import pytest
+import redis
+from backend import MemoryBackend, SqliteBackend, redis_client
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def b(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SqliteBackend(str(tmp_path / "test.db"))
+    client = redis_client()
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"redis unreachable: {e}")
+    return client
+
+
+def test_strings(b):
+    b.delete("t:a", "t:short")
+    assert b.get("t:missing") is None
+    assert b.set("t:a", "1")
+    assert b.get("t:a") == "1"
+    b.set("t:a", "2")
+    assert b.mget(["t:a", "t:missing"]) == ["2", None]
+    b.set("t:short", "x", ex=1)
+    assert b.get("t:short") == "x"
+    time.sleep(1.1)
+    assert b.get("t:short") is None
+    assert b.delete("t:a", "t:missing") == 1
+    assert b.get("t:a") is None
+
+
+def test_hashes(b):
+    b.delete("t:h")
+    assert b.hgetall("t:h") == {}
+    b.hset("t:h", mapping={"x": "1", "y": "2"})
+    b.hset("t:h", "z", "3")
+    assert b.hget("t:h", "y") == "2"
+    assert b.hget("t:h", "missing") is None
+    assert b.hgetall("t:h") == {"x": "1", "y": "2", "z": "3"}
+    assert b.hdel("t:h", "x", "missing") == 1
+    assert b.hgetall("t:h") == {"y": "2", "z": "3"}
+    b.delete("t:h")
+    assert b.hgetall("t:h") == {}
+
+
+def test_pipeline(b):
+    pipe = b.pipeline(transaction=False)
+    pipe.set("t:p", "v")
+    pipe.hset("t:ph", mapping={"f": "1"})
+    pipe.get("t:p")
+    results = pipe.execute()
+    assert results[0] is True and results[2] == "v"
+    assert b.hget("t:ph", "f") == "1"
+    b.delete("t:p", "t:ph")
+
+
+def next_message(ps, timeout=1.0):
+    # redis-py returns None for the skipped subscribe confirmations
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        msg = ps.get_message(timeout=0.1)
+        if msg is not None:
+            return msg
+    raise AssertionError("no message received")
+
+
+def test_pubsub(b):
+    ps = b.pubsub(ignore_subscribe_messages=True)
+    ps.subscribe("t:events")
+    pps = b.pubsub(ignore_subscribe_messages=True)
+    pps.psubscribe("wf:*:control")
+    time.sleep(0.1)
+    pipe = b.pipeline(transaction=False)
+    pipe.publish("t:events", "one")
+    pipe.publish("wf:x:control", "PAUSED")
+    pipe.execute()
+    msg = next_message(ps)
+    assert msg["type"] == "message" and msg["channel"] == "t:events" and msg["data"] == "one"
+    msg = next_message(pps)
+    assert msg["type"] == "pmessage" and msg["channel"] == "wf:x:control" and msg["data"] == "PAUSED"
+    ps.close()
+    pps.close()
+
+
+def test_raw_client_reads_bytes_on_the_same_pool():
+    fakeredis = pytest.importorskip("fakeredis")
+    from backend import raw_client
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.set("t:bin", b"\x80\x01")
+    reader = raw_client(client)
+    assert reader.client is client
+    assert reader.get("t:bin") == b"\x80\x01"
+    assert reader.mget(["t:bin", "t:missing"]) == [b"\x80\x01", None]
+
+
+def test_sqlite_purges_expired_rows(tmp_path):
+    b = SqliteBackend(str(tmp_path / "ttl.db"))
+    b.PURGE_INTERVAL = 0
+    b.set("t:old", "x", ex=0.01)
+    b.set("t:kept", "y")
+    time.sleep(0.05)
+    b.set("t:new", "z", ex=60)
+    keys = {key for key, in b.conn.execute("SELECT key FROM kv")}
+    assert keys == {"t:kept", "t:new"}
@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future
+from dagview import DagRenderer
+
+
+class DoneExecutor:
+    """
+    Stands in for the render pool when the result is ready immediately,
+    as with an image that already exists.
+    """
+    def submit(self, fn, *args):
+        fut = Future()
+        fut.set_result("dag.png")
+        return fut
+
+
+def test_submit_with_finished_future_does_not_deadlock(tmp_path):
+    renderer = DagRenderer()
+    renderer.executor = DoneExecutor()
+    result = {}
+    t = threading.Thread(target=lambda: result.setdefault("fut", renderer.submit({"a": []}, ["a"], str(tmp_path))),
+                         daemon=True)
+    t.start()
+    t.join(2)
+    assert not t.is_alive(), "submit deadlocked on its own lock"
+    assert result["fut"].result() == "dag.png"
+    assert renderer.pending == {}
+
+
+def test_concurrent_requests_share_one_render(tmp_path):
+    renderer = DagRenderer()
+    gate = threading.Event()
+    calls = []
+
+    def render(dag, nodes, base, digest, name):
+        calls.append(base)
+        gate.wait(2)
+        return base + ".png"
+
+    renderer._render = render
+    first = renderer.submit({"a": []}, ["a"], str(tmp_path))
+    second = renderer.submit({"a": []}, ["a"], str(tmp_path))
+    gate.set()
+    assert first is second
+    assert first.result(2).endswith(".png")
+    assert len(calls) == 1
@@ -0,0 +1,145 @@
+import threading
+import time
+import uuid
+import pytest
+from engine import WorkflowEngine
+from store import get_task_status
+from workpool import WorkPool
+
+
+@pytest.fixture(autouse=True)
+def run_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def workflow(tasks):
+    # a fresh version per test keeps cache entries from leaking between tests
+    return {"workflow_name": "test", "version": uuid.uuid4().hex, "tasks": tasks}
+
+
+def shell(tid, command, depends_on=(), **extra):
+    return {"id": tid, "type": "SHELL", "command": command, "depends_on": list(depends_on),
+            "outputs": {"o": {"type": "stdout"}}, **extra}
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_failure_during_drain_keeps_admission_closed():
+    engine = WorkflowEngine(workflow([
+        shell("a", "sleep 0.3; exit 1"),
+        shell("b", "sleep 0.5; echo b"),
+        shell("c", "echo c", ["b"]),
+    ]))
+    t = threading.Thread(target=engine.run_parallel, args=(4,))
+    t.start()
+    try:
+        time.sleep(0.1)
+        engine.drain()
+        assert wait_for(lambda: engine.gate.state == "PAUSED")
+        time.sleep(0.3)
+        statuses = get_task_status(engine.wf_key)
+        assert statuses["a"] == "FAILED"
+        assert statuses["c"] == "PENDING"
+    finally:
+        engine.resume()
+        t.join(10)
+    assert not t.is_alive()
+    assert engine.results["c"] == {"o": "c"}
+
+
+def test_reduce_sums_text_outputs():
+    engine = WorkflowEngine(workflow([
+        {"id": "list", "type": "PYTHON", "callable": "json:loads", "args": ["[1, 2, 3]"],
+         "outputs": {"xs": {"type": "json", "json_path": "$"}}},
+        {"id": "m", "type": "MAP", "over": "xs", "depends_on": ["list"],
+         "task": {"type": "SHELL", "command": "echo $(( {{item}} * 10 ))", "outputs": {"n": {"type": "stdout"}}}},
+        {"id": "r", "type": "REDUCE", "depends_on": ["m"],
+         "reduce": {"total": {"field": "n", "op": "sum"}, "top": {"field": "n", "op": "max"}}},
+    ]))
+    results = engine.run()
+    assert results["r"] == {"total": 60, "top": 30}
+
+
+def test_reduce_rejects_non_numeric_text():
+    engine = WorkflowEngine(workflow([
+        {"id": "list", "type": "PYTHON", "callable": "json:loads", "args": ["[1, 2]"],
+         "outputs": {"xs": {"type": "json", "json_path": "$"}}},
+        {"id": "m", "type": "MAP", "over": "xs", "depends_on": ["list"],
+         "task": {"type": "SHELL", "command": "echo item {{item}}", "outputs": {"n": {"type": "stdout"}}}},
+        {"id": "r", "type": "REDUCE", "depends_on": ["m"], "reduce": {"total": {"field": "n", "op": "sum"}}},
+    ]))
+    engine.run()
+    assert get_task_status(engine.wf_key)["r"] == "FAILED"
+
+
+def test_async_run_keeps_backend_calls_off_the_loop(monkeypatch):
+    import asyncio
+    import engine as engine_module
+    threads = []
+    for name in ("load_task_cache", "save_task_cache", "set_workflow_status"):
+        real = getattr(engine_module, name)
+
+        def record(*args, _real=real, **kwargs):
+            threads.append(threading.current_thread())
+            return _real(*args, **kwargs)
+        monkeypatch.setattr(engine_module, name, record)
+    engine = WorkflowEngine(workflow([shell("a", "echo a"), shell("b", "echo b", ["a"])]))
+    results = asyncio.run(engine.run_async())
+    assert results["b"] == {"o": "b"}
+    assert threads and threading.main_thread() not in threads
+
+
+def test_async_run_keeps_log_and_reduce_io_off_the_loop(monkeypatch):
+    import asyncio
+    threads = []
+    for name in ("_open_log", "_reduce"):
+        real = getattr(WorkflowEngine, name)
+
+        def record(self, *args, _real=real):
+            threads.append(threading.current_thread())
+            return _real(self, *args)
+        monkeypatch.setattr(WorkflowEngine, name, record)
+    engine = WorkflowEngine(workflow([
+        {"id": "list", "type": "PYTHON", "callable": "json:loads", "args": ["[1, 2]"],
+         "outputs": {"xs": {"type": "json", "json_path": "$"}}},
+        {"id": "m", "type": "MAP", "over": "xs", "depends_on": ["list"],
+         "task": {"type": "SHELL", "command": "echo {{item}}", "outputs": {"n": {"type": "stdout"}}}},
+        {"id": "r", "type": "REDUCE", "depends_on": ["m"], "reduce": {"total": {"field": "n", "op": "sum"}}},
+    ]))
+    results = asyncio.run(engine.run_async())
+    assert results["r"] == {"total": 3}
+    assert len(threads) >= 3 and threading.main_thread() not in threads
+
+
+def test_checkpoint_is_cleared_only_after_a_successful_run():
+    from checkpoint import Checkpoint
+    ok = WorkflowEngine(workflow([shell("a", "echo a")]))
+    ok.run_parallel()
+    assert Checkpoint(ok.wf_key).load() is None
+    pooled = WorkflowEngine(workflow([shell("a", "echo a")]))
+    WorkPool().submit(pooled).result(timeout=10)
+    assert Checkpoint(pooled.wf_key).load() is None
+    failed = WorkflowEngine(workflow([shell("a", "exit 1")]))
+    failed.run()
+    assert Checkpoint(failed.wf_key).load().failed == {"a"}
+
+
+def test_serial_resume_skips_checkpointed_failures(tmp_path):
+    first = WorkflowEngine(workflow([
+        shell("a", "echo a"),
+        shell("b", f"echo run >> {tmp_path}/b.count; exit 1"),
+        shell("c", "echo c", ["b"]),
+    ]))
+    first.run()
+    resumed = WorkflowEngine.from_checkpoint(first.wf_key)
+    results = resumed.run()
+    assert (tmp_path / "b.count").read_text() == "run\n"
+    assert results == {"a": {"o": "a"}}
+    assert get_task_status(first.wf_key) == {"a": "COMPLETED", "b": "FAILED", "c": "PENDING"}
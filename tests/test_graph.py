@@ -0,0 +1,24 @@
+import pytest
+from bench_graph import synthetic_tasks, legacy_build_dag, legacy_descendants
+from graph import TaskGraph
+
+
+def test_csr_graph_matches_dict_graph():
+    tasks = synthetic_tasks(2000, window=50)
+    dag, indegree, _ = legacy_build_dag(tasks)
+    graph = TaskGraph.from_tasks(tasks)
+    assert dict(graph.items()) == dag
+    assert graph.indegree_map() == indegree
+    order = graph.topological_order()
+    position = {tid: i for i, tid in enumerate(order)}
+    assert all(position[p] < position[c] for p, children in dag.items() for c in children)
+    for tid in order[:20]:
+        assert graph.descendants(tid) == legacy_descendants(dag, tid)
+
+
+def test_unknown_parent_and_cycle():
+    with pytest.raises(ValueError, match="'b' depends on unknown 'x'"):
+        TaskGraph.from_tasks([{"id": "a"}, {"id": "b", "depends_on": ["x"]}])
+    graph = TaskGraph.from_tasks([{"id": "a", "depends_on": ["b"]}, {"id": "b", "depends_on": ["a"]}])
+    with pytest.raises(RuntimeError, match="Cycle"):
+        graph.topological_order()
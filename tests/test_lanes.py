@@ -0,0 +1,37 @@
+from lanes import Lane, Lanes
+
+
+def test_shell_lane_is_bounded_by_the_callers_limit():
+    lanes = Lanes(cpus=1, max_workers=20)
+    task = {"type": "SHELL", "command": "sleep 1"}
+    tickets = [lanes.try_acquire(task) for _ in range(20)]
+    assert all(tickets)
+    assert lanes.try_acquire(task) is None
+    assert lanes.try_acquire({"type": "PYTHON", "callable": "os:getcwd"}) is None
+
+
+def test_bound_resets_the_shell_lane():
+    lanes = Lanes(cpus=2)
+    lanes.bound(8)
+    assert lanes.snapshot()["SHELL"]["limit"] == 8
+
+
+def test_saturation_halves_down_to_the_floor():
+    saturated = [True]
+    lane = Lane("SHELL", 16, saturated=lambda: saturated[0], floor=4)
+    for _ in range(5):
+        lane.acquire(1)
+        lane.last_decrease = 0.0
+        lane.release(1)
+    assert lane.limit == 4
+    saturated[0] = False
+    lane.acquire(1)
+    lane.release(1)
+    assert lane.limit > 4
+
+
+def test_failures_still_halve_below_the_floor():
+    lane = Lane("SHELL", 4, saturated=lambda: False, floor=4)
+    lane.acquire(1)
+    lane.release(1, ok=False)
+    assert lane.limit == 2
@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+from store import StateWriter
+
+
+class FlakyPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def hset(self, name, mapping):
+        self.ops.append((name, dict(mapping)))
+
+    def publish(self, channel, message):
+        pass
+
+    def execute(self):
+        if self.client.failures:
+            self.client.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        for name, mapping in self.ops:
+            self.client.hashes.setdefault(name, {}).update(mapping)
+
+
+class FlakyClient:
+    def __init__(self, failures):
+        self.failures = failures
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return FlakyPipeline(self)
+
+
+def test_failed_flush_requeues_batch():
+    client = FlakyClient(failures=1)
+    writer = StateWriter(client, flush_interval=60)
+    writer.set_task_status("wf", "a", "RUNNING")
+    writer.set_task_status("wf", "b", "RUNNING")
+    with pytest.raises(sqlite3.OperationalError):
+        writer.flush()
+    # a newer status set while the batch was failing must win over the requeued one
+    writer.set_task_status("wf", "a", "COMPLETED")
+    writer.flush()
+    assert client.hashes["wf:wf:tasks"] == {"a": "COMPLETED", "b": "RUNNING"}
+    assert writer.count == 0 and writer.pending == {}
+
+
+def test_full_batch_is_flushed_by_the_writer_thread():
+    import threading
+    import time
+    client = FlakyClient(failures=0)
+    flushed_on = []
+    pipeline = client.pipeline
+    client.pipeline = lambda transaction=True: flushed_on.append(threading.current_thread()) or pipeline()
+    writer = StateWriter(client, flush_interval=60, max_batch=2)
+    writer.set_task_status("wf", "a", "RUNNING")
+    writer.set_task_status("wf", "b", "RUNNING")
+    assert flushed_on == []
+    deadline = time.monotonic() + 2
+    while "wf:wf:tasks" not in client.hashes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.hashes["wf:wf:tasks"] == {"a": "RUNNING", "b": "RUNNING"}
+    assert flushed_on == [writer.thread]
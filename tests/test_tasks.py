@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from logstream import TaskLogStream
+from tasks import execute_task, execute_task_async, TaskTimeout
+
+# prints on every attempt, fails on the first one
+FLAKY = "echo attempt; if [ ! -e marker ]; then touch marker; echo boom >&2; exit 1; fi; echo ok"
+
+
+def flaky_task(executor="spawn"):
+    return {"id": "flaky", "type": "SHELL", "command": FLAKY, "retries": 1, "retry_backoff": 0.01,
+            "executor": executor}
+
+
+@pytest.mark.parametrize("executor", ["spawn", "prefork"])
+def test_retry_output_holds_only_the_last_attempt(tmp_path, executor):
+    log = TaskLogStream(None, "flaky", str(tmp_path / ".logs"))
+    try:
+        assert execute_task(flaky_task(executor), cwd=str(tmp_path), log=log) == "attempt\nok"
+        assert log.tail("stderr") == ""
+    finally:
+        log.close()
+    spool = (tmp_path / ".logs" / "flaky.stdout.log").read_text()
+    assert spool == "attempt\n\n----- attempt 2 -----\nattempt\nok\n"
+    assert "boom" in (tmp_path / ".logs" / "flaky.stderr.log").read_text()
+
+
+def test_async_retry_output_holds_only_the_last_attempt(tmp_path):
+    log = TaskLogStream(None, "flaky")
+    assert asyncio.run(execute_task_async(flaky_task(), cwd=str(tmp_path), log=log)) == "attempt\nok"
+
+
+def test_shell_timeout(tmp_path):
+    with pytest.raises(TaskTimeout):
+        execute_task({"id": "slow", "type": "SHELL", "command": "sleep 5", "timeout": 0.2}, cwd=str(tmp_path))
+
+
+def test_async_rest_writes_outputs_off_the_loop(tmp_path, monkeypatch):
+    import threading
+    import http_client
+    import tasks
+
+    async def fetch_async(task, path, threshold):
+        return b'{"n": 1}', "utf-8"
+    threads = []
+    real = tasks._write_json_outputs
+
+    def record(*args):
+        threads.append(threading.current_thread())
+        return real(*args)
+    monkeypatch.setattr(http_client, "fetch_async", fetch_async)
+    monkeypatch.setattr(tasks, "_write_json_outputs", record)
+    task = {"id": "r", "type": "RESTAPI", "method": "GET", "url": "http://example.invalid",
+            "outputs": {"n": {"type": "json", "json_path": "out/r.json"}}}
+    assert asyncio.run(execute_task_async(task, cwd=str(tmp_path))) == {"n": 1}
+    assert (tmp_path / "out" / "r.json").read_text() == '{"n": 1}'
+    assert threads and threading.main_thread() not in threads
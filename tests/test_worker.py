@@ -0,0 +1,20 @@
+import store
+import worker
+from store import StateWriter, r
+
+
+def test_running_status_is_written_before_the_result(tmp_path, monkeypatch):
+    # a writer that would otherwise hold RUNNING back for a minute
+    monkeypatch.setattr(store, "writer", StateWriter(r, flush_interval=60))
+    seen = []
+    monkeypatch.setattr(worker, "report_result", lambda job, ok, **kw: seen.append(
+        (ok, r.hget(f"wf:{job['wf_key']}:tasks", job["task_id"]))))
+    job = {
+        "job_id": "j1",
+        "task_id": "a",
+        "wf_key": "order:v1",
+        "cwd": str(tmp_path),
+        "task": {"id": "a", "type": "SHELL", "command": "echo a"},
+    }
+    worker.Worker()._execute(job)
+    assert seen == [(True, "RUNNING")]
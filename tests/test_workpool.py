@@ -0,0 +1,35 @@
+import time
+import uuid
+import pytest
+from engine import WorkflowEngine
+from workpool import WorkPool
+
+
+@pytest.fixture(autouse=True)
+def run_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def engine(*commands):
+    return WorkflowEngine({"workflow_name": "pool", "version": uuid.uuid4().hex, "tasks": [
+        {"id": f"t{i}", "type": "SHELL", "command": c, "outputs": {"o": {"type": "stdout"}}}
+        for i, c in enumerate(commands)]})
+
+
+def test_slow_start_does_not_stall_other_workflows():
+    pool = WorkPool(max_workers=2)
+    slow, fast = engine("echo slow"), engine("echo fast")
+    begin = slow._begin_run
+
+    def slow_begin():
+        time.sleep(1)
+        return begin()
+    slow._begin_run = slow_begin
+    slow_result = pool.submit(slow)
+    time.sleep(0.05)
+    started = time.monotonic()
+    assert pool.submit(fast).result(timeout=5) == {"t0": {"o": "fast"}}
+    assert time.monotonic() - started < 0.8
+    assert pool.is_running(slow.wf_key)
+    assert slow_result.result(timeout=5) == {"t0": {"o": "slow"}}
+    assert not pool.is_running(slow.wf_key)
@@ -0,0 +1,69 @@
+import time
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from store import get_task_status
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    import ws_api
+    with TestClient(ws_api.app) as c:
+        yield c
+
+
+def receive_until(ws, typ):
+    while True:
+        msg = ws.receive_json()
+        if msg.get("type") == typ:
+            return msg
+
+
+def test_duplicate_start_is_rejected_without_touching_the_run(client):
+    wf = {"workflow_name": "dup", "version": uuid.uuid4().hex,
+          "tasks": [{"id": "a", "type": "SHELL", "command": "sleep 1"}]}
+    wf_key = f"dup:{wf['version']}"
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "START", "workflow": wf})
+        receive_until(ws, "workflow_started")
+        deadline = time.monotonic() + 5
+        while get_task_status(wf_key).get("a") != "RUNNING" and time.monotonic() < deadline:
+            time.sleep(0.02)
+        import ws_api
+        engine = ws_api.engines[wf_key]
+
+        ws.send_json({"type": "START", "workflow": wf})
+        error = receive_until(ws, "error")
+        assert "already running" in error["message"]
+        assert ws_api.engines[wf_key] is engine
+        assert get_task_status(wf_key)["a"] == "RUNNING"
+
+        ws.send_json({"type": "RESTART"})
+        assert "already running" in receive_until(ws, "error")["message"]
+        assert get_task_status(wf_key)["a"] == "RUNNING"
+
+        # the socket is still served
+        ws.send_json({"type": "PAUSE"})
+        receive_until(ws, "PAUSE_ack")
+        ws.send_json({"type": "RESUME"})
+        receive_until(ws, "RESUME_ack")
+        deadline = time.monotonic() + 5
+        while ws_api.run_active(wf_key) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert get_task_status(wf_key)["a"] == "COMPLETED"
+
+
+def test_distributed_start_with_map_is_rejected_up_front(client):
+    wf = {"workflow_name": "fan", "version": uuid.uuid4().hex, "tasks": [
+        {"id": "list", "type": "SHELL", "command": "echo '[1, 2]'", "outputs": {"xs": {"type": "json"}}},
+        {"id": "m", "type": "MAP", "over": "xs", "depends_on": ["list"],
+         "task": {"type": "SHELL", "command": "echo {{item}}"}},
+    ]}
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "START", "workflow": wf, "mode": "distributed"})
+        error = receive_until(ws, "error")
+        assert "cannot run in distributed mode" in error["message"]
+        import ws_api
+        assert f"fan:{wf['version']}" not in ws_api.engines
@@ -0,0 +1,250 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_PREFIX = "upload:"
+SHA256 = re.compile(r"[0-9a-f]{64}")
+UNSAFE_NAME = re.compile(r"[^\w.-]")
+
+
+def upload_ref(sha):
+    return f"{{{{{UPLOAD_PREFIX}{sha}}}}}"
+
+def _safe_name(name):
+    name = UNSAFE_NAME.sub("_", os.path.basename(str(name)))
+    return name if name.strip(".") else "_"
+
+
+class OffsetMismatch(ValueError):
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadSession:
+    """
+    A resumable upload in progress: the bytes received so far in a .part
+    file, and a running sha256 over them.
+    """
+    def __init__(self, upload_id, meta, part_path):
+        self.upload_id = upload_id
+        self.meta = meta
+        self.part_path = part_path
+        self.hasher = hashlib.sha256()
+        self.file = open(part_path, "r+b")
+        # after a restart, pick the hash up from what is already on disk
+        for chunk in iter(lambda: self.file.read(CHUNK_SIZE), b""):
+            self.hasher.update(chunk)
+        self.offset = self.file.tell()
+        self.busy = False
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    def write(self, data):
+        if self.offset + len(data) > self.size:
+            raise ValueError(f"Upload would exceed its declared size of {self.size} bytes")
+        self.file.write(data)
+        self.hasher.update(data)
+        self.offset += len(data)
+
+    def close(self):
+        self.file.close()
+
+
+class UploadStore:
+    """
+    Uploaded files stored once by content under `<root>/.objects/` and
+    hardlinked into `<root>/<user>/<workflow>/<filename>`, so the same file
+    uploaded for several users or workflows takes its space once. Objects
+    are read-only, since every link shares them.
+    """
+    def __init__(self, root=UPLOAD_DIR):
+        self.root = os.path.abspath(root)
+        self.objects = os.path.join(self.root, ".objects")
+        self.partial = os.path.join(self.root, ".partial")
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def path(self, sha):
+        return os.path.join(self.objects, sha[:2], sha)
+
+    def resolve(self, sha):
+        """
+        Path of an uploaded object, or None if there is none with that hash.
+        """
+        if not SHA256.fullmatch(sha):
+            return None
+        path = self.path(sha)
+        return path if os.path.exists(path) else None
+
+    def _commit(self, tmp_path, sha):
+        # returns False when the content was already stored
+        path = self.path(sha)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+        return True
+
+    def workflow_dir(self, user, workflow):
+        """
+        Create and return `<root>/<user>/<workflow>`, with both names
+        sanitised the same way as uploaded filenames.
+        """
+        workflow_dir = os.path.join(self.root, _safe_name(user), _safe_name(workflow))
+        os.makedirs(workflow_dir, exist_ok=True)
+        return workflow_dir
+
+    def _link(self, sha, user, workflow, filename):
+        workflow_dir = self.workflow_dir(user, workflow)
+        dest = os.path.join(workflow_dir, _safe_name(filename))
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(self.path(sha), dest)
+        except OSError:
+            shutil.copyfile(self.path(sha), dest)
+        return dest
+
+    def _stored(self, sha, size, created, user, workflow, filename):
+        dest = self._link(sha, user, workflow, filename)
+        logger.info(f"Upload {filename} stored as {sha} ({size} bytes{'' if created else ', deduplicated'})")
+        return {
+            "sha256": sha,
+            "size": size,
+            "ref": upload_ref(sha),
+            "saved_path": os.path.relpath(dest),
+            "deduplicated": not created,
+        }
+
+    def put_stream(self, src, user, workflow, filename):
+        """
+        Copy a file object into the store in CHUNK_SIZE pieces, hashing as
+        it goes. Blocking; run it off the event loop.
+        """
+        os.makedirs(self.partial, exist_ok=True)
+        tmp_path = os.path.join(self.partial, f"{uuid.uuid4().hex}.tmp")
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            sha = h.hexdigest()
+            created = self._commit(tmp_path, sha)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._stored(sha, size, created, user, workflow, filename)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.partial, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial, f"{upload_id}.part")
+
+    def create(self, user, workflow, filename, size):
+        """
+        Start a resumable upload of `size` bytes. Returns its id.
+        """
+        if size < 0:
+            raise ValueError("Upload size must not be negative")
+        os.makedirs(self.partial, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        meta = {"user": user, "workflow": workflow, "filename": filename, "size": size}
+        open(self._part_path(upload_id), "wb").close()
+        with open(self._meta_path(upload_id), "w") as f:
+            json.dump(meta, f)
+        return upload_id
+
+    def session(self, upload_id):
+        """
+        The open session for an upload, reopened from disk if needed.
+        Raises KeyError for unknown ids.
+        """
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            raise KeyError(upload_id)
+        with self.lock:
+            session = self.sessions.get(upload_id)
+            if session is None:
+                try:
+                    with open(self._meta_path(upload_id)) as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    raise KeyError(upload_id)
+                session = UploadSession(upload_id, meta, self._part_path(upload_id))
+                self.sessions[upload_id] = session
+            return session
+
+    def begin(self, upload_id, offset):
+        """
+        Claim an upload for writing at `offset`. Raises OffsetMismatch when
+        the client is not where the server is, or another request is still
+        writing to the same upload.
+        """
+        session = self.session(upload_id)
+        with self.lock:
+            if session.busy or offset != session.offset:
+                raise OffsetMismatch(session.offset)
+            session.busy = True
+        return session
+
+    def end(self, session):
+        """
+        Release a session after a write request. Returns the stored upload's
+        info once every declared byte has arrived, otherwise None.
+        """
+        try:
+            if session.offset < session.size:
+                session.file.flush()
+                return None
+            return self._finish(session)
+        finally:
+            with self.lock:
+                session.busy = False
+
+    def _finish(self, session):
+        session.close()
+        sha = session.hasher.hexdigest()
+        created = self._commit(session.part_path, sha)
+        os.remove(self._meta_path(session.upload_id))
+        with self.lock:
+            self.sessions.pop(session.upload_id, None)
+        meta = session.meta
+        return self._stored(sha, session.size, created, meta["user"], meta["workflow"], meta["filename"])
+
+    def abort(self, upload_id):
+        session = self.session(upload_id)
+        with self.lock:
+            self.sessions.pop(upload_id, None)
+        session.close()
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def resolve_placeholder(name):
+    """
+    Path for an `upload:<sha256>` placeholder name, or None.
+    """
+    if not name.startswith(UPLOAD_PREFIX):
+        return None
+    return uploads.resolve(name[len(UPLOAD_PREFIX):].strip())
+
+
+uploads = UploadStore()
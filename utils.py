@@ -1,35 +1,50 @@
+import os
+import re
 import json
 import hashlib
-from collections import defaultdict, deque
+from itertools import islice
+from functools import lru_cache
+from collections import deque
 from jsonpath_ng import parse
 from graphviz import Digraph
+from graph import TaskGraph
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 def compute_hash(obj):
     normalized = json.dumps(obj, sort_keys=True).encode("utf‑8")
     return hashlib.sha256(normalized).hexdigest()
 
+def fingerprint_file(path, mode="stat"):
+    """
+    Cheap identity of a file artifact: size and mtime by default, or a
+    sha256 of the content when mode is "content". None if it is missing.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if mode != "content":
+        return [st.st_size, st.st_mtime_ns]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
 def build_dag(tasks):
-    dag = defaultdict(list)
-    dag = { t["id"]: [] for t in tasks }
-    indegree = {}
-    nodes = {}
-
-    for t in tasks:
-        tid = t["id"]
-        nodes[tid] = t
-        indegree.setdefault(tid, 0)
-
-    for t in tasks:
-        tid = t["id"]
-        for parent in t.get("depends_on", []):
-            if parent not in nodes:
-                raise ValueError(f"Task '{tid}' depends on unknown '{parent}'")
-            dag[parent].append(tid)
-            indegree[tid] = indegree.get(tid, 0) + 1
-
-    return dag, indegree, nodes
-
-def topological_sort(dag, indegree):
+    """
+    Returns the task graph (see graph.TaskGraph) and {task_id: task}.
+    """
+    nodes = {t["id"]: t for t in tasks}
+    return TaskGraph.from_tasks(tasks), nodes
+
+def topological_sort(dag, indegree=None):
+    if isinstance(dag, TaskGraph):
+        return dag.topological_order()
     q = deque([n for n,deg in indegree.items() if deg == 0])
     order = []
     while q:
@@ -62,24 +77,157 @@ def resolve_input_mappings(task, results):
             for k, v in t["headers"].items():
                 if isinstance(v, str):
                     t["headers"][k] = v.replace(placeholder, str(val))
-        if "body" in t:
-            body_str = json.dumps(t["body"])
-            body_str = body_str.replace(placeholder, str(val))
-            t["body"] = json.loads(body_str)
+        for field in ("body", "args", "kwargs"):
+            if field in t:
+                value_str = json.dumps(t[field])
+                value_str = value_str.replace(placeholder, str(val))
+                t[field] = json.loads(value_str)
     return t
 
-def extract_outputs(task, raw_output):
-    outputs = {}
+_PATH_STEP = re.compile(r"""\.([A-Za-z_][\w-]*)|\[(\d+)\]|\['([^']*)'\]|\["([^"]*)"\]""")
+
+def _simple_steps(path):
+    """
+    Split plain field/index paths such as `$.data[0]['id']` into steps.
+    Returns None for anything needing the full JSONPath engine.
+    """
+    s = path.strip()
+    if s.startswith("$"):
+        s = s[1:]
+    elif s and s[0] not in ".[":
+        s = "." + s
+    steps = []
+    pos = 0
+    while pos < len(s):
+        m = _PATH_STEP.match(s, pos)
+        if not m:
+            return None
+        field, index, quoted, dquoted = m.groups()
+        steps.append(int(index) if index is not None else next(
+            g for g in (field, quoted, dquoted) if g is not None))
+        pos = m.end()
+    return steps
+
+def _walk(data, steps):
+    for step in steps:
+        if isinstance(step, int):
+            if not isinstance(data, list) or step >= len(data):
+                return None
+        elif not isinstance(data, dict) or step not in data:
+            return None
+        data = data[step]
+    return data
+
+
+class JsonPath:
+    """
+    A compiled output JSONPath. Plain field/index paths are walked directly
+    and stop at the single match; everything else goes through jsonpath-ng.
+    """
+    __slots__ = ("path", "steps", "expr")
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = _simple_steps(path)
+        self.expr = parse(path) if self.steps is None else None
+
+    def first(self, data):
+        if self.steps is not None:
+            return _walk(data, self.steps)
+        for match in self.expr.find(data):
+            return match.value
+        return None
+
+    def can_stream(self):
+        return (
+            ijson is not None
+            and bool(self.steps)
+            and not any(isinstance(s, str) and "." in s for s in self.steps)
+        )
+
+    def first_in_file(self, path):
+        """
+        Stream the first match out of a JSON file with ijson, reading only up
+        to the matched value. Paths are split at their first index; the
+        remaining steps are walked on that one array element.
+        """
+        fields = []
+        for i, step in enumerate(self.steps):
+            if isinstance(step, int):
+                prefix = ".".join(fields + ["item"])
+                with open(path, "rb") as f:
+                    item = next(islice(ijson.items(f, prefix, use_float=True), step, None), None)
+                return None if item is None else _walk(item, self.steps[i + 1:])
+            fields.append(step)
+        with open(path, "rb") as f:
+            return next(ijson.items(f, ".".join(fields), use_float=True), None)
+
+
+@lru_cache(maxsize=1024)
+def compile_json_path(path):
+    return JsonPath(path)
+
+
+class SpooledBody:
+    """
+    A response body left on disk instead of being parsed into memory.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data.decode("utf-8", errors="replace")
+
+
+def compile_outputs(task):
+    """
+    Output extraction plan for a task: (name, type, spec) tuples with
+    JSONPaths compiled through the shared LRU cache.
+    """
+    plan = []
     for name, spec in task.get("outputs", {}).items():
         typ = spec.get("type")
         if typ == "json":
-            expr = parse(spec["json_path"])
-            matches = [m.value for m in expr.find(raw_output)]
-            outputs[name] = matches[0] if matches else None
+            plan.append((name, typ, compile_json_path(spec["json_path"])))
+        elif typ == "file":
+            plan.append((name, typ, spec["path"]))
+        else:
+            plan.append((name, typ, None))
+    return plan
+
+def extract_outputs(task, raw_output, plan=None, blobs=None):
+    """
+    With a blob store, a spooled body above its threshold is copied into
+    the store as is and returned as a reference instead of being loaded.
+    """
+    if plan is None:
+        plan = compile_outputs(task)
+    outputs = {}
+    loaded = raw_output
+    if isinstance(raw_output, SpooledBody):
+        loaded = None
+    for name, typ, spec in plan:
+        if typ == "json":
+            if loaded is None and spec.can_stream():
+                outputs[name] = spec.first_in_file(raw_output.path)
+                continue
+            if loaded is None:
+                loaded = raw_output.load()
+            outputs[name] = spec.first(loaded)
         elif typ == "file":
-            outputs[name] = spec["path"]
+            outputs[name] = spec
         else:
-            outputs[name] = raw_output
+            if loaded is None and blobs is not None and os.path.getsize(raw_output.path) > blobs.threshold:
+                outputs[name] = blobs.put_file(raw_output.path)
+                continue
+            if loaded is None:
+                loaded = raw_output.load()
+            outputs[name] = loaded
     return outputs
 
 def dag_to_dot(dag, all_nodes, filename="workflow.dot", engine_name=None):
@@ -93,7 +241,9 @@ def dag_to_dot(dag, all_nodes, filename="workflow.dot", engine_name=None):
     dot.render(filename, view=False)
     return filename + ".png"
 
-def compute_max_threads(dag, indegree):
+def compute_max_threads(dag, indegree=None):
+    if isinstance(dag, TaskGraph):
+        return dag.max_width()
     from collections import deque
     indeg = indegree.copy()
     frontier = deque([n for n, d in indeg.items() if d == 0])
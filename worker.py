@@ -0,0 +1,112 @@
+import argparse
+import os
+import socket
+import time
+import threading
+import uuid
+from tasks import execute_task, PROCESS_TYPES
+from utils import extract_outputs
+from store import set_task_status, flush_task_statuses
+from logstream import TaskLogStream
+from dispatch import (
+    claim_job,
+    renew_leases,
+    report_result,
+    LeaseReaper,
+    HEARTBEAT_INTERVAL,
+)
+from logging_config import setup_logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(self, concurrency=1):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reaper = LeaseReaper()
+
+    def _heartbeat(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self.lock:
+                    held = list(self.held)
+                if held:
+                    renew_leases(self.worker_id, held)
+                self.reaper.reap()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+
+    def _execute(self, job):
+        task_id = job["task_id"]
+        set_task_status(job["wf_key"], task_id, "RUNNING")
+        log = None
+        if job["task"].get("type") in PROCESS_TYPES:
+            log = TaskLogStream(job["wf_key"], task_id, os.path.join(job["cwd"], ".logs"))
+        start = time.monotonic()
+        try:
+            os.makedirs(job["cwd"], exist_ok=True)
+            raw_output = execute_task(job["task"], cwd=job["cwd"], log=log)
+            outputs = extract_outputs(job["task"], raw_output)
+            # a buffered RUNNING must not land after the engine records the result
+            flush_task_statuses(job["wf_key"])
+            report_result(job, True, outputs=outputs, worker_id=self.worker_id,
+                          duration=time.monotonic() - start)
+            logger.info(f"Task {task_id} of {job['wf_key']} completed")
+        except Exception as e:
+            flush_task_statuses(job["wf_key"])
+            report_result(job, False, error=str(e), worker_id=self.worker_id)
+            logger.info(f"Task {task_id} of {job['wf_key']} failed: {e}")
+        finally:
+            if log is not None:
+                log.close()
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            try:
+                job = claim_job(self.worker_id)
+            except Exception as e:
+                logger.warning(f"Claim failed: {e}")
+                self.stopped.wait(1)
+                continue
+            if job is None:
+                continue
+            with self.lock:
+                self.held.add(job["job_id"])
+            try:
+                self._execute(job)
+            finally:
+                with self.lock:
+                    self.held.discard(job["job_id"])
+
+    def run(self):
+        logger.info(f"Worker {self.worker_id} started with concurrency {self.concurrency}")
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        threads = [
+            threading.Thread(target=self._loop, name=f"worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                t.join()
+        except KeyboardInterrupt:
+            self.stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Wizflow task worker")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of tasks this process runs at once")
+    parser.add_argument("--log-file", default="logs/worker.log")
+    args = parser.parse_args()
+
+    setup_logging(log_file=args.log_file)
+    Worker(concurrency=args.concurrency).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from lanes import Lanes
+from store import set_workflow_status
+import logging
+logger = logging.getLogger(__name__)
+
+MAX_ACTIVE_WORKFLOWS = 16
+GATE_POLL_INTERVAL = 0.05
+
+
+class WorkflowRun:
+    """
+    Scheduling state of one admitted workflow: the bookkeeping run_parallel
+    keeps on its stack, driven by the WorkPool instead. `lock` guards it
+    between the scheduler and the threads settling finished tasks.
+    """
+    def __init__(self, engine, weight=1.0, max_workers=None, policy="critical_path"):
+        self.engine = engine
+        self.weight = weight
+        self.max_workers = max_workers or engine.estimate_max_workers()
+        self.policy = policy
+        self.result = Future()
+        self.indegree = None
+        self.ready = None
+        self.blocked = set()
+        self.any_failed = False
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.indegree, self.blocked, self.any_failed = self.engine._begin_run()
+        self.ready = self.engine._ready_queue(self.indegree, self.policy)
+
+    def wants_slot(self):
+        return (bool(self.ready) and len(self.inflight) < self.max_workers
+                and self.engine.gate.can_submit())
+
+    def share(self):
+        return (len(self.inflight) + 1) / self.weight
+
+    def take(self):
+        return self.engine._admit_ready(self.ready, self.blocked, limit=1)
+
+    def complete(self, fut):
+        tid, lease = self.inflight.pop(fut)
+        error = fut.exception()
+        self.engine._release_lanes(lease, ok=error is None)
+        outputs = fut.result() if error is None else None
+        if not self.engine._settle_task(tid, outputs, error, self.indegree, self.ready, self.blocked):
+            self.any_failed = True
+
+    def held(self):
+        return bool(self.ready) and not self.engine.gate.can_submit()
+
+    def finished(self):
+        return not self.inflight and not self.ready
+
+    def finish(self):
+        self.engine._end_run(self.any_failed)
+
+
+class WorkPool:
+    """
+    One bounded executor shared by every workflow submitted to it. At most
+    `max_workers` tasks run at once across all workflows. Each free slot
+    goes to the admitted workflow with the smallest weighted share (running
+    tasks / weight), and no workflow runs more than its own max_workers.
+    Admitted workflows also share one set of execution lanes, so the SHELL
+    lane bounds CPU-bound work for the whole process. Up to `max_active`
+    workflows are admitted; the rest wait in FIFO order with status QUEUED.
+    Finished runs are dropped as soon as they end.
+
+    `cond` only guards the pool's bookkeeping. Starting and finishing a
+    run talk to the backend, so each happens on a thread of its own while
+    the run is listed in `starting` or `ending`.
+    """
+    def __init__(self, max_workers=None, max_active=MAX_ACTIVE_WORKFLOWS, lanes=None):
+        self.max_workers = max_workers or (os.cpu_count() or 1) * 5
+        self.max_active = max_active
+        self.lanes = lanes or Lanes(max_workers=self.max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix="workpool")
+        self.active = {}
+        self.starting = {}
+        self.ending = {}
+        self.waiting = deque()
+        self.running = 0
+        self.changed = False
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def submit(self, engine, weight=1.0, max_workers=None, policy="critical_path"):
+        """
+        Queue a run of `engine`. Returns a Future for its results.
+        """
+        run = WorkflowRun(engine, weight, max_workers, policy)
+        with self.cond:
+            if self.is_running(engine.wf_key):
+                raise RuntimeError(f"Workflow {engine.wf_key} is already running")
+            queued = self._admitted() + len(self.waiting) >= self.max_active
+            self.waiting.append(run)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="workpool", daemon=True)
+                self.thread.start()
+            self._wake()
+        if queued:
+            logger.info(f"Workflow {engine.wf_key} queued, {self.max_active} workflows active")
+            set_workflow_status(engine.wf_key, "QUEUED")
+        return run.result
+
+    def is_running(self, wf_key):
+        """
+        Whether a run of `wf_key` is active or queued.
+        """
+        with self.cond:
+            return (wf_key in self.active or wf_key in self.starting or wf_key in self.ending
+                    or any(w.engine.wf_key == wf_key for w in self.waiting))
+
+    def stats(self):
+        with self.cond:
+            return {
+                "running": self.running,
+                "max_workers": self.max_workers,
+                "active": {wf: len(run.inflight) for wf, run in self.active.items()},
+                "waiting": [run.engine.wf_key for run in self.waiting],
+            }
+
+    def _admitted(self):
+        return len(self.active) + len(self.starting) + len(self.ending)
+
+    def _wake(self):
+        self.changed = True
+        self.cond.notify()
+
+    def _take_admissions(self):
+        starting = []
+        while self.waiting and self._admitted() < self.max_active:
+            run = self.waiting.popleft()
+            self.starting[run.engine.wf_key] = run
+            starting.append(run)
+        return starting
+
+    def _start(self, run):
+        wf_key = run.engine.wf_key
+        run.engine.lanes = self.lanes
+        try:
+            run.start()
+        except Exception as e:
+            logger.exception(f"Could not start workflow {wf_key}: {e}")
+            with self.cond:
+                del self.starting[wf_key]
+                self._wake()
+            run.result.set_exception(e)
+            return
+        with self.cond:
+            del self.starting[wf_key]
+            self.active[wf_key] = run
+            self._wake()
+
+    def _dispatch(self):
+        stalled = set()
+        while self.running < self.max_workers:
+            candidates = [run for run in self.active.values()
+                          if run not in stalled and run.wants_slot()]
+            if not candidates:
+                return
+            run = min(candidates, key=WorkflowRun.share)
+            # a thread settling one of its tasks holds the lock and wakes the loop after
+            if not run.lock.acquire(blocking=False):
+                stalled.add(run)
+                continue
+            try:
+                admitted = run.take()
+                if admitted:
+                    tid, lease = admitted[0]
+                    fut = self.executor.submit(run.engine._run_single_task, tid)
+                    run.inflight[fut] = (tid, lease)
+            finally:
+                run.lock.release()
+            if not admitted:
+                # lanes are full, or only blocked tasks were left
+                stalled.add(run)
+                continue
+            self.running += 1
+            fut.add_done_callback(lambda f, run=run: self._on_done(run, f))
+
+    def _on_done(self, run, fut):
+        with run.lock:
+            run.complete(fut)
+        with self.cond:
+            self.running -= 1
+            self._wake()
+
+    def _take_finished(self):
+        ending = []
+        for wf_key, run in list(self.active.items()):
+            if not run.lock.acquire(blocking=False):
+                continue
+            try:
+                done = run.finished()
+            finally:
+                run.lock.release()
+            if done:
+                del self.active[wf_key]
+                self.ending[wf_key] = run
+                ending.append(run)
+        return ending
+
+    def _end(self, run):
+        wf_key = run.engine.wf_key
+        error = None
+        try:
+            run.finish()
+        except Exception as e:
+            logger.exception(f"Could not record the end of workflow {wf_key}: {e}")
+            error = e
+        # the key stays taken until the run's outcome is written
+        with self.cond:
+            del self.ending[wf_key]
+            self._wake()
+            active = len(self.active)
+        if error is None:
+            run.result.set_result(run.engine.results)
+        else:
+            run.result.set_exception(error)
+        logger.info(f"Workflow {wf_key} finished, {active} active")
+
+    def _loop(self):
+        held = False
+        while True:
+            with self.cond:
+                # nothing signals a resume locally, so poll while a run is held
+                self.cond.wait_for(lambda: self.changed, GATE_POLL_INTERVAL if held else None)
+                self.changed = False
+                starting = self._take_admissions()
+            for run in starting:
+                threading.Thread(target=self._start, args=(run,), daemon=True).start()
+            held = False
+            drained, ending = [], []
+            with self.cond:
+                try:
+                    self._dispatch()
+                    for run in self.active.values():
+                        if run.held():
+                            held = True
+                            if not run.inflight:
+                                drained.append(run)
+                    ending = self._take_finished()
+                except Exception as e:
+                    logger.exception(f"Work pool scheduling failed: {e}")
+                    held = True
+            for run in drained:
+                run.engine._settle_drain()
+            for run in ending:
+                threading.Thread(target=self._end, args=(run,), daemon=True).start()
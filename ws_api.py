@@ -4,11 +4,14 @@ import logging
 from threading import Thread
 import os
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from redis.asyncio import Redis
 
-from engine import WorkflowEngine
+from backend import async_client
+from engine import WorkflowEngine, workflow_key, check_run_mode
+from fanout import ClientFeed, EventHub
+from workpool import WorkPool
 from logging_config import setup_logging
 
 app = FastAPI(
@@ -25,124 +28,273 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-redis_client: Redis
+redis_client = None
+hub: EventHub
 engines: dict[str, WorkflowEngine] = {}
+background_runs: set[asyncio.Task] = set()
+# workflows with a run in progress, in any mode
+active_runs: set[str] = set()
+
+workpool = WorkPool()
+run_generation: dict[str, int] = {}
+ENGINE_TTL = 300
+
+def launch_run(engine: WorkflowEngine, mode: str | None = None, weight: float = 1.0):
+    loop = asyncio.get_running_loop()
+    wf_id = engine.wf_key
+    generation = run_generation[wf_id] = run_generation.get(wf_id, 0) + 1
+    active_runs.add(wf_id)
+
+    def finished(_=None):
+        loop.call_soon_threadsafe(active_runs.discard, wf_id)
+        # keep the engine for workflow_output and RESTART a while longer
+        loop.call_soon_threadsafe(loop.call_later, ENGINE_TTL, evict_engine, wf_id, generation)
+
+    if mode == "async":
+        task = asyncio.create_task(engine.run_async())
+        background_runs.add(task)
+        task.add_done_callback(background_runs.discard)
+        task.add_done_callback(finished)
+    elif mode == "distributed":
+        def run_distributed():
+            try:
+                engine.run_distributed()
+            finally:
+                finished()
+        Thread(target=run_distributed, daemon=True).start()
+    else:
+        try:
+            workpool.submit(engine, weight=weight).add_done_callback(finished)
+        except RuntimeError:
+            active_runs.discard(wf_id)
+            raise
+
+def run_active(wf_id: str):
+    return wf_id in active_runs or workpool.is_running(wf_id)
+
+async def reject_running(websocket: WebSocket, wf_id: str):
+    """
+    Sends an error frame and returns True if `wf_id` already has a run in
+    progress; starting another would reset its state under it.
+    """
+    if not run_active(wf_id):
+        return False
+    await websocket.send_json({"type": "error", "workflow_id": wf_id,
+                               "message": f"Workflow {wf_id} is already running"})
+    return True
+
+def evict_engine(wf_id: str, generation: int):
+    if run_generation.get(wf_id) == generation:
+        engines.pop(wf_id, None)
+        run_generation.pop(wf_id, None)
+
+def unbatch_event(data):
+    """
+    Expand bulk events from store.py into the per-node frames that clients
+    which did not opt into "batched": true expect.
+    """
+    typ = data.get("type")
+    if typ == "NODE_UPDATE_BATCH":
+        return [
+            {"type": "NODE_UPDATE", "nodeId": u["nodeId"], "status": u["status"]}
+            for u in data["updates"]
+        ]
+    if typ == "WORKFLOW_SNAPSHOT":
+        frames = [{"type": "workflow_update", "status": data["status"]}]
+        frames += [
+            {"type": "NODE_UPDATE", "nodeId": tid, "status": status}
+            for tid, status in data["nodes"].items()
+        ]
+        return frames
+    return [data]
 
 @app.on_event("startup")
 async def startup_event():
-    global redis_client
+    global redis_client, hub
     log_file = "logs/workflow.log"
     if os.path.exists(log_file):
         open(log_file, "w").close()
     setup_logging(log_file="logs/workflow.log")
     logging.getLogger("uvicorn").info("Logging initialized, writing to logs/workflow.log")
-    redis_client = Redis(host="localhost", port=6379, db=0, decode_responses=True)
+    redis_client = async_client()
+    hub = EventHub(redis_client)
+
+def render_dag(engine: WorkflowEngine):
+    def report(fut):
+        if fut.exception() is not None:
+            logging.getLogger("uvicorn").warning(f"DAG render for {engine.wf_key} failed: {fut.exception()}")
+    engine.export_dag_async().add_done_callback(report)
+
+@app.get("/workflows/{wf_id}/graph")
+async def workflow_graph(wf_id: str):
+    engine = engines.get(wf_id)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Unknown workflow")
+    return engine.graph()
+
+@app.get("/workflows/{wf_id}/graph.png")
+async def workflow_graph_png(wf_id: str):
+    engine = engines.get(wf_id)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Unknown workflow")
+    try:
+        png_path = await asyncio.wrap_future(engine.export_dag_async())
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"DAG render failed: {e}")
+    return FileResponse(png_path, media_type="image/png")
+
+async def send_events(websocket: WebSocket, wf_id: str, client: ClientFeed):
+    try:
+        while True:
+            for payload, data in await client.next_events():
+                if client.batched:
+                    await websocket.send_text(payload or json.dumps(data))
+                else:
+                    for frame in unbatch_event(data):
+                        await websocket.send_json(frame)
+                if data.get("type") == "workflow_update" and data.get("status") == "COMPLETED":
+                    engine = engines.get(wf_id)
+                    if engine:
+                        leaf_tasks = engine.dag.leaves()
+                        final_outputs = {
+                            tid: engine.results.get(tid)
+                            for tid in leaf_tasks
+                        }
+                        await websocket.send_json({
+                            "type": "workflow_output",
+                            "outputs": final_outputs
+                        })
+    except WebSocketDisconnect:
+        pass
 
 @app.websocket("/ws")
 async def workflow_ws(websocket: WebSocket):
     await websocket.accept()
     wf_id = None
-    pubsub = None
+    client = None
+    sender = None
+    run_mode = None
+
+    async def watch(new_wf_id, msg):
+        nonlocal wf_id, client, sender
+        if sender:
+            sender.cancel()
+            hub.detach(wf_id, client)
+        wf_id = new_wf_id
+        client = ClientFeed(
+            batched=bool(msg.get("batched", False)),
+            coalesce=bool(msg.get("coalesce", False)),
+        )
+        await hub.attach(wf_id, client)
+        sender = asyncio.create_task(send_events(websocket, wf_id, client))
 
     try:
         while True:
-            ws_task = asyncio.create_task(websocket.receive_text())
-            ps_task = None
-            if pubsub:
-                ps_task = asyncio.create_task(pubsub.get_message(ignore_subscribe_messages=True))
-
-            done, pending = await asyncio.wait(
-                [t for t in (ws_task, ps_task) if t],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
-
-            if ws_task in done:
-                text = ws_task.result()
-                msg = json.loads(text)
-                typ = msg.get("type")
-
-                # start workflow
-                if typ == "START":
-                    # logging.getLogger("uvicorn").info(msg)
-                    wf_data = msg["workflow"]
-                    wf_json = wf_data
-                    if isinstance(wf_data, str):
-                        wf_json = json.loads(wf_data)
-                    engine = WorkflowEngine(wf_json)
-                    engine.export_dag()
-                    wf_id = engine.wf_key
-                    engines[wf_id] = engine
-
-                    pubsub = redis_client.pubsub()
-                    await pubsub.subscribe(f"wf:{wf_id}:events")
-
-                    max_workers = engine.estimate_max_workers()
-                    Thread(
-                        target=lambda: engine.run_parallel(max_workers=max_workers),
-                        daemon=True
-                    ).start()
+            msg = json.loads(await websocket.receive_text())
+            typ = msg.get("type")
+
+            # start workflow
+            if typ == "START":
+                # logging.getLogger("uvicorn").info(msg)
+                wf_data = msg["workflow"]
+                wf_json = wf_data
+                if isinstance(wf_data, str):
+                    wf_json = json.loads(wf_data)
+                if await reject_running(websocket, workflow_key(wf_json)):
+                    continue
+                try:
+                    check_run_mode(wf_json, msg.get("mode"))
+                except ValueError as e:
+                    await websocket.send_json({"type": "error", "workflow_id": workflow_key(wf_json),
+                                               "message": str(e)})
+                    continue
+                engine = WorkflowEngine(wf_json)
+                # claim the key before awaiting, so a concurrent START is rejected
+                active_runs.add(engine.wf_key)
+                try:
+                    render_dag(engine)
+                    engines[engine.wf_key] = engine
+
+                    await watch(engine.wf_key, msg)
+                    run_mode = msg.get("mode")
+                    launch_run(engine, run_mode, float(msg.get("weight", 1.0)))
+                except BaseException:
+                    active_runs.discard(engine.wf_key)
+                    raise
+
+                await websocket.send_json({
+                    "type": "workflow_started",
+                    "workflow_id": wf_id
+                })
 
+            # follow a workflow started elsewhere
+            elif typ == "WATCH":
+                await watch(msg["workflow_id"], msg)
+                await websocket.send_json({
+                    "type": "WATCH_ack",
+                    "workflow_id": wf_id
+                })
+
+            # continue a run interrupted by a server restart
+            elif typ == "RECOVER":
+                if await reject_running(websocket, msg["workflow_id"]):
+                    continue
+                try:
+                    engine = WorkflowEngine.from_checkpoint(msg["workflow_id"])
+                    check_run_mode(engine.workflow_json, msg.get("mode"))
+                except ValueError as e:
+                    await websocket.send_json({"type": "error", "message": str(e)})
+                    continue
+                active_runs.add(engine.wf_key)
+                try:
+                    render_dag(engine)
+                    engines[engine.wf_key] = engine
+
+                    await watch(engine.wf_key, msg)
+                    run_mode = msg.get("mode")
+                    launch_run(engine, run_mode, float(msg.get("weight", 1.0)))
+                except BaseException:
+                    active_runs.discard(engine.wf_key)
+                    raise
+                await websocket.send_json({
+                    "type": "RECOVER_ack",
+                    "workflow_id": wf_id
+                })
+
+            # pause/drain/resume/restart
+            elif typ in ("PAUSE", "DRAIN", "RESUME", "RESTART"):
+                if not wf_id or wf_id not in engines:
                     await websocket.send_json({
-                        "type": "workflow_started",
-                        "workflow_id": wf_id
+                        "type": "error",
+                        "message": "No active workflow"
                     })
-
-                # pause/resume/restart
-                elif typ in ("PAUSE", "RESUME", "RESTART"):
-                    if not wf_id or wf_id not in engines:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": "No active workflow"
-                        })
-                    else:
-                        engine = engines[wf_id]
-                        if typ == "PAUSE":
-                            engine.pause()
-                        elif typ == "RESUME":
-                            engine.resume()
-                        elif typ == "RESTART":
-                            from_task = msg.get("from_task")
+                else:
+                    engine = engines[wf_id]
+                    if typ == "PAUSE":
+                        engine.pause()
+                    elif typ == "DRAIN":
+                        engine.drain()
+                    elif typ == "RESUME":
+                        engine.resume()
+                    elif typ == "RESTART":
+                        from_task = msg.get("from_task")
+                        if await reject_running(websocket, wf_id):
+                            continue
+                        try:
                             engine.restart(from_task)
-                            max_workers = engine.estimate_max_workers()
-                            Thread(
-                                target=lambda: engine.run_parallel(max_workers=max_workers),
-                                daemon=True
-                            ).start()
+                            launch_run(engine, msg.get("mode", run_mode), float(msg.get("weight", 1.0)))
+                        except (RuntimeError, ValueError) as e:
+                            await websocket.send_json({"type": "error", "message": str(e)})
+                            continue
 
-                        await websocket.send_json({
-                            "type": f"{typ}_ack",
-                            "workflow_id": wf_id
-                        })
-                if ps_task:
-                    ps_task.cancel()
-
-            elif ps_task in done:
-                event = ps_task.result()
-                # {"type":"message","pattern":None,"channel":"...","data":"..."}
-                if event and event.get("data"):
-                    payload = event["data"]
-                    await websocket.send_text(payload)
-                    try:
-                        data = json.loads(payload)
-                    except json.JSONDecodeError:
-                        data = {}
-                    if data.get("type") == "workflow_update" and data.get("status") == "COMPLETED":
-                        engine = engines.get(wf_id)
-                        if engine:
-                            leaf_tasks = [tid for tid, children in engine.dag.items() if not children]
-                            final_outputs = {
-                                tid: engine.results.get(tid)
-                                for tid in leaf_tasks
-                            }
-                            await websocket.send_json({
-                                "type": "workflow_output",
-                                "outputs": final_outputs
-                            })
-                ws_task.cancel()
-
-            for task in pending:
-                task.cancel()
+                    await websocket.send_json({
+                        "type": f"{typ}_ack",
+                        "workflow_id": wf_id
+                    })
 
     except WebSocketDisconnect:
-        if pubsub and wf_id:
-            await pubsub.unsubscribe(f"wf:{wf_id}:events")
+        pass
+    finally:
+        if sender:
+            sender.cancel()
+            hub.detach(wf_id, client)